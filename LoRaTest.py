@@ -27,9 +27,10 @@ def main():
     print(f" - APP_EUI: {APP_EUI}")
     print(f" - APP_KEY: {APP_KEY}")
 
-    # インスタンス作成
+    # インスタンス作成 (引数でポートを指定可能: 例 python LoRaTest.py /dev/pts/3)
+    port = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyS0'
     try:
-        lora = LoRaCommunicator(port='/dev/ttyS0')
+        lora = LoRaCommunicator(port=port)
         print("Serial port opened successfully.")
     except Exception as e:
         print(f"Failed to open serial port: {e}")
@@ -77,9 +78,8 @@ def main():
                     print("Result: Sent Command Accepted")
                     # 送信直後に自動で受信チェックも行うと便利
                     print("Checking for response...")
-                    # Class Aの受信ウィンドウ待ち (少し待ってから確認)
-                    import time
-                    time.sleep(2)
+                    # Class Aの受信ウィンドウ待ち (通知が来れば即座に確認)
+                    lora.wait_downlink(2)
                     data = lora.receive_data()
                     if data:
                         print(f"Received: {data}")
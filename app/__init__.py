@@ -1,6 +1,50 @@
-from .camera import Camera
-from .detector import YoloDetector
-from .logger_handler import LoggerHandler
-from .lora_serial import LoRaCommunicator
-from .config_loader import ConfigManager
-from .system_initializer import SystemInitializer
\ No newline at end of file
+"""
+各クラスは最初に使われたときにモジュールごと読み込む
+(起動時に cv2 / numpy / tflite_runtime などをまとめて読み込まず、使わない機能の分は読み込まない)
+"""
+import importlib
+
+_EXPORTS = {
+    "Camera": ".camera",
+    "CameraBackend": ".camera",
+    "ReplayCamera": ".camera",
+    "fit_lores_size": ".camera",
+    "YoloDetector": ".detector",
+    "DetectorManager": ".detector_manager",
+    "ModelSpec": ".detector_manager",
+    "LoggerHandler": ".logger_handler",
+    "LoRaCommunicator": ".lora_serial",
+    "LinkAdapter": ".link_adapter",
+    "LinkPolicy": ".link_adapter",
+    "LinkStats": ".link_adapter",
+    "ConfigManager": ".config_loader",
+    "ConfigWatcher": ".config_watcher",
+    "SystemInitializer": ".system_initializer",
+    "YoloDecoder": ".yolo_decoder",
+    "LetterboxPreprocessor": ".preprocessor",
+    "Pipeline": ".pipeline",
+    "PayloadCodec": ".payload_codec",
+    "WindowAggregator": ".payload_codec",
+    "UplinkScheduler": ".uplink_scheduler",
+    "Outbox": ".outbox",
+    "TimeSeriesStore": ".timeseries_store",
+    "MotionGate": ".motion_gate",
+    "MultiObjectTracker": ".tracker",
+    "SamplingScheduler": ".sampling_scheduler",
+    "MetricsExporter": ".metrics",
+    "MetricsRegistry": ".metrics",
+    "FrameStore": ".web_monitor",
+    "SnapshotSaver": ".web_monitor",
+    "WebMonitor": ".web_monitor",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
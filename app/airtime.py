@@ -0,0 +1,48 @@
+import math
+
+# LoRaWANのフレームオーバーヘッド (MHDR 1 + FHDR 7 + FPort 1 + MIC 4)
+LORAWAN_OVERHEAD = 13
+
+# AS923 のデータレート -> (拡散率, 帯域幅[Hz])
+AS923_DATA_RATES = {
+    0: (12, 125000),
+    1: (11, 125000),
+    2: (10, 125000),
+    3: (9, 125000),
+    4: (8, 125000),
+    5: (7, 125000),
+    6: (7, 250000),
+}
+
+
+def time_on_air(phy_payload_len, sf, bw=125000, cr=1, preamble=8, explicit_header=True, crc=True,
+                low_dr_optimize=None):
+    """
+    LoRa変調の送信時間 (Semtech AN1200.13 の式)
+    :param phy_payload_len: PHYペイロード長 [byte]
+    :param sf: 拡散率 (7-12)
+    :param bw: 帯域幅 [Hz]
+    :param cr: 符号化率 1=4/5 ... 4=4/8
+    :param low_dr_optimize: Noneなら シンボル長16ms超で自動的に有効
+    :return: 送信時間 [秒]
+    """
+    t_sym = (2 ** sf) / bw
+    if low_dr_optimize is None:
+        low_dr_optimize = t_sym > 0.016
+    de = 1 if low_dr_optimize else 0
+    ih = 0 if explicit_header else 1
+
+    t_preamble = (preamble + 4.25) * t_sym
+    numerator = 8 * phy_payload_len - 4 * sf + 28 + (16 if crc else 0) - 20 * ih
+    n_payload = 8 + max(math.ceil(numerator / (4 * (sf - 2 * de))) * (cr + 4), 0)
+    return t_preamble + n_payload * t_sym
+
+
+def lorawan_time_on_air(app_payload_len, data_rate=None, sf=None, bw=125000):
+    """
+    アプリケーションペイロード長からLoRaWANフレームの送信時間を求める
+    :param data_rate: AS923のデータレート番号 (指定時は sf, bw より優先)
+    """
+    if data_rate is not None:
+        sf, bw = AS923_DATA_RATES[data_rate]
+    return time_on_air(app_payload_len + LORAWAN_OVERHEAD, sf, bw)
@@ -0,0 +1,181 @@
+"""
+推論バックエンド
+
+YoloDetector は tflite_runtime のインタプリタのAPI
+(allocate_tensors, get_input_details, get_output_details, tensor, invoke, get_tensor) で推論する。
+tflite 以外のバックエンドも同じAPIで包み、前処理 (LetterboxPreprocessor) とデコード・NMS (YoloDecoder) を共通にする。
+
+  - tflite:          tflite_runtime (XNNPACK デリゲートあり。tflite_runtime の既定)
+  - tflite-nodelegate: tflite_runtime (既定のデリゲートなし。組み込みカーネルだけで推論)
+  - opencv:          OpenCV DNN (.onnx または .tflite。tflite は OpenCV 4.8 以降)
+  - onnxruntime:     ONNX Runtime (CPUExecutionProvider)
+
+tflite 以外は float のモデル (ultralytics の .onnx 書き出しなど) を想定し、
+入力 (1, H, W, 3) float32 [0-1]・出力 (1, 4+クラス数, 候補数) float32 として見せる。
+ultralytics から書き出した .onnx はボックスが入力画素単位なので、tflite と同じ正規化座標に直して返す。
+"""
+import abc
+
+import numpy as np
+
+BACKENDS = ("tflite", "tflite-nodelegate", "opencv", "onnxruntime")
+
+INPUT_INDEX = 0
+OUTPUT_INDEX = 1
+
+
+def available_backends():
+    """この環境で使えるバックエンド名"""
+    names = []
+    try:
+        import tflite_runtime.interpreter  # noqa: F401
+        names += ["tflite", "tflite-nodelegate"]
+    except ImportError:
+        pass
+    try:
+        import cv2
+        if hasattr(cv2, "dnn"):
+            names.append("opencv")
+    except ImportError:
+        pass
+    try:
+        import onnxruntime  # noqa: F401
+        names.append("onnxruntime")
+    except ImportError:
+        pass
+    return names
+
+
+def create_interpreter(model_path, backend="tflite", num_threads=4, input_size=None):
+    """
+    バックエンドを作る
+    :param backend: BACKENDS のいずれか
+    :param input_size: 入力サイズ (Width, Height)。opencv で使う (None なら .onnx のグラフから読み取り、
+                       読み取れなければ 640x640)
+    :return: tflite のインタプリタと同じAPIのオブジェクト
+    """
+    if backend in ("tflite", "tflite-nodelegate"):
+        import tflite_runtime.interpreter as tflite
+        if backend == "tflite":
+            return tflite.Interpreter(model_path=model_path, num_threads=num_threads)
+        return tflite.Interpreter(
+            model_path=model_path, num_threads=num_threads,
+            experimental_op_resolver_type=tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+    if backend == "opencv":
+        return OpenCVBackend(model_path, num_threads=num_threads, input_size=input_size)
+    if backend == "onnxruntime":
+        return OnnxRuntimeBackend(model_path, num_threads=num_threads)
+    raise ValueError(f"Unknown backend: {backend} (choose from {BACKENDS})")
+
+
+def onnx_input_size(model_path):
+    """
+    .onnx のグラフから入力サイズ (Width, Height) を読み取る
+    :return: onnx パッケージがない・サイズが可変なら None
+    """
+    try:
+        import onnx
+    except ImportError:
+        return None
+    try:
+        model = onnx.load(model_path, load_external_data=False)
+        dims = model.graph.input[0].type.tensor_type.shape.dim  # NCHW
+        height, width = dims[2].dim_value, dims[3].dim_value
+    except Exception as e:
+        print(f"[Backend] Cannot read the input size of {model_path}: {e}")
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+
+class _FloatBackend(abc.ABC):
+    """NCHW float32 入力のモデルを tflite のインタプリタと同じAPIで見せる共通部分"""
+
+    def __init__(self, input_size, pixel_boxes):
+        """
+        :param input_size: 入力サイズ (Width, Height)
+        :param pixel_boxes: 出力のボックスが入力画素単位なら True (正規化座標に直す)
+        """
+        width, height = input_size
+        self._input = np.zeros((1, height, width, 3), dtype=np.float32)
+        self._output = None
+        self._box_scale = np.array([width, height, width, height], dtype=np.float32).reshape(4, 1) \
+            if pixel_boxes else None
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{"index": INPUT_INDEX, "shape": np.array(self._input.shape), "dtype": np.float32,
+                 "quantization": (0.0, 0)}]
+
+    def get_output_details(self):
+        # 出力の形は最初の推論まで分からないので、形は使わない前提で型と量子化だけ返す
+        return [{"index": OUTPUT_INDEX, "shape": np.array(self._output.shape if self._output is not None else ()),
+                 "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def tensor(self, index):
+        return lambda: self._input
+
+    def set_tensor(self, index, value):
+        self._input[...] = value
+
+    def invoke(self):
+        output = np.asarray(self._run(np.ascontiguousarray(self._input.transpose(0, 3, 1, 2))), dtype=np.float32)
+        if output.ndim == 2:
+            output = output[np.newaxis]
+        if self._box_scale is not None:
+            output = output.copy()
+            output[0, :4] /= self._box_scale
+        self._output = output
+
+    def get_tensor(self, index):
+        return self._output if index == OUTPUT_INDEX else self._input
+
+    @abc.abstractmethod
+    def _run(self, blob):
+        """
+        :param blob: (1, 3, H, W) float32
+        :return: (1, 4+クラス数, 候補数) または (4+クラス数, 候補数)
+        """
+
+
+class OpenCVBackend(_FloatBackend):
+    def __init__(self, model_path, num_threads=4, input_size=None):
+        import cv2
+        cv2.setNumThreads(num_threads)
+        if model_path.endswith(".tflite"):
+            self._net = cv2.dnn.readNetFromTFLite(model_path)
+        else:
+            self._net = cv2.dnn.readNet(model_path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # OpenCV DNN からは入力サイズが分からないので、指定がなければ .onnx のグラフから読む
+        if input_size is None and model_path.endswith(".onnx"):
+            input_size = onnx_input_size(model_path)
+        if input_size is None:
+            print(f"[Backend] Input size of {model_path} is unknown. Assuming 640x640")
+        super().__init__(tuple(input_size) if input_size else (640, 640), pixel_boxes=model_path.endswith(".onnx"))
+
+    def _run(self, blob):
+        self._net.setInput(blob)
+        return self._net.forward()
+
+
+class OnnxRuntimeBackend(_FloatBackend):
+    def __init__(self, model_path, num_threads=4):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(model_path, sess_options=options,
+                                             providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        _, _, height, width = model_input.shape  # NCHW
+        if not isinstance(width, int) or not isinstance(height, int):
+            # 入力サイズが可変のモデルは ultralytics の既定に合わせる
+            width, height = 640, 640
+        super().__init__((width, height), pixel_boxes=True)
+
+    def _run(self, blob):
+        return self._session.run(None, {self._input_name: blob})[0]
@@ -1,33 +1,214 @@
+import abc
+import os
 import time
-from picamera2 import Picamera2
+import cv2
 
-class Camera:
-    def __init__(self, width=1280, height=720, focus_val=0.0):
+from .metrics import metrics
+
+
+def fit_lores_size(main_size, input_size, align=64):
+    """
+    推論用の低解像度ストリームの大きさを決める
+    フル解像度の縦横比を保ったまま、モデル入力 (Width, Height) に収まる最大の大きさにする
+    (Letterbox時にCPUでのリサイズが不要になる)
+    :param align: 幅をこの倍数に丸める (ISPの行アライメント)
+    """
+    mw, mh = main_size
+    iw, ih = input_size
+    scale = min(iw / mw, ih / mh, 1.0)
+    width = max(align, int(mw * scale) // align * align)
+    height = int(round(width * mh / mw / 2)) * 2
+    return width, height
+
+
+class CameraBackend(abc.ABC):
+    """
+    カメラ・再生ソース共通のインターフェース
+
+    推論用の低解像度画像 (lores) と、スナップショット保存用のフル解像度画像 (main) を
+    同じフレームから取り出せる。main は必要なときだけ取得する。
+    """
+
+    def __init__(self, width=1280, height=720, lores_size=None):
+        """
+        :param width, height: フル解像度 (main)
+        :param lores_size: 推論用の解像度 (Width, Height)。None なら main をそのまま使う
+        """
         self.width = width
         self.height = height
+        self.lores_size = tuple(lores_size) if lores_size else None
+
+    @property
+    def main_size(self):
+        return self.width, self.height
+
+    @property
+    def lores_scale(self):
+        """lores 座標 -> main 座標の倍率 (sx, sy)"""
+        if not self.lores_size:
+            return 1.0, 1.0
+        return self.width / self.lores_size[0], self.height / self.lores_size[1]
+
+    @abc.abstractmethod
+    def capture_frames(self, main=False):
+        """
+        :param main: フル解像度画像も取得する
+        :return: (推論用画像, フル解像度画像 or None)。どちらもBGR。終端では (None, None)
+        """
+
+    def capture(self):
+        """フル解像度の画像をnumpy配列(BGR)で返す"""
+        _, frame = self.capture_frames(main=True)
+        return frame
+
+    def to_main_coords(self, results):
+        """推論用画像上の検出結果の座標をフル解像度の座標に直す (新しいリストを返す)"""
+        sx, sy = self.lores_scale
+        if sx == 1.0 and sy == 1.0:
+            return results
+        scaled = []
+        for res in results:
+            left, top, width, height = res["box"]
+            scaled.append(dict(res, box=[int(left * sx), int(top * sy), int(width * sx), int(height * sy)]))
+        return scaled
+
+    def set_focus(self, focus_val):
+        """フォーカス位置を変更する (固定焦点のソースでは何もしない)"""
+        pass
+
+    def stop(self):
+        pass
+
+
+class Camera(CameraBackend):
+    def __init__(self, width=1280, height=720, focus_val=0.0, lores_size=None):
+        """
+        :param lores_size: 推論用の低解像度ストリームの大きさ。ISPで縮小されるためCPUでのリサイズが不要になる
+        """
+        super().__init__(width, height, lores_size)
         self.focus_val = focus_val
         self.picam2 = None
         self._initialize()
 
     def _initialize(self):
+        from picamera2 import Picamera2
         self.picam2 = Picamera2()
-        config = self.picam2.create_video_configuration(
-            main={"size": (self.width, self.height), "format": "RGB888"}
-        )
+        streams = {"main": {"size": (self.width, self.height), "format": "RGB888"}}
+        if self.lores_size:
+            # Pi Zero 2 W (VC4) の lores は YUV420 のみ
+            streams["lores"] = {"size": self.lores_size, "format": "YUV420"}
+        config = self.picam2.create_video_configuration(**streams)
         self.picam2.configure(config)
+        if self.lores_size:
+            # アライメントで調整された実際の大きさ
+            self.lores_size = tuple(self.picam2.camera_configuration()["lores"]["size"])
         self.picam2.start()
-        
+
         # フォーカス固定設定
         self.picam2.set_controls({
             "AfMode": 0,
             "LensPosition": self.focus_val
         })
         print(f"Camera initialized with Manual Focus: {self.focus_val}")
+        if self.lores_size:
+            print(f"Inference stream (lores): {self.lores_size[0]}x{self.lores_size[1]}")
 
-    def capture(self):
-        """画像を撮影してnumpy配列(BGR)で返す"""
-        return self.picam2.capture_array()
+    def capture_frames(self, main=False):
+        with metrics.timer("camera_capture"):
+            if not self.lores_size:
+                frame = self.picam2.capture_array("main")
+                return frame, (frame if main else None)
+
+            # 同じフレームの lores と main を取り出す (main は必要なときだけ配列にする)
+            request = self.picam2.capture_request()
+            try:
+                lores = cv2.cvtColor(request.make_array("lores"), cv2.COLOR_YUV2BGR_I420)
+                frame = request.make_array("main") if main else None
+            finally:
+                request.release()
+            return lores, frame
+
+    def set_focus(self, focus_val):
+        self.focus_val = focus_val
+        self.picam2.set_controls({"LensPosition": focus_val})
+        print(f"Camera focus changed: {focus_val}")
 
     def stop(self):
         if self.picam2:
-            self.picam2.stop()
\ No newline at end of file
+            self.picam2.stop()
+
+
+class ReplayCamera(CameraBackend):
+    """
+    画像ディレクトリまたは動画ファイルを Camera と同じインターフェースで再生する
+    実機カメラなしでの動作確認・ベンチマーク用
+    """
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, source, width=None, height=None, loop=True, lores_size=None):
+        """
+        :param source: 画像ディレクトリまたは動画ファイルのパス
+        :param width, height: 指定すると出力フレームをこのサイズにリサイズする
+        :param loop: 最後まで再生したら先頭に戻る
+        :param lores_size: 推論用画像の大きさ (ISPの代わりにCPUで縮小する)
+        """
+        super().__init__(width, height, lores_size)
+        self.source = source
+        self.loop = loop
+        self.frames_read = 0
+        self._files = None
+        self._index = 0
+        self._video = None
+
+        if os.path.isdir(source):
+            self._files = sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.lower().endswith(self.IMAGE_EXTENSIONS)
+            )
+            if not self._files:
+                raise ValueError(f"No images found in {source}")
+        else:
+            self._video = cv2.VideoCapture(source)
+            if not self._video.isOpened():
+                raise ValueError(f"Could not open video: {source}")
+        print(f"Replay camera initialized from: {source}")
+
+    def _read(self):
+        if self._files is not None:
+            if self._index >= len(self._files):
+                if not self.loop:
+                    return None
+                self._index = 0
+            frame = cv2.imread(self._files[self._index])
+            self._index += 1
+            return frame
+
+        ok, frame = self._video.read()
+        if not ok and self.loop:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._video.read()
+        return frame if ok else None
+
+    def capture_frames(self, main=False):
+        """終端 (loop=False) では (None, None)"""
+        with metrics.timer("camera_capture"):
+            return self._capture_frames(main)
+
+    def _capture_frames(self, main):
+        frame = self._read()
+        if frame is None:
+            return None, None
+        if self.width and self.height and frame.shape[:2] != (self.height, self.width):
+            frame = cv2.resize(frame, (self.width, self.height))
+        elif not (self.width and self.height):
+            self.height, self.width = frame.shape[:2]
+        self.frames_read += 1
+
+        if not self.lores_size:
+            return frame, (frame if main else None)
+        lores = cv2.resize(frame, self.lores_size, interpolation=cv2.INTER_AREA)
+        return lores, (frame if main else None)
+
+    def stop(self):
+        if self._video is not None:
+            self._video.release()
@@ -1,31 +1,107 @@
 import json
 import os
 import sys
-from box import Box
 
 class ConfigManager:
     CONFIG_PATH = "/boot/firmware/config.json"
+    LAST_GOOD_PATH = "data/config.last_good.json"
+    # Join状態は config.json とは別に記録する (実行中に config.json を書き直すと、起動後の編集を上書きしてしまう)
+    JOIN_STATE_PATH = "data/lora_join.json"
 
     def __init__(self):
         self.config_data = {}
 
     def load(self):
+        """
+        設定ファイルを読み込んで検証する
+        壊れている・検証に通らない場合は、最後に正常だった設定 (LAST_GOOD_PATH) があればそれを使う
+        """
         try:
             if os.path.exists(self.CONFIG_PATH):
                 print(f"Config file found at: {self.CONFIG_PATH}")
                 with open(self.CONFIG_PATH, 'r') as f:
-                    self.config_data = json.load(f)
-                    print("Config file correctly Loaded !")
+                    data = json.load(f)
             else:
                 print(f"Config not found.")
                 return None
         
         except Exception as e:
             print(f"[Error] Failed to load config: {e}")
-            return None
+            data = None
 
+        errors = self.validate(data) if data is not None else ["not a valid JSON file"]
+        if errors:
+            print("[Error] Config validation failed:")
+            for error in errors:
+                print(f" - {error}")
+            last_good = self.load_last_good()
+            if last_good is not None:
+                print(f"Using the last good config: {self.LAST_GOOD_PATH}")
+                data = last_good
+            elif data is None:
+                return None
+            else:
+                print("No last good config. Continuing with the file as is.")
+        else:
+            self.save_last_good(data)
+
+        self.config_data = data
+        print("Config file correctly Loaded !")
         return self.config_data
 
+    @staticmethod
+    def validate(data):
+        """
+        スキーマ (app/config_schema.py) と項目間の関係を検証する
+        :return: エラーメッセージのリスト (問題なければ空)
+        """
+        errors = []
+        try:
+            import jsonschema
+            from .config_schema import SCHEMA
+            validator = jsonschema.Draft7Validator(SCHEMA)
+            for error in sorted(validator.iter_errors(data), key=lambda e: list(e.path)):
+                location = ".".join(str(p) for p in error.path) or "(root)"
+                errors.append(f"{location}: {error.message}")
+        except ImportError:
+            print("[Warning] jsonschema is not installed. Skipping schema validation.")
+            if not isinstance(data, dict):
+                return ["(root): config must be an object"]
+        if errors:
+            return errors
+
+        sampling = data.get("Sampling", {})
+        low, high = sampling.get("MinInterval"), sampling.get("MaxInterval")
+        if low is not None and high is not None and low > high:
+            errors.append("Sampling: MinInterval must not exceed MaxInterval")
+        if sampling.get("TempSoft", 70) >= sampling.get("TempHard", 80):
+            errors.append("Sampling: TempSoft must be lower than TempHard")
+        lora = data.get("LoRa", {})
+        if lora.get("JoinBackoff", 15) > lora.get("JoinBackoffMax", 600):
+            errors.append("LoRa: JoinBackoff must not exceed JoinBackoffMax")
+        link = data.get("Link", {})
+        if link.get("MinDataRate", 0) > link.get("MaxDataRate", 5):
+            errors.append("Link: MinDataRate must not exceed MaxDataRate")
+        return errors
+
+    def load_last_good(self):
+        try:
+            with open(self.LAST_GOOD_PATH, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_last_good(self, data):
+        """検証に通った設定を控えておく (次に壊れた設定が書かれたときに使う)"""
+        try:
+            os.makedirs(os.path.dirname(self.LAST_GOOD_PATH) or ".", exist_ok=True)
+            tmp = self.LAST_GOOD_PATH + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.LAST_GOOD_PATH)
+        except OSError as e:
+            print(f"[Warning] Failed to save last good config: {e}")
+
     def save(self):
         print(f"Saving config to: {self.CONFIG_PATH}")
         try:
@@ -36,6 +112,7 @@ class ConfigManager:
                 os.fsync(f.fileno())
             
             print("Config saved successfully.")
+            self.save_last_good(self.config_data)
             return True
         except Exception as e:
             print(f"[Error] Failed to save config: {e}")
@@ -49,7 +126,41 @@ class ConfigManager:
         self.config_data["Network"]["IsLatest"] = is_latest_value
         return self.save()
     
-    def update_lora_join_status(self, is_joined: int):
+    def is_joined(self):
+        """
+        前回のJoinが記録されているか
+        config.json の LoRa.IsJoined か、同じ DevEUI/AppEUI で JOIN_STATE_PATH に記録されたJoin
+        """
+        lora = self.config_data.get("LoRa", {})
+        if lora.get("IsJoined", 0):
+            return True
+        try:
+            with open(self.JOIN_STATE_PATH, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return bool(state.get("IsJoined", 0)) and state.get("DEVEUI") == lora.get("DEVEUI") \
+            and state.get("APPEUI") == lora.get("APPEUI")
 
-        self.config_data["LoRa"]["IsJoined"] = is_joined
-        return self.save()
\ No newline at end of file
+    def update_lora_join_status(self, is_joined: int, dev_eui=None, app_eui=None):
+        """
+        Join状態を JOIN_STATE_PATH に記録する (config.json は書き換えない)
+        鍵を変えたときに古い記録を使わないよう、Joinに使った DevEUI/AppEUI も一緒に記録する
+        :param dev_eui, app_eui: Joinに使った値 (None なら読み込んだ設定の値)
+        """
+        lora = self.config_data.get("LoRa", {})
+        state = {"IsJoined": is_joined,
+                 "DEVEUI": dev_eui if dev_eui is not None else lora.get("DEVEUI"),
+                 "APPEUI": app_eui if app_eui is not None else lora.get("APPEUI")}
+        try:
+            os.makedirs(os.path.dirname(self.JOIN_STATE_PATH) or ".", exist_ok=True)
+            tmp = self.JOIN_STATE_PATH + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(state, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.JOIN_STATE_PATH)
+            return True
+        except OSError as e:
+            print(f"[Error] Failed to save join state: {e}")
+            return False
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+config.json のスキーマ (JSON Schema draft-07)
+
+各セクションの型と範囲を定める。未知のキーは許可する (古い設定ファイルや手元のメモ用のキーで起動を止めない)。
+"""
+
+_FLAG = {"type": ["integer", "boolean"], "enum": [0, 1, True, False]}
+_POSITIVE = {"type": "number", "exclusiveMinimum": 0}
+_NON_NEGATIVE = {"type": "number", "minimum": 0}
+_OPTIONAL_POSITIVE = {"type": ["number", "null"], "exclusiveMinimum": 0}
+_RATIO = {"type": "number", "minimum": 0, "maximum": 1}
+_PORT = {"type": "integer", "minimum": 0, "maximum": 65535}
+_HEX = lambda length: {"type": "string", "pattern": f"^[0-9A-Fa-f]{{{length}}}$"}
+_CLASSES = {"type": "array", "items": {"type": ["string", "integer"]}}
+_POINT = {"type": "array", "items": _RATIO, "minItems": 2, "maxItems": 2}
+_BACKEND = {"enum": ["tflite", "tflite-nodelegate", "opencv", "onnxruntime"]}
+_RECT = {"type": "array", "items": _RATIO, "minItems": 4, "maxItems": 4}
+
+
+def _section(properties, required=()):
+    return {"type": "object", "properties": properties, "required": list(required)}
+
+
+SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "properties": {
+        "LoRa": _section({
+            "DEVEUI": _HEX(16),
+            "APPEUI": _HEX(16),
+            "APPKEY": _HEX(32),
+            "IsJoined": _FLAG,
+            "JoinBackoff": _POSITIVE,
+            "JoinBackoffMax": _POSITIVE,
+        }, required=("DEVEUI", "APPEUI", "APPKEY")),
+        "Camera": _section({
+            "Sensor": {"type": "string"},
+            "Focus": _NON_NEGATIVE,
+            "Lores": _FLAG,
+            "SnapshotInterval": _NON_NEGATIVE,
+        }),
+        "Network": _section({
+            "wifi_enabled": _FLAG,
+            "SSID": {"type": "string"},
+            "PASSWORD": {"type": "string"},
+            "HostName": {"type": "string", "minLength": 1},
+            "IsLatest": _FLAG,
+        }),
+        "Detection": _section({
+            "Interval": _POSITIVE,
+            "CONF_THRESHOLD": _RATIO,
+            "Classes": _CLASSES,
+            "ROIs": {"type": "array", "items": _RECT},
+            "Tiled": _FLAG,
+            "TileSize": {"type": ["array", "null"], "items": {"type": "integer", "minimum": 32},
+                         "minItems": 2, "maxItems": 2},
+            "TileOverlap": {"type": "number", "minimum": 0, "maximum": 0.9},
+            "Models": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"Path": {"type": "string", "minLength": 1},
+                               "Name": {"type": "string"},
+                               "Accuracy": {"type": "number"},
+                               "Threads": {"type": "integer", "minimum": 1},
+                               "Backend": _BACKEND,
+                               "InputSize": {"type": "array", "items": {"type": "integer", "minimum": 32},
+                                             "minItems": 2, "maxItems": 2}},
+                "required": ["Path"],
+            }},
+            "Threads": {"type": "integer", "minimum": 1},
+            "Backend": _BACKEND,
+            "LatencyBudget": _OPTIONAL_POSITIVE,
+        }),
+        "Sampling": _section({
+            "Align": _FLAG,
+            "Jitter": _NON_NEGATIVE,
+            "MinInterval": _OPTIONAL_POSITIVE,
+            "MaxInterval": _OPTIONAL_POSITIVE,
+            "ActiveInterval": _OPTIONAL_POSITIVE,
+            "IdleInterval": _OPTIONAL_POSITIVE,
+            "IdleAfter": {"type": "integer", "minimum": 1},
+            "TempSoft": {"type": "number"},
+            "TempHard": {"type": "number"},
+        }),
+        "Web": _section({
+            "Enabled": _FLAG,
+            "Host": {"type": "string"},
+            "Port": _PORT,
+            "Quality": {"type": "integer", "minimum": 1, "maximum": 100},
+            "StreamFPS": _POSITIVE,
+            "Persist": {"enum": ["none", "change", "detection", "always"]},
+            "PersistMinInterval": _NON_NEGATIVE,
+        }),
+        "Metrics": _section({
+            "Enabled": _FLAG,
+            "Bind": {"type": "string"},
+            "Port": _PORT,
+            "SnapshotPath": {"type": ["string", "null"]},
+            "SnapshotInterval": _POSITIVE,
+            "Window": {"type": "integer", "minimum": 1},
+        }),
+        "MotionGate": _section({
+            "Enabled": _FLAG,
+            "Mode": {"enum": ["diff", "background"]},
+            "Width": {"type": "integer", "minimum": 16},
+            "Threshold": {"type": "number", "minimum": 0, "maximum": 255},
+            "MinArea": _RATIO,
+            "ForceEvery": {"type": "integer", "minimum": 0},
+            "Masks": {"type": "array", "items": {"type": "array", "items": _POINT, "minItems": 3}},
+        }),
+        "Tracking": _section({
+            "Enabled": _FLAG,
+            "DetectEvery": {"type": "integer", "minimum": 1},
+            "IoUThreshold": _RATIO,
+            "MaxMisses": {"type": "integer", "minimum": 0},
+            "MinHits": {"type": "integer", "minimum": 1},
+            "Lines": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"},
+                               "points": {"type": "array", "items": _POINT, "minItems": 2, "maxItems": 2}},
+                "required": ["name", "points"],
+            }},
+        }),
+        "Pipeline": _section({
+            "QueueSize": {"type": "integer", "minimum": 1},
+            "Policy": {"enum": ["drop_oldest", "block"]},
+        }),
+        "Logging": _section({
+            "FlushRows": {"type": "integer", "minimum": 1},
+            "FlushInterval": _NON_NEGATIVE,
+            "FsyncInterval": {"type": ["number", "null"], "minimum": 0},
+            "Rotate": {"enum": ["daily", "size", "none"]},
+            "MaxBytes": {"type": "integer", "minimum": 0},
+            "Compress": _FLAG,
+            "Database": {"type": ["string", "null"]},
+        }),
+        "Uplink": _section({
+            "Format": {"enum": ["binary", "text"]},
+            "Classes": _CLASSES,
+            "TimeMode": {"enum": ["none", "epoch", "age"]},
+            "Epoch": {"type": "string"},
+            "Window": {"type": "integer", "minimum": 1},
+            "DataRate": {"type": "integer", "minimum": 0, "maximum": 6},
+            "DutyCycle": {"type": "number", "exclusiveMinimum": 0, "maximum": 1},
+            "BudgetWindow": _POSITIVE,
+            "MaxLatency": _NON_NEGATIVE,
+            "DwellTime": _FLAG,
+            "Confirmed": _FLAG,
+        }),
+        "Link": _section({
+            "Adaptive": _FLAG,
+            "LinkCheck": _FLAG,
+            "Window": {"type": "integer", "minimum": 1},
+            "MinDataRate": {"type": "integer", "minimum": 0, "maximum": 6},
+            "MaxDataRate": {"type": "integer", "minimum": 0, "maximum": 6},
+            "Margin": _NON_NEGATIVE,
+            "MaxTrials": {"type": "integer", "minimum": 1, "maximum": 15},
+            "AutoConfirm": _FLAG,
+            "StepUpAfter": {"type": "integer", "minimum": 1},
+            "FailureLimit": {"type": "integer", "minimum": 1},
+        }),
+        "Outbox": _section({
+            "Enabled": _FLAG,
+            "Path": {"type": "string", "minLength": 1},
+            "Slots": {"type": "integer", "minimum": 1},
+            "SlotSize": {"type": "integer", "minimum": 32, "maximum": 65535},
+            "Order": {"enum": ["oldest", "newest"]},
+            "SyncInterval": _NON_NEGATIVE,
+        }),
+        "Config": _section({
+            "Watch": _FLAG,
+            "PollInterval": _POSITIVE,
+        }),
+    },
+    "required": ["LoRa", "Detection"],
+}
@@ -0,0 +1,251 @@
+"""
+設定ファイルの変更を監視し、再起動せずに反映する
+
+ファイルの変更は inotify (使えなければ更新時刻のポーリング) で検知する。
+読み込んだ設定はスキーマで検証し、通らなければ捨てて直前の設定のまま動き続ける。
+検証に通った変更は監視スレッドではなく撮影ループから apply_pending() で反映し、
+1周期の途中で設定が入れ替わらないようにする。ハンドラが失敗した場合は反映済みのセクションも元に戻す。
+"""
+import copy
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import threading
+
+from .metrics import metrics
+
+# inotify のイベント
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+def changed_keys(old, new):
+    """セクション内で値が変わったキー"""
+    old = old or {}
+    new = new or {}
+    return sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+
+class _Inotify:
+    """ディレクトリ内の書き込み・置き換えを待つ (Linux のみ)"""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if self._libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed: {directory}")
+
+    def wait(self, timeout):
+        """
+        イベントがあるまで最大 timeout 秒待つ
+        :return: 変更されたファイル名の集合
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        names = set()
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + 16 <= len(data):
+            _, _, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + length].split(b"\0", 1)[0]
+            names.add(name.decode(errors="replace"))
+            offset += 16 + length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher:
+    def __init__(self, manager, poll_interval=2.0, debounce=0.5):
+        """
+        :param manager: ConfigManager (config_data が現在の設定)
+        :param poll_interval: inotify が使えないときにファイルを確認する間隔 [秒]
+        :param debounce: 変更を検知してから読み込むまでの待ち時間 [秒] (書き込み途中を読まないため)
+        """
+        self.manager = manager
+        self.path = manager.CONFIG_PATH
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._handlers = {}  # セクション名 -> [handler, ...]
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # 反映中の設定全体 (ハンドラが他のセクションを参照するときに使う)
+        self.target = manager.config_data
+        self._stat = self._file_stat()
+
+        # カウンタ
+        self.applied = 0
+        self.rejected = 0
+
+    def register(self, section, handler):
+        """
+        セクションの変更ハンドラを登録する
+        handler(old_section, new_section) は反映したうえで、再起動しないと反映されないキーを返す
+        """
+        self._handlers.setdefault(section, []).append(handler)
+
+    # ------------------------------------------------------------------
+    # 監視 (監視スレッド)
+    # ------------------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(2)
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    def _run(self):
+        inotify = None
+        try:
+            inotify = _Inotify(os.path.dirname(os.path.abspath(self.path)))
+            print(f"Watching config (inotify): {self.path}")
+        except (OSError, AttributeError) as e:
+            print(f"Watching config (polling every {self.poll_interval} sec): {self.path} ({e})")
+
+        name = os.path.basename(self.path)
+        try:
+            while not self._stop_event.is_set():
+                if inotify is not None:
+                    # 停止要求に気づけるよう1秒ごとに戻る
+                    if name not in inotify.wait(1.0):
+                        continue
+                elif self._stop_event.wait(self.poll_interval):
+                    break
+                stat = self._file_stat()
+                if stat is None or stat == self._stat:
+                    continue
+                # 書き込みが落ち着くまで待ってから読む
+                if self._stop_event.wait(self.debounce):
+                    break
+                self._stat = self._file_stat()
+                self.check()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def check(self):
+        """
+        ファイルを読み込んで検証し、変更があれば反映待ちにする
+        ファイルが現在の設定に戻った・検証に通らない場合は、以前の反映待ちの変更も捨てる (ファイルの内容だけを反映する)
+        :return: 反映待ちにしたら True
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self._discard_pending()
+            self._reject([f"failed to read: {e}"])
+            return False
+        errors = self.manager.validate(data)
+        if errors:
+            self._discard_pending()
+            self._reject(errors)
+            return False
+
+        current = self.manager.config_data
+        sections = [s for s in set(current) | set(data) if current.get(s) != data.get(s)]
+        if not sections:
+            # 反映前に元に戻された: 反映待ちの (もうファイルにない) 変更は捨てる
+            if self._discard_pending():
+                print("Config change reverted before it was applied.")
+            return False
+        print(f"Config change detected: {sorted(sections)}")
+        with self._lock:
+            self._pending = data
+        return True
+
+    def _discard_pending(self):
+        """:return: 反映待ちの変更があったら True"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending is not None
+
+    def _reject(self, errors):
+        self.rejected += 1
+        metrics.inc("config_rejected")
+        print("[Error] Config change rejected. Keeping the current config:")
+        for error in errors:
+            print(f" - {error}")
+
+    # ------------------------------------------------------------------
+    # 反映 (撮影ループ)
+    # ------------------------------------------------------------------
+    def apply_pending(self):
+        """
+        検証済みの変更があれば、登録されたハンドラで反映する
+        撮影ループの周期の区切りで呼ぶ
+        :return: 反映したら True
+        """
+        with self._lock:
+            new, self._pending = self._pending, None
+        if new is None:
+            return False
+
+        old = self.manager.config_data
+        sections = sorted(s for s in set(old) | set(new) if old.get(s) != new.get(s))
+        applied = []
+        restart = []
+        self.target = new
+        try:
+            for section in sections:
+                before, after = old.get(section, {}), new.get(section, {})
+                handlers = self._handlers.get(section)
+                if not handlers:
+                    restart += [f"{section}.{key}" for key in changed_keys(before, after)]
+                    continue
+                applied.append(section)
+                not_applied = set()
+                for handler in handlers:
+                    not_applied |= set(handler(before, after) or ())
+                restart += [f"{section}.{key}" for key in sorted(not_applied)]
+        except Exception as e:
+            # 途中まで反映したセクションを元の設定に戻す
+            print(f"[Error] Failed to apply config ({e}). Rolling back.")
+            self.target = old
+            for section in reversed(applied):
+                for handler in self._handlers[section]:
+                    try:
+                        handler(new.get(section, {}), old.get(section, {}))
+                    except Exception as rollback_error:
+                        print(f"[Error] Rollback of {section} failed: {rollback_error}")
+            self._reject([str(e)])
+            return False
+
+        self.manager.config_data = self.target = copy.deepcopy(new)
+        self.manager.save_last_good(new)
+        self.applied += 1
+        metrics.inc("config_applied")
+        print(f"Config applied: {sections}")
+        if restart:
+            print(f" - Takes effect after restart: {restart}")
+        return True
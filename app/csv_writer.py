@@ -0,0 +1,198 @@
+import csv
+import datetime
+import gzip
+import os
+import shutil
+import threading
+import time
+
+
+class RotatingCsvWriter:
+    """
+    ファイルを開いたまま行をバッファし、まとめて書き込むCSVライタ
+
+    SDカードへの細かい書き込みを減らすため、
+      - flush_rows 行たまるか、最後の書き込みから flush_interval 秒経ったら書き込む
+      - fsync は fsync_interval 秒に1回まで (0 なら毎回、None ならしない)
+    とする。ファイル名は常に同じ (例: logPerson.csv) で、日付が変わるか max_bytes を超えたら
+    logPerson.2025-01-01.csv のように退避し、バックグラウンドで gzip 圧縮する。
+    既存のファイルのヘッダーが header と違う (列を追加した) 場合も、追記せずに退避してから書き始める。
+    """
+
+    def __init__(self, path, header, flush_rows=32, flush_interval=10.0, fsync_interval=60.0,
+                 rotate="daily", max_bytes=0, compress=True):
+        """
+        :param path: 書き込み先のCSVファイル
+        :param header: ヘッダー行 (新規ファイルの先頭に書く)
+        :param flush_rows: この行数たまったら書き込む
+        :param flush_interval: 最後の書き込みからこの秒数経ったら書き込む
+        :param fsync_interval: fsync の最小間隔 [秒] (0 なら書き込みごと、None ならしない)
+        :param rotate: "daily" (日付が変わったら) / "size" (max_bytes を超えたら) / "none"
+        :param max_bytes: このサイズを超えたら退避する (0 なら無効。daily と併用可)
+        :param compress: 退避したファイルを gzip 圧縮する
+        """
+        if rotate not in ("daily", "size", "none"):
+            raise ValueError(f"Unknown rotate mode: {rotate}")
+        self.path = path
+        self.header = list(header)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.compress = compress
+
+        self._lock = threading.Lock()
+        self._rows = []
+        self._file = None
+        self._writer = None
+        self._size = 0
+        self._day = None
+        self._last_flush = time.monotonic()
+        self._last_fsync = time.monotonic()
+        self._compressors = []
+
+        # カウンタ
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.rotations = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+
+    def write_row(self, row, dt=None):
+        self.write_rows([row], dt)
+
+    def write_rows(self, rows, dt=None):
+        """
+        :param rows: 行のリスト
+        :param dt: 行の日時 (日付ごとの退避に使う。省略時は現在時刻)
+        """
+        day = (dt or datetime.datetime.now()).date()
+        with self._lock:
+            if self.rotate == "daily" and self._day is not None and day != self._day:
+                # 前日分を書き切ってから退避する
+                self._flush_locked()
+                self._rotate_locked()
+            self._day = day
+            self._rows.extend(rows)
+            if (len(self._rows) >= self.flush_rows
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self, fsync=False):
+        with self._lock:
+            self._flush_locked(force_fsync=fsync)
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._file:
+                if self.fsync_interval is not None:
+                    os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                self._file.close()
+                self._file = None
+        for thread in self._compressors:
+            thread.join()
+        self._compressors = []
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "rows_buffered": len(self._rows),
+            "bytes_written": self.bytes_written,
+            "flushes": self.flushes,
+            "fsyncs": self.fsyncs,
+            "rotations": self.rotations,
+            "flush_time_mean_ms": self.flush_time_total / self.flushes * 1000 if self.flushes else 0.0,
+            "flush_time_max_ms": self.flush_time_max * 1000,
+        }
+
+    # ------------------------------------------------------------------
+    def _open(self):
+        if self.rotate == "daily" and os.path.isfile(self.path):
+            # 前回起動時の古い日付のファイルが残っていれば退避する
+            mtime_day = datetime.date.fromtimestamp(os.path.getmtime(self.path))
+            if mtime_day != (self._day or datetime.date.today()):
+                self._rotate_locked(mtime_day)
+        if os.path.isfile(self.path) and self._read_header() not in (None, self.header):
+            # 列の違う古い形式のファイルには追記せず退避する
+            self._rotate_locked(datetime.date.fromtimestamp(os.path.getmtime(self.path)))
+
+        self._file = open(self.path, mode='a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._writer.writerow(self.header)
+
+    def _read_header(self):
+        """既存ファイルのヘッダー行 (空なら None)"""
+        with open(self.path, newline='', encoding='utf-8', errors='replace') as f:
+            return next(csv.reader(f), None)
+
+    def _flush_locked(self, force_fsync=False):
+        self._last_flush = time.monotonic()
+        if not self._rows:
+            return
+        t0 = time.perf_counter()
+        if self._file is None:
+            self._open()
+        start = self._file.tell()
+        self._writer.writerows(self._rows)
+        self._file.flush()
+
+        now = time.monotonic()
+        if self.fsync_interval is not None and (force_fsync or now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+            self.fsyncs += 1
+
+        self._size = self._file.tell()
+        self.bytes_written += self._size - start
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+        elapsed = time.perf_counter() - t0
+        self.flushes += 1
+        self.flush_time_total += elapsed
+        self.flush_time_max = max(self.flush_time_max, elapsed)
+
+        if self.max_bytes and self._size >= self.max_bytes:
+            self._rotate_locked()
+
+    def _rotate_locked(self, day=None):
+        """現在のファイルを日付付きの名前に退避する"""
+        if self._file:
+            if self.fsync_interval is not None:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if not os.path.isfile(self.path):
+            return
+
+        base, ext = os.path.splitext(self.path)
+        stamp = (day or self._day or datetime.date.today()).isoformat()
+        target = f"{base}.{stamp}{ext}"
+        n = 1
+        while os.path.exists(target) or os.path.exists(target + ".gz"):
+            target = f"{base}.{stamp}.{n}{ext}"
+            n += 1
+        os.replace(self.path, target)
+        self.rotations += 1
+
+        if self.compress:
+            self._compressors = [t for t in self._compressors if t.is_alive()]
+            thread = threading.Thread(target=_gzip_file, args=(target,), name="csv-gzip", daemon=True)
+            thread.start()
+            self._compressors.append(thread)
+
+
+def _gzip_file(path):
+    try:
+        with open(path, 'rb') as src, gzip.open(path + ".gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+    except OSError as e:
+        print(f"Failed to compress {path}: {e}")
@@ -1,27 +1,42 @@
+import math
+
 import cv2
 import numpy as np
-import tflite_runtime.interpreter as tflite
-
-# COCOデータセットのクラス名
-CLASSES = [
-    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
-    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
-    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
-    "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard",
-    "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple",
-    "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch",
-    "potted plant", "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard", "cell phone",
-    "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors", "teddy bear",
-    "hair drier", "toothbrush"
-]
+from .backends import create_interpreter
+from .metrics import metrics
+from .preprocessor import LetterboxPreprocessor
+from .yolo_decoder import CLASSES, YoloDecoder, resolve_class_ids
 
 class YoloDetector:
-    def __init__(self, model_path, num_threads=4, conf_threshold=0.4, nms_threshold=0.45):
+    def __init__(self, model_path, num_threads=4, conf_threshold=0.4, nms_threshold=0.45, classes=None, top_k=300,
+                 interpreter=None, rois=None, tiled=False, tile_size=None, tile_overlap=0.2, merge_threshold=0.7,
+                 backend="tflite", input_size=None):
+        """
+        :param classes: 検出対象クラス (例: ["person"])。None なら全クラス
+        :param top_k: NMSに渡す候補の上限
+        :param interpreter: 生成済みのインタプリタ (ベンチマーク用のスタブなど)。None なら model_path から読み込む
+        :param rois: 推論する領域のリスト。各領域は正規化座標 (0-1) の [x, y, w, h]。None なら画面全体
+        :param tiled: 領域をモデル入力サイズ程度のタイルに分けて推論する (遠くの小さな人物向け)
+        :param tile_size: タイル1枚の大きさ [px] (Width, Height)。None ならモデル入力サイズ (等倍)
+        :param tile_overlap: 隣り合うタイルの重なり (0-1)
+        :param merge_threshold: タイル境界で分断された検出を統合する重なり (小さい方の面積に対する割合)
+        :param backend: 推論バックエンド (app/backends.py の BACKENDS)。interpreter を指定した場合は使わない
+        :param input_size: モデルの入力サイズ (Width, Height)。モデルから読み取れないバックエンド (opencv) で使う
+        """
         self.conf_threshold = conf_threshold
         self.nms_threshold = nms_threshold
+        self.rois = rois or []
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.merge_threshold = merge_threshold
+        self._windows = {}
         
         # モデル読み込み
-        self.interpreter = tflite.Interpreter(model_path=model_path, num_threads=num_threads)
+        if interpreter is None:
+            interpreter = create_interpreter(model_path, backend=backend, num_threads=num_threads,
+                                             input_size=input_size)
+        self.interpreter = interpreter
         self.interpreter.allocate_tensors()
         
         self.input_details = self.interpreter.get_input_details()
@@ -39,93 +54,168 @@ class YoloDetector:
         self.output_index = self.output_details[0]['index']
         self.output_scale, self.output_zero_point = self.output_details[0]['quantization']
 
+        # 前処理エンジン (入力テンソルへ直接書き込む)
+        self.preprocessor = LetterboxPreprocessor(
+            self.model_input_size,
+            self.input_dtype,
+            quantization=(self.input_scale, self.input_zero_point),
+        )
+        self.input_tensor = self.interpreter.tensor(self.input_index)
+
+        # 出力デコーダ (量子化のまま閾値判定する)
+        self.decoder = YoloDecoder(
+            self.model_input_size,
+            conf_threshold=conf_threshold,
+            nms_threshold=nms_threshold,
+            classes=classes,
+            top_k=top_k,
+            output_dtype=self.output_dtype,
+            quantization=(self.output_scale, self.output_zero_point),
+        )
+
+    def set_conf_threshold(self, conf_threshold):
+        self.conf_threshold = conf_threshold
+        self.decoder.set_conf_threshold(conf_threshold)
+
+    def set_classes(self, classes):
+        """検出対象クラスを変更する (None または空なら全クラス)"""
+        self.decoder.class_ids = resolve_class_ids(classes)
+
+    def set_regions(self, rois=None, tile_size=None, tile_overlap=0.2):
+        """推論する領域・タイルの設定を変更する (切り出し範囲は次の推論で計算し直す)"""
+        self.rois = rois or []
+        self.tile_size = tuple(tile_size) if tile_size else None
+        self.tile_overlap = tile_overlap
+        self._windows = {}
+
     def preprocess(self, image):
-        """Letterbox処理と正規化"""
-        ih, iw = image.shape[:2]
-        w, h = self.model_input_size
-        scale = min(w / iw, h / ih)
-        nw, nh = int(iw * scale), int(ih * scale)
-        image_resized = cv2.resize(image, (nw, nh))
-        new_image = np.full((h, w, 3), 0, dtype=np.uint8)
-        dx = (w - nw) // 2
-        dy = (h - nh) // 2
-        new_image[dy:dy+nh, dx:dx+nw, :] = image_resized
-        
-        # RGB変換
-        img_rgb = cv2.cvtColor(new_image, cv2.COLOR_BGR2RGB)
-        
-        # 型に応じた変換
-        if self.input_dtype == np.int8:
-            img_norm = img_rgb.astype(np.float32) / 255.0
-            img_input = (img_norm / self.input_scale) + self.input_zero_point
-            input_data = np.clip(img_input, -128, 127).astype(np.int8)
-            input_data = np.expand_dims(input_data, axis=0)
-        elif self.input_dtype == np.uint8:
-            input_data = np.expand_dims(img_rgb, axis=0).astype(np.uint8)
-        else:
-            img_norm = img_rgb.astype(np.float32) / 255.0
-            input_data = np.expand_dims(img_norm, axis=0)
-            
-        return input_data, scale, (dx, dy)
+        """
+        Letterbox処理と正規化
+        結果は入力テンソルへ直接書き込まれる (set_tensorによるコピーは不要)
+        """
+        # テンソルのビューはinvoke前に手放す必要があるため、都度取得して保持しない
+        return self.preprocessor.run(image, self.input_tensor()[0])
+
+    def windows(self, image_shape):
+        """
+        推論する切り出し範囲 [(x, y, w, h), ...] を返す (画像サイズごとに一度だけ計算する)
+        ROIもタイルも指定されていなければ画面全体の1つ
+        """
+        key = tuple(image_shape[:2])
+        windows = self._windows.get(key)
+        if windows is None:
+            windows = self._plan_windows(*key)
+            self._windows[key] = windows
+        return windows
+
+    def _plan_windows(self, height, width):
+        regions = []
+        for rx, ry, rw, rh in self.rois or [[0.0, 0.0, 1.0, 1.0]]:
+            x0 = min(max(int(rx * width), 0), width - 1)
+            y0 = min(max(int(ry * height), 0), height - 1)
+            x1 = min(max(int((rx + rw) * width), x0 + 1), width)
+            y1 = min(max(int((ry + rh) * height), y0 + 1), height)
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+        if not self.tiled:
+            return regions
+
+        tw, th = self.tile_size or self.model_input_size
+        windows = []
+        for x, y, w, h in regions:
+            for ty in self._tile_positions(y, h, th):
+                for tx in self._tile_positions(x, w, tw):
+                    windows.append((tx, ty, min(tw, w), min(th, h)))
+        return windows
 
+    def _tile_positions(self, start, length, tile):
+        """length を tile 幅のタイルで重なりを持たせて覆う開始位置 (端のタイルも同じ大きさにする)"""
+        if length <= tile:
+            return [start]
+        stride = tile * (1.0 - self.tile_overlap)
+        count = math.ceil((length - tile) / stride) + 1
+        step = (length - tile) / (count - 1)
+        return [start + round(i * step) for i in range(count)]
+
+    @metrics.timed("detector_detect")
     def detect(self, image):
         """推論実行と結果のパース"""
-        input_data, scale, pad = self.preprocess(image)
-        
-        self.interpreter.set_tensor(self.input_index, input_data)
-        self.interpreter.invoke()
-        
-        output_data = self.interpreter.get_tensor(self.output_index)
-        output_data = output_data[0].transpose()
-
-        # デオンタイズ（必要な場合）
-        if self.output_dtype == np.int8 or self.output_dtype == np.uint8:
-            if self.output_scale > 0:
-                output_data = (output_data.astype(np.float32) - self.output_zero_point) * self.output_scale
-
-        # 解析ロジック
-        boxes_candidate = []
-        confidences = []
-        class_ids = []
-
-        all_scores = output_data[:, 4:]
-        max_scores = np.max(all_scores, axis=1)
-        max_indices = np.argmax(all_scores, axis=1)
-        
-        valid_rows = np.where(max_scores > self.conf_threshold)[0]
+        windows = self.windows(image.shape)
+        ih, iw = image.shape[:2]
+        if len(windows) == 1 and windows[0] == (0, 0, iw, ih):
+            return self._detect_window(image)
 
-        for i in valid_rows:
-            score = float(max_scores[i])
-            class_id = int(max_indices[i])
-            row = output_data[i]
-            
-            cx = row[0] * self.model_input_size[0]
-            cy = row[1] * self.model_input_size[1]
-            w = row[2]  * self.model_input_size[0]
-            h = row[3]  * self.model_input_size[1]
-            
-            left = int(cx - w/2)
-            top = int(cy - h/2)
-            
-            boxes_candidate.append([left, top, int(w), int(h)])
-            confidences.append(score)
-            class_ids.append(class_id)
+        # 必要な範囲だけを切り出して推論し (コピーなしのビュー)、画面座標に戻して統合する
+        results = []
+        for x, y, w, h in windows:
+            results.extend(self._detect_window(image[y:y + h, x:x + w], (x, y)))
+        if len(windows) > 1:
+            results = self._merge(results)
+        return results
 
-        indices = cv2.dnn.NMSBoxes(boxes_candidate, confidences, self.conf_threshold, self.nms_threshold)
+    def _detect_window(self, image, offset=(0, 0)):
+        with metrics.timer("detector_preprocess"):
+            scale, pad = self.preprocess(image)
+        with metrics.timer("detector_invoke"):
+            self.interpreter.invoke()
         
+        output_data = self.interpreter.get_tensor(self.output_index)[0]
+
+        # 解析ロジック (ベクトル化デコード + NMS)
+        with metrics.timer("detector_decode"):
+            boxes, confidences, class_ids = self.decoder.decode(output_data)
+            indices = self.decoder.nms(boxes, confidences)
+        return self.to_results(boxes, confidences, class_ids, indices, scale, pad, offset)
+
+    def to_results(self, boxes, confidences, class_ids, indices, scale, pad, offset=(0, 0)):
+        """NMSで残った候補を元画像の座標に戻して結果のリストにする"""
+        ox, oy = offset
         results = []
-        if len(indices) > 0:
-            for i in indices:
-                idx = i if isinstance(i, (int, np.integer)) else i[0]
-                box = self._scale_coords(boxes_candidate[idx], scale, pad)
-                results.append({
-                    "box": box,
-                    "score": confidences[idx],
-                    "class_id": class_ids[idx],
-                    "class_name": CLASSES[class_ids[idx]]
-                })
+        for idx in indices:
+            class_id = int(class_ids[idx])
+            box = self._scale_coords(boxes[idx].tolist(), scale, pad)
+            box[0] += ox
+            box[1] += oy
+            results.append({
+                "box": box,
+                "score": float(confidences[idx]),
+                "class_id": class_id,
+                "class_name": CLASSES[class_id]
+            })
         return results
 
+    def _merge(self, results):
+        """
+        領域・タイルをまたいだ重複を除く
+        通常のNMS (IoU) に加え、タイル境界で切れた検出が同じクラスの大きい検出に
+        ほぼ含まれる場合 (小さい方の面積に対する重なりが merge_threshold 以上) も除く
+        """
+        if len(results) < 2:
+            return results
+        results = sorted(results, key=lambda r: r["score"], reverse=True)
+        boxes = np.array([r["box"] for r in results], dtype=np.float64)
+        x1, y1 = boxes[:, 0], boxes[:, 1]
+        x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+        areas = np.maximum(boxes[:, 2], 0) * np.maximum(boxes[:, 3], 0)
+        class_ids = np.array([r["class_id"] for r in results])
+
+        suppressed = np.zeros(len(results), dtype=bool)
+        keep = []
+        for i in range(len(results)):
+            if suppressed[i]:
+                continue
+            keep.append(results[i])
+            rest = np.arange(i + 1, len(results))
+            iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+            ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+            inter = iw * ih
+            union = areas[i] + areas[rest] - inter
+            iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+            smaller = np.minimum(areas[i], areas[rest])
+            ios = np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+            duplicate = (iou > self.nms_threshold) | ((ios >= self.merge_threshold) & (class_ids[rest] == class_ids[i]))
+            suppressed[rest[duplicate]] = True
+        return keep
+
     def _scale_coords(self, box, scale, pad):
         dx, dy = pad
         left = int((box[0] - dx) / scale)
@@ -134,6 +224,7 @@ class YoloDetector:
         height = int(box[3] / scale)
         return [left, top, width, height]
 
+    @metrics.timed("detector_draw")
     def draw_results(self, image, results):
         """画像へのバウンディングボックス描画"""
         color = (0, 255, 0)
@@ -0,0 +1,233 @@
+"""
+複数のYOLOモデルから、1フレームあたりの処理時間の予算に収まるものを選んで使う
+
+起動時に登録したモデル (入力サイズ・n/s・int8/float の違い) をすべて読み込み、実機で処理時間を測る。
+予算に収まるモデルのうち最も精度の高いものを使い、稼働中も処理時間を監視して
+  - 直近の処理時間 (中央値) が予算を超え続けたら、より速いモデルへ
+  - 十分に余裕がある状態が続いたら、より精度の高いモデルへ
+切り替える。モデルはすべて読み込み済みなので、切り替えは次の detect() から即座に効き、フレームを落とさない。
+SoCの温度で処理速度が落ちた場合も、実測値の変化として同じ仕組みで追従する。
+"""
+import statistics
+import time
+from collections import deque
+
+import numpy as np
+
+from .metrics import metrics
+
+
+class ModelSpec:
+    def __init__(self, path, name=None, accuracy=0.0, num_threads=4, backend="tflite", input_size=None):
+        """
+        :param path: モデルのパス (.tflite。opencv / onnxruntime なら .onnx も可)
+        :param name: 表示名 (None ならファイル名)
+        :param accuracy: 精度の指標 (例: COCO mAP50-95)。大きいほど優先する。同じ値ならリストの順
+        :param num_threads: 推論スレッド数
+        :param backend: 推論バックエンド (app/backends.py の BACKENDS)
+        :param input_size: 入力サイズ (Width, Height)。opencv で .onnx のグラフから読み取れない場合に指定する
+        """
+        self.path = path
+        self.name = name or path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        self.accuracy = accuracy
+        self.num_threads = num_threads
+        self.backend = backend
+        self.input_size = tuple(input_size) if input_size else None
+
+    @classmethod
+    def from_config(cls, entry, default_threads=4, default_backend="tflite"):
+        """config.json の Detection.Models の1要素から作る"""
+        return cls(entry["Path"], name=entry.get("Name"), accuracy=entry.get("Accuracy", 0.0),
+                   num_threads=entry.get("Threads", default_threads),
+                   backend=entry.get("Backend", default_backend), input_size=entry.get("InputSize"))
+
+
+class DetectorManager:
+    def __init__(self, specs, factory, budget=None, window=10, cooldown=30, max_cooldown=240,
+                 benchmark_runs=5, frame_size=None):
+        """
+        :param specs: ModelSpec のリスト
+        :param factory: factory(spec) で YoloDetector を作る関数
+        :param budget: 1フレームあたりの処理時間の予算 [秒]。None なら切り替えない (先頭のモデルを使う)
+        :param window: 処理時間の判定に使う直近の検出回数
+        :param cooldown: 切り替えてから次に精度の高いモデルへ戻すまでの最小検出回数 (行ったり来たりを防ぐ)
+        :param max_cooldown: 戻したモデルがすぐにまた予算を超えた場合に cooldown を倍々に伸ばす上限
+        :param benchmark_runs: 起動時の計測回数 (別に1回の空回しを行う)
+        :param frame_size: 起動時の計測に使う画像の大きさ (Width, Height)。None なら各モデルの入力サイズ
+        """
+        self.budget = budget
+        self.window = window
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self._cooldown = cooldown
+        self._promoted = False  # 直前の切り替えが精度の高いモデルへの切り替えか
+        self.benchmark_runs = benchmark_runs
+        self.frame_size = frame_size
+        self._latencies = deque(maxlen=window)
+        self._since_switch = 0
+
+        # 精度の高い順 (同じならリストの順)
+        self.models = []
+        for spec in sorted(specs, key=lambda s: -s.accuracy):
+            t0 = time.monotonic()
+            try:
+                detector = factory(spec)
+            except Exception as e:
+                print(f"[DetectorManager] Failed to load {spec.name}: {e}")
+                continue
+            print(f"[DetectorManager] Loaded {spec.name} {detector.model_input_size} "
+                  f"in {time.monotonic() - t0:.1f} sec")
+            self.models.append({"spec": spec, "detector": detector, "latency": None})
+        if not self.models:
+            raise RuntimeError("No detection model could be loaded")
+
+        if budget is not None:
+            self._benchmark_all()
+        self.active = self._choose(1.0)
+        self.switches = 0
+        print(f"[DetectorManager] Using {self.name}"
+              + (f" (budget {budget * 1000:.0f} ms)" if budget is not None else ""))
+        metrics.gauge("detector_model_index", lambda: self.active)
+
+    def _benchmark_all(self):
+        """各モデルの処理時間を測る (モデルが1つなら切り替えないので測らない)"""
+        if len(self.models) < 2:
+            return
+        for model in self.models:
+            model["latency"] = self._benchmark(model["detector"], self.benchmark_runs, self.frame_size)
+            print(f"[DetectorManager] {model['spec'].name}: {model['latency'] * 1000:.1f} ms/frame")
+
+    @staticmethod
+    def _benchmark(detector, runs, frame_size):
+        """ノイズ画像で detect() の処理時間の中央値を測る (ROI・タイルの設定も含めた1フレーム分)"""
+        width, height = frame_size or detector.model_input_size
+        image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        detector.detect(image)  # 空回し (メモリ確保・キャッシュ)
+        samples = []
+        for _ in range(max(1, runs)):
+            t0 = time.perf_counter()
+            detector.detect(image)
+            samples.append(time.perf_counter() - t0)
+        return statistics.median(samples)
+
+    def _choose(self, drift, limit=None):
+        """
+        予想処理時間 (起動時の計測値 × drift) が limit に収まる最も精度の高いモデルの番号
+        収まるものがなければ最も速いモデル
+        """
+        limit = self.budget if limit is None else limit
+        if limit is None or self.models[0]["latency"] is None:
+            return 0
+        for index, model in enumerate(self.models):
+            if model["latency"] * drift <= limit:
+                return index
+        return min(range(len(self.models)), key=lambda i: self.models[i]["latency"])
+
+    # ------------------------------------------------------------------
+    # YoloDetector と同じ使い方
+    # ------------------------------------------------------------------
+    @property
+    def detector(self):
+        return self.models[self.active]["detector"]
+
+    @property
+    def name(self):
+        return self.models[self.active]["spec"].name
+
+    @property
+    def model_input_size(self):
+        return self.detector.model_input_size
+
+    def detect(self, image):
+        t0 = time.perf_counter()
+        results = self.detector.detect(image)
+        latency = time.perf_counter() - t0
+        metrics.observe("detector_frame", latency, model=self.name)
+        if self.budget is not None and len(self.models) > 1:
+            self._latencies.append(latency)
+            self._since_switch += 1
+            self._adapt()
+        return results
+
+    def draw_results(self, image, results):
+        return self.detector.draw_results(image, results)
+
+    def set_conf_threshold(self, conf_threshold):
+        for model in self.models:
+            model["detector"].set_conf_threshold(conf_threshold)
+
+    def set_classes(self, classes):
+        for model in self.models:
+            model["detector"].set_classes(classes)
+
+    def set_regions(self, rois=None, tile_size=None, tile_overlap=0.2):
+        for model in self.models:
+            model["detector"].set_regions(rois, tile_size, tile_overlap)
+
+    def set_budget(self, budget):
+        """
+        予算を変更する (次の判定から使う)
+        予算なしで起動していた場合は、ここで各モデルの処理時間を測ってモデルを選び直す
+        """
+        self.budget = budget
+        self._latencies.clear()
+        if budget is None or len(self.models) < 2 or self.models[0]["latency"] is not None:
+            return
+        self._benchmark_all()
+        index = self._choose(1.0)
+        if index != self.active:
+            self._switch(index, self.models[self.active]["latency"])
+        else:
+            print(f"[DetectorManager] Using {self.name} (budget {budget * 1000:.0f} ms)")
+
+    # ------------------------------------------------------------------
+    # 切り替え
+    # ------------------------------------------------------------------
+    def _adapt(self):
+        """
+        起動時と同じ基準 (予想処理時間が予算に収まる最も精度の高いモデル) で選び直す
+        行ったり来たりは予算を削るのではなく、戻すまでの待ち (cooldown) で防ぐ
+        """
+        if len(self._latencies) < self.window:
+            return
+        measured = statistics.median(self._latencies)
+        expected = self.models[self.active]["latency"]
+        drift = measured / expected if expected else 1.0
+        settled = self._since_switch >= self._cooldown
+        if settled and self._promoted:
+            # 戻したモデルが cooldown の間予算に収まった: 待ちを元に戻す
+            self._promoted = False
+            self._cooldown = self.cooldown
+        if measured > self.budget:
+            # 予算超過: 今の速度の落ち方を見込んで、収まるモデルへ
+            target = self._choose(drift)
+            if self._promoted:
+                # 戻してすぐにまた超えた: 次に戻すまでの待ちを伸ばす
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+        elif settled and self.active > 0:
+            # 今の速度の落ち方で見て予算に収まるなら、精度の高いモデルへ戻す
+            target = min(self._choose(drift), self.active)
+        else:
+            return
+        if target != self.active:
+            self._switch(target, measured)
+
+    def _switch(self, index, measured):
+        previous = self.name
+        self._promoted = index < self.active
+        self.active = index
+        self.switches += 1
+        self._latencies.clear()
+        self._since_switch = 0
+        metrics.inc("detector_switches")
+        print(f"[DetectorManager] Switched model: {previous} -> {self.name} "
+              f"(measured {measured * 1000:.1f} ms, budget {self.budget * 1000:.0f} ms)")
+
+    def stats(self):
+        return {
+            "active": self.name,
+            "switches": self.switches,
+            "budget_ms": self.budget * 1000 if self.budget is not None else None,
+            "benchmark_ms": {m["spec"].name: (m["latency"] * 1000 if m["latency"] is not None else None)
+                             for m in self.models},
+        }
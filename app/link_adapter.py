@@ -0,0 +1,273 @@
+"""
+リンク品質に応じたデータレート・再送回数・Confirmed の選択
+
+送信のたびにモジュールから得られるリンク情報 (AT+CLINKCHECK の結果: 復調マージン・受信ゲートウェイ数・
+ダウンリンクの RSSI/SNR) と送信結果を LinkStats に直近 window 回分ためておき、LinkPolicy がそこから
+  - データレート: 上りの推定SNRが、その拡散率の復調限界 + margin を上回る最も速いもの
+  - 再送回数 (nbtrials): 余裕が大きければ1回、小さければ max_trials 回
+  - Confirmed: 余裕が小さい・失敗が続くときは受信確認を取る (auto_confirm)
+を選ぶ。速いデータレートほど送信時間が短く、デューティ比の予算も節約できる。
+データレートを上げるのは成功が続いたときに1段ずつ、下げるのは即座に行う (行ったり来たりを防ぐ)。
+リンク情報がまだない間は設定のデータレートのまま送る。
+"""
+import math
+import statistics
+import threading
+import time
+from collections import deque
+
+from .airtime import AS923_DATA_RATES
+from .metrics import metrics
+from .uplink_scheduler import max_payload
+
+# 拡散率ごとの復調に必要な SNR [dB] (SX1276 データシート, 125kHz)
+SNR_FLOOR = {7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+
+def snr_floor(data_rate):
+    """データレートの復調限界 [dB] (帯域幅が広いと雑音も増えるのでその分を足す)"""
+    sf, bw = AS923_DATA_RATES[data_rate]
+    return SNR_FLOOR[sf] + 10 * math.log10(bw / 125000)
+
+
+class LinkStats:
+    """
+    直近の送信のリンク情報と結果
+    リンク情報は受信スレッドから、送信結果は送信側のスレッドから追加される
+    """
+
+    def __init__(self, window=20):
+        """
+        :param window: 統計を取る直近のリンクチェック・送信の回数
+        """
+        self._checks = deque(maxlen=window)  # (時刻, 上りの推定SNR, マージン, ゲートウェイ数, RSSI, SNR)
+        self._results = deque(maxlen=window)  # 送信に成功したか
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.checks_failed = 0
+        self.last = None
+
+    def add_check(self, margin, gateways, rssi=None, snr=None, data_rate=None):
+        """
+        リンクチェックの結果を追加する
+        :param margin: ゲートウェイでの上りの復調マージン [dB] (送信したデータレートの復調限界からの余裕)
+        :param data_rate: リンクチェックを送ったデータレート (上りのSNRの推定に使う。不明なら None)
+        """
+        uplink_snr = snr_floor(data_rate) + margin if data_rate is not None else None
+        with self._lock:
+            self._checks.append((time.monotonic(), uplink_snr, margin, gateways, rssi, snr))
+            self.last = {"margin": margin, "gateways": gateways, "rssi": rssi, "snr": snr, "data_rate": data_rate}
+
+    def add_check_failure(self):
+        """リンクチェックの応答がなかった"""
+        with self._lock:
+            self.checks_failed += 1
+
+    def add_result(self, success):
+        with self._lock:
+            self._results.append(bool(success))
+            if success:
+                self.consecutive_successes += 1
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+                self.consecutive_successes = 0
+
+    def reset_streak(self):
+        """データレートを変えたら、連続成功・失敗の数は新しいデータレートで数え直す"""
+        with self._lock:
+            self.consecutive_successes = 0
+            self.consecutive_failures = 0
+
+    @property
+    def samples(self):
+        return len(self._checks)
+
+    def uplink_snr(self, quantile=0.2):
+        """
+        上りの推定SNRの下側の分位点 [dB] (ばらつきの悪い側に合わせる)
+        :return: リンクチェックの結果がなければ None
+        """
+        with self._lock:
+            values = sorted(c[1] for c in self._checks if c[1] is not None)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(quantile * len(values)))]
+
+    def success_rate(self):
+        with self._lock:
+            results = list(self._results)
+        return sum(results) / len(results) if results else None
+
+    def summary(self):
+        with self._lock:
+            checks = list(self._checks)
+        median = lambda index: statistics.median(c[index] for c in checks if c[index] is not None) \
+            if any(c[index] is not None for c in checks) else None
+        return {
+            "samples": len(checks),
+            "uplink_snr_db": self.uplink_snr(),
+            "margin_db": median(2),
+            "gateways": median(3),
+            "rssi_dbm": median(4),
+            "snr_db": median(5),
+            "last_check_age_s": time.monotonic() - checks[-1][0] if checks else None,
+            "checks_failed": self.checks_failed,
+            "success_rate": self.success_rate(),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class LinkPolicy:
+    def __init__(self, min_data_rate=0, max_data_rate=5, margin=5.0, max_trials=3, confirmed=False,
+                 auto_confirm=True, step_up_after=5, failure_limit=2, min_samples=3, quantile=0.2):
+        """
+        :param min_data_rate: 使う最も遅いデータレート
+        :param max_data_rate: 使う最も速いデータレート
+        :param margin: 復調限界に対して確保する余裕 [dB]
+        :param max_trials: 余裕が小さいときの送信回数 (nbtrials)
+        :param confirmed: 常に Confirmed で送る
+        :param auto_confirm: 余裕が小さい・失敗が多いときは Confirmed で送る
+        :param step_up_after: データレートを1段上げるのに必要な連続成功数
+        :param failure_limit: この回数続けて失敗したらデータレートを1段下げる
+        :param min_samples: データレートを選ぶのに必要なリンクチェックの数
+        :param quantile: 上りのSNRのどの分位点で判断するか
+        """
+        self.min_data_rate = min_data_rate
+        self.max_data_rate = max(min_data_rate, max_data_rate)
+        self.margin = margin
+        self.max_trials = max_trials
+        self.confirmed = confirmed
+        self.auto_confirm = auto_confirm
+        self.step_up_after = step_up_after
+        self.failure_limit = failure_limit
+        self.min_samples = min_samples
+        self.quantile = quantile
+
+    def decide(self, stats, data_rate):
+        """
+        次の送信の設定を選ぶ
+        :param stats: LinkStats
+        :param data_rate: 現在のデータレート
+        :return: {"data_rate", "nbtrials", "confirmed", "reason"}
+        """
+        current = min(max(data_rate, self.min_data_rate), self.max_data_rate)
+        if stats.consecutive_failures >= self.failure_limit:
+            # 失敗が続く: リンク情報も届いていないので、1段遅くして確実に届ける
+            return {"data_rate": max(self.min_data_rate, current - 1), "nbtrials": self.max_trials,
+                    "confirmed": self.confirmed or self.auto_confirm, "reason": "failures"}
+
+        snr = stats.uplink_snr(self.quantile) if stats.samples >= self.min_samples else None
+        if snr is None:
+            return {"data_rate": current, "nbtrials": 2, "confirmed": self.confirmed, "reason": "no link check"}
+
+        best = self.min_data_rate
+        for candidate in range(self.min_data_rate, self.max_data_rate + 1):
+            if snr >= snr_floor(candidate) + self.margin:
+                best = candidate
+        if best > current:
+            target = current + 1 if stats.consecutive_successes >= self.step_up_after else current
+        else:
+            target = best
+
+        headroom = snr - snr_floor(target)
+        success_rate = stats.success_rate()
+        if headroom >= 2 * self.margin:
+            nbtrials = 1
+        elif headroom >= self.margin:
+            nbtrials = 2
+        else:
+            nbtrials = self.max_trials
+        marginal = headroom < self.margin or (success_rate is not None and success_rate < 0.9)
+        if marginal:
+            nbtrials = max(nbtrials, 2)
+        return {"data_rate": target, "nbtrials": nbtrials,
+                "confirmed": self.confirmed or (self.auto_confirm and marginal),
+                "reason": f"uplink SNR {snr:.1f} dB, headroom {headroom:.1f} dB"}
+
+
+class LinkAdapter:
+    """LinkPolicy の選択をモジュール (AT+CDATARATE) と UplinkScheduler (最大ペイロード・送信時間) に反映する"""
+
+    def __init__(self, lora, policy, scheduler=None, data_rate=2, link_check=True, min_payload=1,
+                 dwell_time=False):
+        """
+        :param lora: LoRaCommunicator
+        :param policy: LinkPolicy
+        :param scheduler: UplinkScheduler (None ならテキスト形式)
+        :param data_rate: 最初のデータレート
+        :param link_check: 送信ごとにリンクチェック (AT+CLINKCHECK=2) を行う
+        :param min_payload: 1回の送信に必要なペイロード長 [byte]。これが入らないデータレートは使わない
+        :param dwell_time: UplinkDwellTime=1 の最大ペイロード表を使う
+        """
+        self.lora = lora
+        self.scheduler = scheduler
+        self.data_rate = data_rate
+        self.link_check = link_check
+        self.min_payload = min_payload
+        self.dwell_time = dwell_time
+        self.decision = None
+        self.changes = 0
+        self._configured = False
+        self.set_policy(policy)
+
+        metrics.gauge("lora_data_rate", lambda: self.data_rate)
+        metrics.gauge("lora_link_uplink_snr_db", lambda: self.lora.link.uplink_snr())
+        metrics.gauge("lora_link_rssi_dbm", lambda: (self.lora.link.last or {}).get("rssi"))
+        metrics.gauge("lora_link_margin_db", lambda: (self.lora.link.last or {}).get("margin"))
+        metrics.gauge("lora_link_success_ratio", lambda: self.lora.link.success_rate())
+
+    def set_policy(self, policy):
+        """ポリシーを差し替える (最大ペイロードに min_payload が入らないデータレートは除く)"""
+        usable = [dr for dr in range(policy.min_data_rate, policy.max_data_rate + 1)
+                  if max_payload(dr, self.dwell_time) >= self.min_payload]
+        if usable:
+            policy.min_data_rate = usable[0]
+        self.policy = policy
+
+    def _configure(self):
+        """ADRを止め (データレートはこちらで決める)、送信ごとにリンクチェックを付ける"""
+        self._configured = True
+        self.lora.set_adr(False)
+        if self.link_check:
+            self.lora.set_link_check(2)
+        self._apply(self.data_rate, force=True)
+
+    def _apply(self, data_rate, force=False):
+        if data_rate == self.data_rate and not force:
+            return
+        if not self.lora.set_data_rate(data_rate):
+            print(f"[LinkAdapter] Failed to set DR{data_rate}. Keep DR{self.data_rate}")
+            return
+        if data_rate != self.data_rate:
+            self.changes += 1
+            metrics.inc("lora_data_rate_changes")
+            self.lora.link.reset_streak()
+        self.data_rate = data_rate
+        if self.scheduler is not None:
+            self.scheduler.set_data_rate(data_rate)
+
+    def prepare(self):
+        """
+        送信の直前に呼ぶ (Join後)。データレートを選んで反映する
+        :return: (confirm 0/1, nbtrials)
+        """
+        if not self._configured:
+            self._configure()
+        decision = self.policy.decide(self.lora.link, self.data_rate)
+        if decision["data_rate"] != self.data_rate:
+            previous = self.data_rate
+            self._apply(decision["data_rate"])
+            if self.data_rate != previous:
+                print(f"[LinkAdapter] DR{previous} -> DR{self.data_rate} ({decision['reason']})")
+        self.decision = decision
+        return int(decision["confirmed"]), decision["nbtrials"]
+
+    def stats(self):
+        return {
+            "data_rate": self.data_rate,
+            "changes": self.changes,
+            "decision": self.decision,
+            "link": self.lora.link.summary(),
+        }
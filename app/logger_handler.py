@@ -1,55 +1,104 @@
-import csv
 import os
 
+from .csv_writer import RotatingCsvWriter
+from .metrics import metrics
+
 class LoggerHandler:
-    def __init__(self, log_dir="data/logs"):
+    def __init__(self, log_dir="data/logs", flush_rows=32, flush_interval=10.0, fsync_interval=60.0,
+                 rotate="daily", max_bytes=0, compress=True, store=None):
+        """
+        :param flush_rows: この行数たまったらファイルに書き込む
+        :param flush_interval: 最後の書き込みからこの秒数経ったら書き込む
+        :param fsync_interval: fsync の最小間隔 [秒] (0 なら書き込みごと、None ならしない)
+        :param rotate: "daily" / "size" / "none"
+        :param max_bytes: 1ファイルの最大サイズ (0 なら無制限)
+        :param compress: 退避したログを gzip 圧縮する
+        :param store: TimeSeriesStore (指定するとCSVと同じ内容を記録する)
+        """
         self.log_dir = log_dir
+        self.store = store
         os.makedirs(self.log_dir, exist_ok=True)
         
         self.file_all = os.path.join(self.log_dir, "logAll.csv")
         self.file_person = os.path.join(self.log_dir, "logPerson.csv")
         self.file_lora = os.path.join(self.log_dir, "logLoRa.csv")
 
-    def save(self, dt, results):
+        options = dict(flush_rows=flush_rows, flush_interval=flush_interval, fsync_interval=fsync_interval,
+                       rotate=rotate, max_bytes=max_bytes, compress=compress)
+        # CarriedOver: 変化がなく推論を省略し、前回の結果を引き継いだ周期なら 1
+        header = ['Date', 'Time', 'Class', 'Count', 'CarriedOver']
+        self.writer_all = RotatingCsvWriter(self.file_all, header, **options)
+        self.writer_person = RotatingCsvWriter(self.file_person, header, **options)
+        # 通信ログは件数が少なく、後から原因を追うことが多いので毎回書き込む
+        lora_options = dict(options, flush_rows=1)
+        self.writer_lora = RotatingCsvWriter(self.file_lora, ['Date', 'Time', 'Type', 'Payload', 'Status'],
+                                             **lora_options)
+
+    @metrics.timed("logger_save")
+    def save(self, dt, results, carried_over=False):
+        """
+        :param carried_over: 推論を省略して前回の結果を引き継いだ周期か
+        """
         # 集計
         counts = {}
         for res in results:
             cname = res['class_name']
             counts[cname] = counts.get(cname, 0) + 1
 
+        date_str, time_str = self._format_dt(dt)
+        carried = int(bool(carried_over))
+
         # logPerson.csv (Personのみ)
         person_count = counts.get("person", 0)
-        self._write_csv(self.file_person, dt, "person", person_count)
+        self.writer_person.write_row([date_str, time_str, "person", person_count, carried], dt)
 
         # logAll.csv (全クラス)
         if len(counts) > 0:
-            for cname, count in counts.items():
-                self._write_csv(self.file_all, dt, cname, count)
+            self.writer_all.write_rows([[date_str, time_str, cname, count, carried]
+                                        for cname, count in counts.items()], dt)
+
+        if self.store:
+            self.store.record(dt, dict(counts, person=person_count), carried_over=carried_over)
         
         return person_count
     
     
+    @metrics.timed("logger_save_lora")
     def save_lora(self, dt, comm_type, payload, status):
-        file_exists = os.path.isfile(self.file_lora)
-        date_str = dt.strftime('%Y-%m-%d')
-        time_str = dt.strftime('%H:%M:%S')
-        
-        with open(self.file_lora, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            # ヘッダー作成
-            if not file_exists:
-                writer.writerow(['Date', 'Time', 'Type', 'Payload', 'Status'])
-            # データ書き込み
-            writer.writerow([date_str, time_str, comm_type, payload, status])
-
-
-    def _write_csv(self, filepath, dt, class_name, count):
-        file_exists = os.path.isfile(filepath)
-        date_str = dt.strftime('%Y-%m-%d')
-        time_str = dt.strftime('%H:%M:%S')
-        
-        with open(filepath, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(['Date', 'Time', 'Class', 'Count'])
-            writer.writerow([date_str, time_str, class_name, count])
\ No newline at end of file
+        date_str, time_str = self._format_dt(dt)
+        self.writer_lora.write_row([date_str, time_str, comm_type, payload, status], dt)
+        if self.store:
+            self.store.record_lora(dt, comm_type, payload, status)
+
+    def configure(self, **options):
+        """
+        書き込みのバッファ・退避設定を変更する (flush_rows, flush_interval, fsync_interval, rotate, max_bytes, compress)
+        通信ログは常に1行ずつ書き込む
+        """
+        for writer in (self.writer_all, self.writer_person, self.writer_lora):
+            for name, value in options.items():
+                if name == "flush_rows" and writer is self.writer_lora:
+                    continue
+                setattr(writer, name, value)
+
+    def flush(self):
+        for writer in (self.writer_all, self.writer_person, self.writer_lora):
+            writer.flush()
+
+    def close(self):
+        """バッファを書き込み、ファイルを閉じる (終了時に呼ぶ)"""
+        for writer in (self.writer_all, self.writer_person, self.writer_lora):
+            writer.close()
+        if self.store:
+            self.store.close()
+
+    def stats(self):
+        return {
+            "logAll": self.writer_all.stats(),
+            "logPerson": self.writer_person.stats(),
+            "logLoRa": self.writer_lora.stats(),
+        }
+
+    def _format_dt(self, dt):
+        date_str, time_str = dt.strftime('%Y-%m-%d %H:%M:%S').split(' ')
+        return date_str, time_str
@@ -1,62 +1,280 @@
 import serial
 import time
 import binascii
+import random
+import re
+import threading
+from collections import deque
+from .airtime import lorawan_time_on_air
+from .link_adapter import LinkStats
+from .metrics import metrics
+
+
+class _PendingCommand:
+    """応答待ちのATコマンド"""
+
+    def __init__(self, command, terminators):
+        self.command = command
+        self.terminators = terminators
+        self.lines = []
+        self.done = threading.Event()
+        self.timed_out = False
+
+    def is_final(self, line):
+        for term in self.terminators:
+            if line == term or line.startswith(term + ":") or line.startswith(term + " "):
+                return True
+        return False
+
 
 class LoRaCommunicator:
-    def __init__(self, port='/dev/ttyS0', baudrate=9600, timeout=1):
+    # 通常コマンドの完了行
+    DEFAULT_TERMINATORS = ("OK", "ERROR", "+CME ERROR")
+
+    # コマンドごとの (完了行, タイムアウト秒)。ここにないコマンドは DEFAULT_TIMEOUT
+    COMMAND_SPECS = {
+        # 送信は OK+SEND (受付) の後、送信完了で OK+SENT / 失敗で ERR+SENT が返る
+        "AT+DTRX": (("OK+SENT", "ERR+SENT", "ERROR", "+CME ERROR"), 15.0),
+        "AT+IREBOOT": (DEFAULT_TERMINATORS, 3.0),
+        "AT+DJOIN": (DEFAULT_TERMINATORS, 3.0),
+        "AT+CSAVE": (DEFAULT_TERMINATORS, 3.0),
+    }
+    DEFAULT_TIMEOUT = 1.0
+    # 1回の送信ごとに、送信完了から RX2 (2秒後) の受信ウィンドウが閉じるまでの時間 [秒]
+    RX_WINDOWS = 3.0
+    # Confirmed で受信確認がないとき、再送までに待つ時間の上限 [秒] (ACK_TIMEOUT)
+    ACK_TIMEOUT = 3.0
+
+    def __init__(self, port='/dev/ttyS0', baudrate=9600, timeout=0.1, link_window=20):
         """
         初期化処理
         :param port: シリアルポート (Pi Zero 2 Wは通常 /dev/ttyS0)
         :param baudrate: A660デフォルトは9600 [cite: 478]
-        :param timeout: シリアル読み込みタイムアウト
+        :param timeout: 受信スレッドのシリアル読み込みタイムアウト
+        :param link_window: リンク情報の統計を取る直近の送信回数
         """
         self.ser = serial.Serial(port, baudrate, timeout=timeout)
         self.debug = True  # デバッグ表示用フラグ
 
-    def _send_at(self, command, wait_time=0.1):
+        self.timeouts = 0  # タイムアウトしたコマンド数
+        self.unsolicited = deque(maxlen=50)  # コマンド外で受信した行
+        self._urc_handlers = {}
+        self._downlinks = deque(maxlen=16)
+        self._downlink_event = threading.Event()
+        self._join_event = threading.Event()
+        self.joined = threading.Event()  # ネットワークに参加済み (送信してよい)
+        self._join_status = None
+        self.data_rate = None  # 現在のデータレート (AT+CDATARATE で設定・確認するまで不明)
+        self.link = LinkStats(window=link_window)  # 送信ごとのリンク情報と結果
+
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self._command_lock = threading.Lock()
+
+        self.register_urc("+DULSTAT", self._on_join_status)
+        self.register_urc("+CJOIN", self._on_join_status)
+        self.register_urc("+DJOIN", self._on_join_status)
+        self.register_urc("OK+RECV", self._on_downlink)
+        self.register_urc("+DRX", self._on_downlink)
+        self.register_urc("+CLINKCHECK", self._on_link_check)
+
+        # 受信スレッド
+        self._running = True
+        self._rx_buffer = b""
+        self._reader = threading.Thread(target=self._read_loop, name="lora-reader", daemon=True)
+        self._reader.start()
+
+    # ------------------------------------------------------------------
+    # 受信処理
+    # ------------------------------------------------------------------
+    def register_urc(self, prefix, callback):
         """
-        ATコマンドを送信し、レスポンスを返す内部メソッド
-        コマンド末尾には <CR> (\r) を付与 [cite: 466]
+        非同期通知のコールバックを登録する
+        コールバックは受信スレッドから呼ばれるため、ここからATコマンドを送ってはいけない
+        :param prefix: 対象行の接頭辞 (例: "OK+RECV")
+        :param callback: callback(line)
         """
-        full_command = command + "\r"
-        if self.debug:
-            print(f"[Send] {command}")
-        
-        self.ser.write(full_command.encode('utf-8'))
-        time.sleep(wait_time)
-        
-        response = []
-        while self.ser.in_waiting > 0:
+        self._urc_handlers.setdefault(prefix, []).append(callback)
+
+    def _read_loop(self):
+        while self._running:
             try:
-                line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    response.append(line)
+                data = self.ser.read(self.ser.in_waiting or 1)
             except Exception as e:
-                print(f"Read Error: {e}")
-                
+                if self._running:
+                    print(f"Read Error: {e}")
+                    time.sleep(0.1)
+                continue
+            if data:
+                self._feed(data)
+
+    def _feed(self, data):
+        """受信バイト列を行単位に分割して処理する (行の途中はバッファに残す)"""
+        self._rx_buffer += data
+        parts = re.split(rb"[\r\n]+", self._rx_buffer)
+        self._rx_buffer = parts.pop()
+        for raw in parts:
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if line:
+                self._handle_line(line)
+
+    def _handle_line(self, line):
         if self.debug:
-            for line in response:
-                print(f"[Recv] {line}")
-                
-        return response
+            print(f"[Recv] {line}")
+
+        with self._pending_lock:
+            cmd = self._pending
+            if cmd is not None:
+                cmd.lines.append(line)
+                if cmd.is_final(line):
+                    cmd.done.set()
+
+        handled = False
+        for prefix, callbacks in list(self._urc_handlers.items()):
+            if line.startswith(prefix):
+                handled = True
+                for callback in callbacks:
+                    try:
+                        callback(line)
+                    except Exception as e:
+                        print(f"URC Callback Error: {e}")
+
+        if cmd is None and not handled:
+            self.unsolicited.append(line)
+
+    def _on_join_status(self, line):
+        status = self._parse_join_line(line)
+        if status is not None:
+            self._join_status = status
+            self._join_event.set()
+
+    def _on_downlink(self, line):
+        data = self._parse_downlink(line)
+        if data:
+            self._downlinks.append(data)
+            self._downlink_event.set()
+
+    def _on_link_check(self, line):
+        result = self._parse_link_check(line)
+        if result is None:
+            return
+        if result["status"] != 0:
+            self.link.add_check_failure()
+            metrics.inc("lora_link_check_failures")
+            return
+        self.link.add_check(result["margin"], result["gateways"], result["rssi"], result["snr"], self.data_rate)
+
+    # ------------------------------------------------------------------
+    # コマンド送信
+    # ------------------------------------------------------------------
+    def _send_at(self, command, wait_time=None):
+        """
+        ATコマンドを送信し、レスポンスを返す内部メソッド
+        コマンド末尾には <CR> (\r) を付与 [cite: 466]
+        完了行 (OK, ERROR など) を受信した時点で戻る
+        :param wait_time: タイムアウト秒。省略時はコマンドごとの既定値
+        """
+        key = re.split(r"[=?]", command, maxsplit=1)[0].upper()
+        terminators, timeout = self.COMMAND_SPECS.get(key, (self.DEFAULT_TERMINATORS, self.DEFAULT_TIMEOUT))
+        if wait_time is not None:
+            timeout = wait_time
+
+        with self._command_lock:
+            cmd = _PendingCommand(command, terminators)
+            with self._pending_lock:
+                self._pending = cmd
+
+            if self.debug:
+                print(f"[Send] {command}")
+            self.ser.write((command + "\r").encode('utf-8'))
+
+            t0 = time.perf_counter()
+            if not cmd.done.wait(timeout):
+                cmd.timed_out = True
+                self.timeouts += 1
+                metrics.inc("lora_at_timeouts", command=key)
+                if self.debug:
+                    print(f"[Timeout] {command} ({timeout} sec)")
+            metrics.observe("lora_at_command", time.perf_counter() - t0, command=key)
+
+            with self._pending_lock:
+                self._pending = None
+
+        return cmd.lines
+
+    def _wait_ready(self, timeout=5.0):
+        """再起動後、モジュールがATコマンドに応答するまで待つ"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if "OK" in self._send_at("AT", wait_time=0.5):
+                return True
+        return False
+
+    def _parse_join_line(self, line):
+        """
+        +DULSTAT:04 / +DULSTAT=04 などから状態番号を取り出す
+        +CJOIN:OK / +CJOIN:FAIL 形式の通知は 4 / 5 に読み替える
+        """
+        match = re.match(r"\+DULSTAT[:=]\s*(\d+)", line)
+        if match:
+            return int(match.group(1))
+        if line.startswith("+CJOIN") or line.startswith("+DJOIN"):
+            if "OK" in line or "SUCCESS" in line.upper():
+                return 4
+            if "FAIL" in line.upper():
+                return 5
+        return None
+
+    def _parse_downlink(self, line):
+        """
+        受信データ行 (+DRX=5,48656C6C6F / OK+RECV:02,01,05,48656C6C6F) を文字列に戻す
+        データがない場合は None
+        """
+        try:
+            if line.startswith("+DRX"):
+                parts = line.split(",")
+                if len(parts) >= 2:
+                    length = int(re.split(r"[=:]", parts[0], maxsplit=1)[1])
+                    if length > 0:
+                        return binascii.unhexlify(parts[1]).decode('utf-8', errors='ignore')
+            elif line.startswith("OK+RECV"):
+                parts = line.split(":", 1)[1].split(",")
+                if len(parts) >= 4 and int(parts[2], 16) > 0:
+                    return binascii.unhexlify(parts[3]).decode('utf-8', errors='ignore')
+        except Exception as e:
+            print(f"Parse Error: {e}")
+        return None
+
+    def _parse_link_check(self, line):
+        """
+        リンクチェックの結果 (+CLINKCHECK: 0,20,1,-50,10) を取り出す
+        値は 結果 (0=成功), 復調マージン [dB], 受信ゲートウェイ数, ダウンリンクのRSSI [dBm], SNR [dB]
+        :return: {"status", "margin", "gateways", "rssi", "snr"}。結果の行でなければ None
+        """
+        match = re.match(r"\+CLINKCHECK[:=]\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*(\d+)\s*,\s*(-?\d+)\s*,\s*(-?\d+)", line)
+        if not match:
+            return None
+        status, margin, gateways, rssi, snr = (int(value) for value in match.groups())
+        return {"status": status, "margin": margin, "gateways": gateways, "rssi": rssi, "snr": snr}
 
     def connect_network(self, dev_eui, app_eui, app_key, region=3):
         """
         LoRaWANネットワークへの接続 (Join) を行う
         設定: Class A, OTAA
-        :param region: 3 = AS923-1-JP (日本) 
+        :param region: 3 = AS923-1-JP (日本)
         """
         print("--- Configuring LoRa Module ---")
-        
+
         # 1. リセット (念のため) [cite: 670]
-        self._send_at("AT+IREBOOT=0", wait_time=2)
+        self._send_at("AT+IREBOOT=0")
+        self._wait_ready()
 
-        # 2. リージョン設定 (日本: AS923-1-JP) 
+        # 2. リージョン設定 (日本: AS923-1-JP)
         self._send_at(f"AT+RREGION={region}")
-        
+
         # 3. Class A設定 [cite: 568]
         self._send_at("AT+CCLASS=0")
-        
+
         # 4. OTAAモード設定 [cite: 519]
         self._send_at("AT+CJOINMODE=0")
 
@@ -70,86 +288,190 @@ class LoRaCommunicator:
 
         # 7. Join開始 (Start, Auto-off, 8s interval, 3 retries) [cite: 626]
         print("--- Starting JOIN Request ---")
-        self._send_at("AT+DJOIN=1,0,8,3", wait_time=1)
+        self._join_event.clear()
+        self._join_status = None
+        self._send_at("AT+DJOIN=1,0,8,3")
 
         # Join完了待ち (ステータス確認ループ)
-        # AT+DULSTAT? -> 04: JOIN succeeded, 05: JOIN fails 
+        # AT+DULSTAT? -> 04: JOIN succeeded, 05: JOIN fails
+        # 状態通知を受信した時点でポーリング間隔を待たずに判定する
         max_retries = 30
         for _ in range(max_retries):
-            resp = self._send_at("AT+DULSTAT?", wait_time=1)
-            for line in resp:
-                if "+DULSTAT:04" in line or "+DULSTAT:03" in line:
-                    print(">>> Network Joined Successfully! <<<")
-                    return True
-                if "+DULSTAT:05" in line:
-                    print(">>> Join Failed. Check Keys or Gateway coverage. <<<")
-                    return False
-            time.sleep(2) # ポーリング間隔
-            
+            self._send_at("AT+DULSTAT?")
+            if self._join_status in (3, 4):
+                print(">>> Network Joined Successfully! <<<")
+                self.joined.set()
+                return True
+            if self._join_status == 5:
+                print(">>> Join Failed. Check Keys or Gateway coverage. <<<")
+                return False
+            self._join_event.clear()
+            self._join_event.wait(2) # ポーリング間隔
+
         print(">>> Join Timed out <<<")
         return False
 
-    def send_data(self, data_str, confirm=0):
+    def resume_session(self):
+        """
+        モジュールに前回のJoinのセッションが残っていれば、再起動・再Joinせずにそのまま使う
+        (プロセスだけが再起動した場合。AT+DULSTAT? 1回で確認する)
+        :return: セッションが有効なら True
+        """
+        if self.get_lora_status_summary() == "CONNECTED":
+            print(">>> Existing LoRaWAN session is active. Skip join. <<<")
+            self.joined.set()
+            return True
+        return False
+
+    def join_with_backoff(self, dev_eui, app_eui, app_key, region=3, stop_event=None,
+                          base_delay=15.0, max_delay=600.0, max_attempts=None):
+        """
+        Joinに成功するまで間隔を指数的に伸ばしながら繰り返す
+        待ち時間は [delay/2, delay] の乱数にして、停電復帰時などに複数台が同時にJoinしないようにする
+        :param stop_event: セットされたら待機を打ち切って False を返す
+        :param max_attempts: 試行回数の上限 (None なら成功するまで)
+        """
+        delay = base_delay
+        attempt = 0
+        while max_attempts is None or attempt < max_attempts:
+            attempt += 1
+            print(f"Joining with DevEUI: {dev_eui} (attempt {attempt}) ...")
+            if self.connect_network(dev_eui, app_eui, app_key, region):
+                return True
+            metrics.inc("lora_join_failures")
+            wait = random.uniform(delay / 2, delay)
+            print(f"Join failed. Retrying in {wait:.0f} sec")
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+            delay = min(delay * 2, max_delay)
+        return False
+
+    def send_timeout(self, length, confirm=0, nbtrials=2):
+        """
+        AT+DTRX の完了 (OK+SENT) を待つ時間 [秒]
+        nbtrials 回分の送信時間と受信ウィンドウ (Confirmed なら再送までの待ち時間も) を見込む。
+        データレートが不明なら最も遅い DR0 として見積もり、COMMAND_SPECS の値より短くはしない
+        :param length: アプリケーションペイロード長 [byte]
+        """
+        data_rate = self.data_rate if self.data_rate is not None else 0
+        attempt = lorawan_time_on_air(length, data_rate=data_rate) + self.RX_WINDOWS
+        if confirm:
+            attempt += self.ACK_TIMEOUT
+        return max(self.COMMAND_SPECS["AT+DTRX"][1], nbtrials * attempt + 1.0)
+
+    def send_data(self, data_str, confirm=0, nbtrials=2, timeout=None):
         """
         データを送信する
-        :param data_str: 送信する文字列 (自動的にHex変換されます)
-        :param confirm: 0=Unconfirmed, 1=Confirmed 
+        :param data_str: 送信する文字列またはバイト列 (自動的にHex変換されます)
+        :param confirm: 0=Unconfirmed, 1=Confirmed
+        :param nbtrials: 送信回数 (Unconfirmed は同じフレームの繰り返し回数、Confirmed は受信確認がないときの再送回数)
+        :param timeout: 送信完了を待つ時間 [秒]。None なら send_timeout() で見積もる
         """
-        # 文字列をHex文字列に変換 ("Hello" -> "48656C6C6F")
-        hex_payload = binascii.hexlify(data_str.encode('utf-8')).decode('utf-8').upper()
+        # Hex文字列に変換 ("Hello" -> "48656C6C6F")
+        data = data_str if isinstance(data_str, bytes) else data_str.encode('utf-8')
+        hex_payload = binascii.hexlify(data).decode('utf-8').upper()
         length = len(hex_payload) // 2
-        
-        # AT+DTRX=<confirm>,<nbtrials>,<len>,<payload> 
-        # 再送回数(nbtrials)はデフォルト2として固定しています
-        command = f"AT+DTRX={confirm},2,{length},{hex_payload}"
-        
-        resp = self._send_at(command, wait_time=2)
-        
-        # 簡易的な成功判定
+
+        # AT+DTRX=<confirm>,<nbtrials>,<len>,<payload>
+        command = f"AT+DTRX={confirm},{nbtrials},{length},{hex_payload}"
+
+        self._downlink_event.clear()
+        with metrics.timer("lora_send"):
+            resp = self._send_at(command, timeout if timeout is not None else
+                                 self.send_timeout(length, confirm, nbtrials))
+
+        # 送信完了通知 (OK+SENT) を受信したときだけ成功とする
+        # OK+SEND (受付) だけでタイムアウトした場合は届いたか分からないので失敗として扱い、レコードを残す
+        metrics.inc("lora_sends")
+        success = False
         for line in resp:
-            if "OK+SENT" in line: # 送信完了通知 
-                return True
-            if "ERROR" in line:
-                return False
+            if "OK+SENT" in line: # 送信完了通知
+                success = True
+                break
+            if "ERROR" in line or "ERR+SENT" in line:
+                break
+        if not success:
+            # エラー応答だけでなく、OK+SENT が来ないままタイムアウトした送信も失敗として数える
+            metrics.inc("lora_send_failures")
+        # タイムアウトもリンクの失敗として記録する (成功率を高く見積もってDRを上げないように)
+        self.link.add_result(success)
+        return success
+
+    def set_data_rate(self, data_rate):
+        """
+        データレートを設定する (ADRが有効だとネットワークに上書きされるので set_adr(False) と併用する)
+        :return: 受け付けられたら True
+        """
+        if "OK" not in self._send_at(f"AT+CDATARATE={data_rate}"):
+            return False
+        self.data_rate = data_rate
         return True
 
+    def query_data_rate(self):
+        """
+        現在のデータレートを確認する (+CDATARATE:2)
+        :return: データレート。確認できなければ None
+        """
+        for line in self._send_at("AT+CDATARATE?", wait_time=0.5):
+            match = re.match(r"\+CDATARATE[:=]\s*(\d+)", line)
+            if match:
+                self.data_rate = int(match.group(1))
+                return self.data_rate
+        return None
+
+    def set_adr(self, enabled):
+        """ADR (ネットワークによるデータレートの制御) の有効・無効"""
+        return "OK" in self._send_at(f"AT+CADR={int(bool(enabled))}")
+
+    def set_link_check(self, mode=2):
+        """
+        リンクチェックの設定 (結果は +CLINKCHECK の通知で届き、link に追加される)
+        :param mode: 0=無効, 1=次の送信で1回, 2=送信のたびに
+        """
+        return "OK" in self._send_at(f"AT+CLINKCHECK={mode}")
+
+    def wait_downlink(self, timeout):
+        """
+        受信ウィンドウ中のダウンリンク通知を待つ
+        通知を受信した時点で戻る
+        :return: 通知があれば True
+        """
+        if self._downlinks:
+            return True
+        return self._downlink_event.wait(timeout)
+
     def receive_data(self):
         """
         受信バッファを確認し、データがあれば返す
-        AT+DRX? を使用 
+        非同期通知で受信済みのデータがあればそれを返し、なければ AT+DRX? を使用
         :return: 受信した文字列 (データがない場合は None)
         """
-        resp = self._send_at("AT+DRX?", wait_time=0.2)
-        
-        # レスポンス例: +DRX=5,48656C6C6F
-        for line in resp:
-            if line.startswith("+DRX="):
-                try:
-                    parts = line.split(",")
-                    if len(parts) >= 2:
-                        length = int(parts[0].split("=")[1])
-                        if length > 0:
-                            hex_data = parts[1]
-                            # Hexを文字列に戻す
-                            decoded_str = binascii.unhexlify(hex_data).decode('utf-8', errors='ignore')
-                            return decoded_str
-                except Exception as e:
-                    print(f"Parse Error: {e}")
+        if self._downlinks:
+            return self._downlinks.popleft()
+
+        # レスポンス例: +DRX=5,48656C6C6F (受信スレッドで _downlinks に格納される)
+        self._send_at("AT+DRX?", wait_time=0.5)
+        if self._downlinks:
+            return self._downlinks.popleft()
         return None
-    
+
     def get_lora_status_summary(self):
         """
         現在のモジュールの状態を総合的に判断する
         """
         resp = self._send_at("AT+DULSTAT?", wait_time=0.5)
         for line in resp:
-            if "+DULSTAT=" in line:
-                status = int(line.split("=")[1])
-                if status in [3, 4, 7, 8]:
-                    return "CONNECTED"
-                if status == 5:
-                    return "JOIN_FAILED"
+            status = self._parse_join_line(line)
+            if status in [3, 4, 7, 8]:
+                return "CONNECTED"
+            if status == 5:
+                return "JOIN_FAILED"
         return "IDLE_OR_UNKNOWN"
 
     def close(self):
-        self.ser.close()
\ No newline at end of file
+        self._running = False
+        self._reader.join(timeout=2)
+        self.ser.close()
@@ -0,0 +1,328 @@
+"""
+ステージごとの処理時間とカウンタの計測
+
+各モジュールは共通のレジストリ (metrics) に処理時間・件数を記録する。
+処理時間は直近 window 件のリングバッファに保持し、出力時にだけ p50/p95/p99 を計算するので
+記録側のコストは perf_counter 2回と配列への代入程度 (常時有効にしておける)。
+
+MetricsExporter を起動すると、
+  - http://<bind>:<port>/metrics に Prometheus のテキスト形式
+  - http://<bind>:<port>/metrics.json と snapshot_path に JSON
+で公開する。
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """直近 window 件の値を保持し、分位点を求める"""
+
+    def __init__(self, window=1024):
+        self._values = [0.0] * window
+        self._window = window
+        self.count = 0  # 起動からの累計
+        self.sum = 0.0
+
+    def observe(self, value):
+        self._values[self.count % self._window] = value
+        self.count += 1
+        self.sum += value
+
+    def _filled(self):
+        return self._values[:min(self.count, self._window)]
+
+    def quantiles(self, qs=QUANTILES):
+        """分位点 (numpy.quantile の既定と同じ線形補間)"""
+        values = sorted(self._filled())
+        if not values:
+            return {q: None for q in qs}
+        result = {}
+        for q in qs:
+            position = q * (len(values) - 1)
+            lower = int(position)
+            upper = min(lower + 1, len(values) - 1)
+            result[q] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+        return result
+
+    def max(self):
+        values = self._filled()
+        return max(values) if values else None
+
+
+class _Timer:
+    __slots__ = ("_registry", "_key", "_t0")
+
+    def __init__(self, registry, key):
+        self._registry = registry
+        self._key = key
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._registry._observe(self._key, time.perf_counter() - self._t0)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+class MetricsRegistry:
+    """
+    処理時間 (秒)・カウンタ・ゲージの置き場
+    名前は Prometheus 形式で出力するときに 処理時間は <name>_seconds、カウンタは <name>_total になる
+    """
+
+    def __init__(self, window=1024, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def configure(self, window=None, enabled=None):
+        if window is not None and window != self.window:
+            with self._lock:
+                self.window = window
+                self._histograms = {}
+        if enabled is not None:
+            self.enabled = enabled
+
+    # ------------------------------------------------------------------
+    # 記録
+    # ------------------------------------------------------------------
+    def timer(self, name, **labels):
+        """with metrics.timer("detector_invoke"): ... の形で処理時間を記録する"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def timed(self, name, **labels):
+        """関数の処理時間を記録するデコレータ"""
+        def _decorator(func):
+            def _wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            _wrapper.__name__ = func.__name__
+            _wrapper.__doc__ = func.__doc__
+            return _wrapper
+        return _decorator
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._observe(_key(name, labels), seconds)
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = RollingHistogram(self.window)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, func, **labels):
+        """
+        出力時に func() を呼んで値を得るゲージを登録する (キューの長さ・温度など)
+        func が None を返したら出力しない
+        """
+        with self._lock:
+            self._gauges[_key(name, labels)] = func
+
+    def counter(self, name, **labels):
+        return self._counters.get(_key(name, labels), 0)
+
+    # ------------------------------------------------------------------
+    # 出力
+    # ------------------------------------------------------------------
+    def _collect(self):
+        with self._lock:
+            histograms = [(key, h.quantiles(), h.max(), h.count, h.sum) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        values = []
+        for key, func in gauges:
+            try:
+                value = func()
+            except Exception:
+                value = None
+            if value is not None:
+                values.append((key, float(value)))
+        return sorted(histograms), sorted(counters), sorted(values)
+
+    def snapshot(self):
+        """JSONにできる形の現在値"""
+        histograms, counters, gauges = self._collect()
+
+        def _name(key):
+            name, labels = key
+            return name + "".join(f"[{v}]" for _, v in labels)
+
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "stages": {
+                _name(key): {
+                    "count": count,
+                    "mean_ms": sum_ / count * 1000 if count else None,
+                    **{f"p{int(q * 100)}_ms": (v * 1000 if v is not None else None) for q, v in quantiles.items()},
+                    "max_ms": max_ * 1000 if max_ is not None else None,
+                }
+                for key, quantiles, max_, count, sum_ in histograms
+            },
+            "counters": {_name(key): value for key, value in counters},
+            "gauges": {_name(key): value for key, value in gauges},
+        }
+
+    def render_prometheus(self, prefix="loracam"):
+        """Prometheus のテキスト形式 (version 0.0.4)"""
+        histograms, counters, gauges = self._collect()
+        lines = []
+        typed = set()
+
+        def _labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        def _type(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (name, labels), quantiles, _, count, sum_ in histograms:
+            metric = f"{prefix}_{name}_seconds"
+            _type(metric, "summary")
+            for q, value in quantiles.items():
+                if value is not None:
+                    lines.append(f"{metric}{_labels(labels, [('quantile', q)])} {value:.6g}")
+            lines.append(f"{metric}_sum{_labels(labels)} {sum_:.6g}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{name}_total"
+            _type(metric, "counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            metric = f"{prefix}_{name}"
+            _type(metric, "gauge")
+            lines.append(f"{metric}{_labels(labels)} {value:.6g}")
+        metric = f"{prefix}_uptime_seconds"
+        _type(metric, "gauge")
+        lines.append(f"{metric} {time.time() - self.started:.1f}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        """JSONスナップショットを書き込む (途中で読まれても壊れないよう置き換えで書く)"""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+
+# 各モジュールが共有するレジストリ
+metrics = MetricsRegistry()
+
+
+class MetricsExporter:
+    """レジストリの内容をHTTPとファイルで公開する"""
+
+    def __init__(self, registry=metrics, bind="127.0.0.1", port=9108, snapshot_path=None, snapshot_interval=60.0):
+        """
+        :param bind, port: HTTPの待ち受けアドレス (port が 0 / None ならHTTPは使わない)
+        :param snapshot_path: JSONスナップショットの保存先 (None なら保存しない)
+        :param snapshot_interval: スナップショットを書き込む間隔 [秒]
+        """
+        self.registry = registry
+        self.bind = bind
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._server = None
+        self._threads = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self.port:
+            registry = self.registry
+
+            class _Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    path = self.path.split("?", 1)[0]
+                    if path == "/metrics":
+                        body = registry.render_prometheus().encode()
+                        content_type = "text/plain; version=0.0.4; charset=utf-8"
+                    elif path == "/metrics.json":
+                        body = json.dumps(registry.snapshot()).encode()
+                        content_type = "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # アクセスごとの出力はしない
+
+            self._server = ThreadingHTTPServer((self.bind, self.port), _Handler)
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            print(f"Metrics endpoint: http://{self.bind}:{self.port}/metrics")
+
+        if self.snapshot_path:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            thread = threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _snapshot_loop(self):
+        while not self._stop_event.wait(self.snapshot_interval):
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        try:
+            self.registry.write_snapshot(self.snapshot_path)
+        except OSError as e:
+            print(f"[Metrics] Failed to write snapshot: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.snapshot_path:
+            self._write_snapshot()
@@ -0,0 +1,138 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    推論前の簡易な変化検出
+
+    フレームを縮小したグレースケール画像にして比較し、変化した画素の割合が min_area 未満なら
+    推論を省略してよいと判定する。比較対象は
+      - "diff": 最後に推論したフレーム (ゆっくりした変化も積算されて検出される)
+      - "background": 移動平均の背景モデル (照明のゆるやかな変化に追従する)
+    変化がなくても force_every 周期ごとに必ず推論する。
+    """
+    MODES = ("diff", "background")
+
+    def __init__(self, width=160, threshold=25, min_area=0.002, mode="diff", alpha=0.05,
+                 force_every=10, masks=None, blur=5):
+        """
+        :param width: 比較用に縮小する幅 [px] (高さは縦横比を保つ)
+        :param threshold: 画素の輝度差がこれを超えたら変化とみなす (0-255)
+        :param min_area: 変化した画素の割合がこれ以上なら推論する (0-1)
+        :param mode: "diff" / "background"
+        :param alpha: background モードの背景更新率
+        :param force_every: 変化がなくてもこの周期数ごとに推論する (0 なら強制しない)
+        :param masks: 比較から除外する領域のリスト。各領域は正規化座標 (0-1) の多角形 [[x, y], ...]
+        :param blur: ノイズ除去のガウシアンぼかしのカーネルサイズ (0 ならなし)
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown motion gate mode: {mode}")
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.mode = mode
+        self.alpha = alpha
+        self.force_every = force_every
+        self.masks = masks or []
+        self.blur = blur
+
+        self._reference = None
+        self._mask = None
+        self._small_size = None
+        self._since_inference = 0
+
+        # カウンタ
+        self.frames = 0
+        self.skipped = 0
+        self.forced = 0
+        self.triggered = 0
+        self.last_change = 0.0
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def reset(self):
+        """比較対象を捨てる (次のフレームは必ず推論する)"""
+        self._reference = None
+
+    def set_masks(self, masks):
+        """除外領域を変更する (次のフレームでマスクを作り直す)"""
+        self.masks = masks or []
+        self._small_size = None
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        if self._small_size is None or self._small_size[2:] != (w, h):
+            small_h = max(1, round(h * self.width / w))
+            self._small_size = (self.width, small_h, w, h)
+            self._mask = self._build_mask(self.width, small_h)
+        small = cv2.resize(frame, self._small_size[:2], interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.blur:
+            small = cv2.GaussianBlur(small, (self.blur, self.blur), 0)
+        return small
+
+    def _build_mask(self, width, height):
+        if not self.masks:
+            return None
+        mask = np.full((height, width), 255, dtype=np.uint8)
+        for polygon in self.masks:
+            pts = np.array([[x * width, y * height] for x, y in polygon], dtype=np.int32)
+            cv2.fillPoly(mask, [pts], 0)
+        return mask
+
+    def check(self, frame):
+        """
+        :param frame: カメラ画像 (BGR)
+        :return: True なら推論する、False なら前回の結果を使ってよい
+        """
+        self.frames += 1
+        small = self._prepare(frame)
+
+        if self._reference is None:
+            self._reference = small.astype(np.float32) if self.mode == "background" else small
+            self._since_inference = 0
+            self.triggered += 1
+            return True
+
+        if self.mode == "background":
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self._reference))
+            cv2.accumulateWeighted(small, self._reference, self.alpha)
+        else:
+            diff = cv2.absdiff(small, self._reference)
+
+        _, changed = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        if self._mask is not None:
+            changed = cv2.bitwise_and(changed, self._mask)
+            area = cv2.countNonZero(self._mask)
+        else:
+            area = changed.size
+        self.last_change = cv2.countNonZero(changed) / area if area else 0.0
+
+        self._since_inference += 1
+        if self.last_change >= self.min_area:
+            self.triggered += 1
+        elif self.force_every and self._since_inference >= self.force_every:
+            self.forced += 1
+        else:
+            self.skipped += 1
+            return False
+
+        # 推論するフレームを次の比較対象にする
+        if self.mode == "diff":
+            self._reference = small
+        self._since_inference = 0
+        return True
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "triggered": self.triggered,
+            "skip_ratio": self.skip_ratio,
+            "last_change": self.last_change,
+        }
@@ -0,0 +1,198 @@
+"""
+送信待ちレコードのディスク上の保管場所 (store-and-forward)
+
+固定サイズのファイルを mmap し、固定長スロットのリングバッファとして使う。
+レコードには通し番号 (seq) を振り、スロット seq % slots に書き込む。送信が確認できたら
+そのスロットの状態1バイトだけを書き換える (ack)。ファイルの大きさは slots * slot_size で一定で、
+満杯になったら最も古いスロットから上書きする。
+
+スロットの形式 (リトルエンディアン):
+  magic(2) state(1) reserved(1) seq(4) length(2) crc32(4) payload(length)
+crc32 は seq・length・payload に対して計算する。書き込み途中で電源が落ちたスロットは
+crc が合わないので、起動時の走査で捨てる。state は crc に含めないので、ack は1バイトの書き換えで済む。
+
+mmap への書き込みはプロセスが落ちてもページキャッシュに残るため、再起動 (Restart=always) では失われない。
+電源断に備えたディスクへの書き出し (msync) は sync_interval 秒に1回にまとめ、SDカードへの書き込み回数を抑える。
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+MAGIC = 0x4F42  # "BO"
+STATE_FREE = 0
+STATE_PENDING = 1
+STATE_ACKED = 2
+
+_HEADER = struct.Struct("<HBBIHI")
+_CRC_PART = struct.Struct("<IH")
+
+
+def encode_record(record):
+    """レコード ({"dt", "counts", "stats"}) をコンパクトなJSONにする"""
+    data = dict(record)
+    if isinstance(data.get("dt"), datetime.datetime):
+        data["dt"] = data["dt"].isoformat()
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def decode_record(payload):
+    record = json.loads(payload)
+    if record.get("dt"):
+        record["dt"] = datetime.datetime.fromisoformat(record["dt"])
+    if record.get("stats") is not None:
+        record["stats"] = {name: tuple(value) for name, value in record["stats"].items()}
+    return record
+
+
+class Outbox:
+    def __init__(self, path, slots=1024, slot_size=128, sync_interval=60.0):
+        """
+        :param path: 保管ファイルのパス (なければ作る。スロット数・大きさが違えば作り直す)
+        :param slots: スロット数 (保管できる送信待ちレコードの上限)
+        :param slot_size: 1スロットのバイト数 (ヘッダ 14 byte を含む)
+        :param sync_interval: ディスクへ書き出す間隔 [秒] (0 なら書き込みのたびに書き出す)
+        """
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.sync_interval = sync_interval
+        self.max_payload = slot_size - _HEADER.size
+
+        size = slots * slot_size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) != size:
+            print(f"[Outbox] Size of {path} does not match the config. Recreating it.")
+            os.remove(path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self._dirty = None  # 書き出していない範囲 (start, end)
+        self._last_sync = time.monotonic()
+
+        # カウンタ
+        self.appended = 0
+        self.acked = 0
+        self.overwritten = 0
+        self.corrupt = 0
+
+        self._pending = {}  # seq -> slot番号
+        self.next_seq = self._recover()
+
+    def _recover(self):
+        """全スロットを走査し、壊れていない未送信レコードを集める -> 次の seq"""
+        last_seq = -1
+        for slot in range(self.slots):
+            header = self._read_header(slot)
+            if header is False:
+                self.corrupt += 1
+            if not header:
+                continue
+            state, seq = header
+            last_seq = max(last_seq, seq)
+            if state == STATE_PENDING:
+                self._pending[seq] = slot
+        if self._pending:
+            print(f"[Outbox] Recovered {len(self._pending)} unsent record(s) from {self.path}")
+        if self.corrupt:
+            print(f"[Outbox] Discarded {self.corrupt} torn slot(s)")
+        return last_seq + 1
+
+    def _read_header(self, slot):
+        """スロットのヘッダを検証する -> (state, seq)。空きなら None、破損していれば False"""
+        offset = slot * self.slot_size
+        magic, state, _, seq, length, crc = _HEADER.unpack_from(self._mm, offset)
+        if magic != MAGIC or state == STATE_FREE:
+            return None
+        start = offset + _HEADER.size
+        if length > self.max_payload or crc != self._crc(seq, length, self._mm[start:start + length]):
+            return False
+        return state, seq
+
+    @staticmethod
+    def _crc(seq, length, payload):
+        return zlib.crc32(payload, zlib.crc32(_CRC_PART.pack(seq, length)))
+
+    def _touch(self, start, end):
+        self._dirty = (start, end) if self._dirty is None else (min(self._dirty[0], start), max(self._dirty[1], end))
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """書き込んだ範囲をディスクへ書き出す"""
+        if self._dirty is not None:
+            start = self._dirty[0] - self._dirty[0] % mmap.PAGESIZE
+            self._mm.flush(start, self._dirty[1] - start)
+            self._dirty = None
+        self._last_sync = time.monotonic()
+
+    # ------------------------------------------------------------------
+    def append(self, record):
+        """
+        レコードを保管する
+        :return: seq。大きすぎて保管できなければ None
+        """
+        payload = encode_record(record)
+        if len(payload) > self.max_payload:
+            print(f"[Outbox] Record of {len(payload)} bytes does not fit in a slot ({self.max_payload} bytes)")
+            return None
+        seq = self.next_seq
+        self.next_seq = (seq + 1) & 0xFFFFFFFF
+        slot = seq % self.slots
+        offset = slot * self.slot_size
+        previous = self._read_header(slot)
+        if previous and previous[0] == STATE_PENDING:
+            # 満杯: 最も古い未送信レコードを上書きする
+            self.overwritten += 1
+            self._pending.pop(previous[1], None)
+
+        header = _HEADER.pack(MAGIC, STATE_PENDING, 0, seq, len(payload), self._crc(seq, len(payload), payload))
+        self._mm[offset:offset + _HEADER.size + len(payload)] = header + payload
+        self._pending[seq] = slot
+        self.appended += 1
+        self._touch(offset, offset + self.slot_size)
+        return seq
+
+    def ack(self, seqs):
+        """送信が確認できたレコードを済みにする (状態の1バイトだけ書き換える)"""
+        for seq in seqs:
+            slot = self._pending.pop(seq, None)
+            if slot is None:
+                continue
+            offset = slot * self.slot_size
+            self._mm[offset + 2] = STATE_ACKED
+            self.acked += 1
+            self._touch(offset, offset + 3)
+
+    def pending(self):
+        """未送信のレコード [(seq, record), ...] (古い順)"""
+        records = []
+        for seq, slot in sorted(self._pending.items()):
+            offset = slot * self.slot_size + _HEADER.size
+            length = _HEADER.unpack_from(self._mm, slot * self.slot_size)[4]
+            records.append((seq, decode_record(self._mm[offset:offset + length])))
+        return records
+
+    def __len__(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "appended": self.appended,
+            "acked": self.acked,
+            "overwritten": self.overwritten,
+            "corrupt": self.corrupt,
+        }
+
+    def close(self):
+        self.sync()
+        self._mm.close()
@@ -0,0 +1,256 @@
+"""
+LoRaアップリンク用バイナリペイロードのエンコーダ / デコーダ
+
+ネットワークサーバ側でも同じ形式をデコードできるよう、標準ライブラリのみで実装している
+(このファイル単体をコピーして使える)。
+
+フォーマット (version 1):
+  [ヘッダ 1byte] bit7-5: バージョン, bit4-3: 時刻モード, bit2: 統計値あり, bit1-0: 予約(0)
+  以降、レコードを時刻順に並べる。各レコードは:
+    [時刻]   先頭レコード: 時刻モードに応じた値 (varint)
+               epoch: デバイスエポックからの経過秒
+               age:   送信時刻から何秒前か
+               none:  なし
+             2件目以降: 前のレコードからの経過秒 (varint, none モードではなし)
+    [カウント] 設定されたクラス順に varint
+    [統計]   統計値ありの場合、クラスごとに 最小, 最大, 平均x10 (varint)
+
+デコード例:
+    python app/payload_codec.py 300005 --classes person
+"""
+import datetime
+
+PAYLOAD_VERSION = 1
+
+TIME_MODES = {"none": 0, "epoch": 1, "age": 2}
+_TIME_MODE_NAMES = {v: k for k, v in TIME_MODES.items()}
+
+# 平均値は 0.1 単位の整数で送る
+MEAN_SCALE = 10
+
+DEFAULT_EPOCH = datetime.datetime(2024, 1, 1)
+
+
+def encode_varint(value, out):
+    """非負整数を LEB128 形式で out (bytearray) に追加する"""
+    if value < 0:
+        raise ValueError(f"varint must be non-negative: {value}")
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+
+def decode_varint(data, pos):
+    """
+    data[pos:] から varint を1つ読む
+    :return: (値, 次の位置)
+    """
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+class WindowAggregator:
+    """
+    複数周期のカウントを1レコードにまとめる
+    レコードのカウントは最後の周期の値、統計は窓内の最小・最大・平均
+    """
+
+    def __init__(self, classes, size=1):
+        """
+        :param size: 1レコードにまとめる周期数
+        """
+        self.classes = list(classes)
+        self.size = size
+        self.reset()
+
+    @property
+    def full(self):
+        return self.samples >= self.size
+
+    def reset(self):
+        self.samples = 0
+        self.last_dt = None
+        self._last = [0] * len(self.classes)
+        self._min = [None] * len(self.classes)
+        self._max = [0] * len(self.classes)
+        self._sum = [0] * len(self.classes)
+
+    def add(self, dt, counts):
+        """
+        :param counts: {クラス名: 数}
+        """
+        self.samples += 1
+        self.last_dt = dt
+        for i, cname in enumerate(self.classes):
+            n = counts.get(cname, 0)
+            self._last[i] = n
+            self._min[i] = n if self._min[i] is None else min(self._min[i], n)
+            self._max[i] = max(self._max[i], n)
+            self._sum[i] += n
+
+    def flush(self):
+        """窓をレコードにして返し、リセットする (空なら None)"""
+        if self.samples == 0:
+            return None
+        record = {
+            "dt": self.last_dt,
+            "counts": dict(zip(self.classes, self._last)),
+            "stats": {
+                cname: (self._min[i], self._max[i], self._sum[i] / self.samples)
+                for i, cname in enumerate(self.classes)
+            },
+        }
+        self.reset()
+        return record
+
+
+class PayloadCodec:
+    def __init__(self, classes=("person",), time_mode="epoch", epoch=DEFAULT_EPOCH):
+        """
+        :param classes: 送信するクラス (デバイスとサーバで同じ順序にすること)
+        :param time_mode: "epoch" / "age" / "none"
+        :param epoch: デバイスエポック (epoch モードの基準時刻)
+        """
+        if time_mode not in TIME_MODES:
+            raise ValueError(f"Unknown time mode: {time_mode}")
+        self.classes = list(classes)
+        self.time_mode = time_mode
+        self.epoch = epoch
+
+    def record_size(self, with_stats=False):
+        """1レコードのおおよその最大バイト数 (時刻4byte, カウント各1byte, 統計各3byte と仮定)"""
+        size = 0 if self.time_mode == "none" else 4
+        size += len(self.classes) * (4 if with_stats else 1)
+        return size
+
+    def _seconds(self, dt):
+        return int((dt - self.epoch).total_seconds() // 1)
+
+    def encode(self, records, sent_at=None):
+        """
+        :param records: [{"dt": datetime, "counts": {クラス名: 数}, "stats": {クラス名: (min, max, mean)}}, ...]
+                        stats は省略可 (全レコードで揃えること)
+        :param sent_at: age モードの基準時刻 (省略時は現在時刻)
+        :return: bytes
+        """
+        if not records:
+            raise ValueError("No records to encode")
+        with_stats = records[0].get("stats") is not None
+
+        out = bytearray()
+        header = (PAYLOAD_VERSION << 5) | (TIME_MODES[self.time_mode] << 3) | (int(with_stats) << 2)
+        out.append(header)
+
+        prev_sec = None
+        for record in records:
+            if self.time_mode != "none":
+                # 秒未満は切り捨てた整数秒で差分を取る
+                sec = self._seconds(record["dt"])
+                if prev_sec is None:
+                    if self.time_mode == "epoch":
+                        encode_varint(sec, out)
+                    else:
+                        sent_sec = self._seconds(sent_at or datetime.datetime.now())
+                        encode_varint(max(0, sent_sec - sec), out)
+                else:
+                    encode_varint(sec - prev_sec, out)
+                prev_sec = sec
+
+            counts = record["counts"]
+            for cname in self.classes:
+                encode_varint(int(counts.get(cname, 0)), out)
+
+            if with_stats:
+                stats = record["stats"]
+                for cname in self.classes:
+                    lo, hi, mean = stats.get(cname, (0, 0, 0.0))
+                    encode_varint(int(lo), out)
+                    encode_varint(int(hi), out)
+                    encode_varint(int(round(mean * MEAN_SCALE)), out)
+        return bytes(out)
+
+    def decode(self, payload, received_at=None):
+        """
+        :param payload: bytes
+        :param received_at: age モードの基準時刻 (受信時刻)
+        :return: encode に渡したものと同じ形式のレコードのリスト
+                 none モードでは dt は None、age モードで received_at がなければ dt は受信時刻からの相対秒 (負の int)
+        """
+        if not payload:
+            raise ValueError("Empty payload")
+        header = payload[0]
+        version = header >> 5
+        if version != PAYLOAD_VERSION:
+            raise ValueError(f"Unsupported payload version: {version}")
+        time_mode = _TIME_MODE_NAMES.get((header >> 3) & 0x03)
+        if time_mode is None:
+            raise ValueError("Unknown time mode in header")
+        with_stats = bool(header & 0x04)
+        if len(payload) == 1:
+            # encode は空のレコードを送らないので、ヘッダだけなら途中で切れている
+            raise ValueError("Truncated payload: no records")
+
+        records = []
+        pos = 1
+        base = None
+        while pos < len(payload):
+            dt = None
+            if time_mode != "none":
+                value, pos = decode_varint(payload, pos)
+                if base is None:
+                    if time_mode == "epoch":
+                        base = self.epoch + datetime.timedelta(seconds=value)
+                    elif received_at is not None:
+                        base = received_at - datetime.timedelta(seconds=value)
+                    else:
+                        base = -value
+                else:
+                    if isinstance(base, int):
+                        base += value
+                    else:
+                        base += datetime.timedelta(seconds=value)
+                dt = base
+
+            counts = {}
+            for cname in self.classes:
+                counts[cname], pos = decode_varint(payload, pos)
+            record = {"dt": dt, "counts": counts}
+
+            if with_stats:
+                stats = {}
+                for cname in self.classes:
+                    lo, pos = decode_varint(payload, pos)
+                    hi, pos = decode_varint(payload, pos)
+                    mean, pos = decode_varint(payload, pos)
+                    stats[cname] = (lo, hi, mean / MEAN_SCALE)
+                record["stats"] = stats
+            records.append(record)
+        return records
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decode a LoRaCam uplink payload")
+    parser.add_argument("payload", help="ペイロード (16進文字列)")
+    parser.add_argument("--classes", nargs="*", default=["person"])
+    parser.add_argument("--epoch", default=DEFAULT_EPOCH.isoformat())
+    args = parser.parse_args()
+
+    codec = PayloadCodec(classes=args.classes, epoch=datetime.datetime.fromisoformat(args.epoch))
+    for rec in codec.decode(bytes.fromhex(args.payload), received_at=datetime.datetime.now()):
+        print(rec)
@@ -0,0 +1,178 @@
+import queue
+import signal
+import threading
+import time
+
+from .metrics import metrics
+
+# ワーカー停止用の番兵
+_STOP = object()
+
+
+class StageQueue:
+    """
+    ステージ間の有界キュー
+    満杯時の動作:
+      drop_oldest: 最も古い要素を捨てて新しい要素を入れる (撮影側は止まらない)
+      block: 空きができるまで投入側を待たせる
+    """
+    POLICIES = ("drop_oldest", "block")
+
+    def __init__(self, maxsize=2, policy="drop_oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.policy = policy
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item, stop_event=None):
+        """
+        要素を投入する
+        :return: 捨てた要素 (なければ None)
+        """
+        if self.policy == "block":
+            while stop_event is None or not stop_event.is_set():
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    return None
+                except queue.Full:
+                    continue
+            # 停止中は待たずに捨てる
+            self.dropped += 1
+            return item
+
+        dropped = None
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    dropped = self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def put_sentinel(self):
+        # 停止通知は捨てられないようポリシーに関係なく待って入れる
+        self._queue.put(_STOP)
+
+    def get(self):
+        return self._queue.get()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class StageWorker(threading.Thread):
+    """キューから要素を取り出してハンドラを実行するワーカースレッド"""
+
+    def __init__(self, name, handler, maxsize=2, policy="drop_oldest", stop_event=None):
+        super().__init__(name=name, daemon=True)
+        self.handler = handler
+        self.queue = StageQueue(maxsize=maxsize, policy=policy)
+        self.stop_event = stop_event
+        self.processed = 0
+        self.errors = 0
+
+    def submit(self, item):
+        dropped = self.queue.put(item, self.stop_event)
+        if dropped is not None:
+            metrics.inc("pipeline_dropped", stage=self.name)
+            print(f"[Pipeline] {self.name}: queue full, dropped one item ({self.queue.dropped} total)")
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            t0 = time.perf_counter()
+            try:
+                self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                metrics.inc("pipeline_errors", stage=self.name)
+                print(f"[Error] {self.name} stage failed: {e}")
+            metrics.observe("pipeline_stage", time.perf_counter() - t0, stage=self.name)
+
+    def stop(self):
+        self.queue.put_sentinel()
+
+
+class Pipeline:
+    """
+    撮影・推論の結果を後段ワーカー (画像保存・CSV記録・LoRa送信など) へ配る
+    各ステージは独立したスレッドと有界キューを持ち、遅いステージが撮影周期を遅らせない
+    捨ててはいけない軽い処理 (送信待ちレコードへの追加など) は inline ステージとして publish() の中で実行する
+    """
+
+    def __init__(self, maxsize=2, policy="drop_oldest"):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.inline = []  # (名前, ハンドラ)
+
+    def add_stage(self, name, handler, maxsize=None, policy=None):
+        worker = StageWorker(
+            name,
+            handler,
+            maxsize=maxsize if maxsize is not None else self.maxsize,
+            policy=policy if policy is not None else self.policy,
+            stop_event=self.stop_event,
+        )
+        self.workers.append(worker)
+        metrics.gauge("pipeline_queue_depth", worker.queue.qsize, stage=name)
+        return worker
+
+    def add_inline_stage(self, name, handler):
+        """キューを通さず、publish() を呼んだスレッドで実行するステージ (要素が捨てられない)"""
+        self.inline.append((name, handler))
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def publish(self, item):
+        """全ステージへ要素を投入する"""
+        for name, handler in self.inline:
+            t0 = time.perf_counter()
+            try:
+                handler(item)
+            except Exception as e:
+                metrics.inc("pipeline_errors", stage=name)
+                print(f"[Error] {name} stage failed: {e}")
+            metrics.observe("pipeline_stage", time.perf_counter() - t0, stage=name)
+        for worker in self.workers:
+            worker.submit(item)
+
+    def install_signal_handlers(self):
+        """SIGTERM (systemctl stop) と SIGINT (Ctrl+C) で停止要求を出す"""
+        def _handler(signum, frame):
+            print(f"\nSignal {signal.Signals(signum).name} received. Stopping...")
+            self.stop_event.set()
+
+        signal.signal(signal.SIGTERM, _handler)
+        signal.signal(signal.SIGINT, _handler)
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def wait(self, timeout):
+        """
+        停止要求があるまで最大timeout秒待つ
+        :return: 停止要求があれば True
+        """
+        return self.stop_event.wait(timeout)
+
+    def shutdown(self, timeout=10.0):
+        """キューに残った要素を処理し終えてからワーカーを止める"""
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                print(f"[Pipeline] {worker.name}: did not finish within {timeout} sec")
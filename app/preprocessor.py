@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+
+def build_input_lut(input_dtype, input_scale=0.0, input_zero_point=0):
+    """
+    uint8画素値 -> モデル入力値 の256要素ルックアップテーブルを作る
+    従来の浮動小数点による正規化・量子化と同じ式を0〜255の全画素値に適用する
+    """
+    pixels = np.arange(256, dtype=np.uint8)
+    if input_dtype == np.int8:
+        img_norm = pixels.astype(np.float32) / 255.0
+        img_input = (img_norm / input_scale) + input_zero_point
+        return np.clip(img_input, -128, 127).astype(np.int8)
+    elif input_dtype == np.uint8:
+        return pixels
+    else:
+        return pixels.astype(np.float32) / 255.0
+
+
+class LetterboxGeometry:
+    """入力解像度ごとのLetterbox配置と作業バッファ"""
+
+    def __init__(self, image_size, input_size):
+        ih, iw = image_size
+        w, h = input_size
+        self.scale = min(w / iw, h / ih)
+        self.nw, self.nh = int(iw * self.scale), int(ih * self.scale)
+        self.dx = (w - self.nw) // 2
+        self.dy = (h - self.nh) // 2
+        self.needs_resize = (self.nw, self.nh) != (iw, ih)
+
+        # 使い回す作業バッファ
+        self.resized = np.empty((self.nh, self.nw, 3), dtype=np.uint8)
+        self.rgb = np.empty((self.nh, self.nw, 3), dtype=np.uint8)
+
+
+class LetterboxPreprocessor:
+    """
+    Letterbox・BGR->RGB変換・量子化をまとめて行う前処理エンジン
+
+    配置計算と作業バッファは入力解像度ごとに一度だけ用意し、
+    量子化はルックアップテーブルで行って結果を出力先 (入力テンソルのビュー) へ直接書き込む。
+    定常状態ではフレームごとのメモリ確保が発生しない。
+    """
+
+    def __init__(self, input_size, input_dtype, quantization=(0.0, 0)):
+        """
+        :param input_size: モデル入力サイズ (Width, Height)
+        :param input_dtype: 入力テンソルの型
+        :param quantization: 入力テンソルの (scale, zero_point)
+        """
+        self.input_size = input_size
+        self.input_dtype = np.dtype(input_dtype)
+        self.lut = build_input_lut(self.input_dtype, *quantization)
+        # 余白 (黒画素) に対応する入力値
+        self.pad_value = self.lut[0]
+        self._geometries = {}
+
+    def geometry(self, image):
+        key = image.shape[:2]
+        geom = self._geometries.get(key)
+        if geom is None:
+            geom = LetterboxGeometry(key, self.input_size)
+            self._geometries[key] = geom
+        return geom
+
+    def run(self, image, out):
+        """
+        画像を前処理して出力先へ書き込む
+        :param image: BGR画像 (H, W, 3) uint8
+        :param out: 書き込み先 (Height, Width, 3)。入力テンソルのビューを渡す
+        :return: (scale, (dx, dy))
+        """
+        geom = self.geometry(image)
+        dx, dy, nw, nh = geom.dx, geom.dy, geom.nw, geom.nh
+
+        if geom.needs_resize:
+            cv2.resize(image, (nw, nh), dst=geom.resized)
+            src = geom.resized
+        else:
+            src = image
+        cv2.cvtColor(src, cv2.COLOR_BGR2RGB, dst=geom.rgb)
+
+        # 余白を埋め、画像部分はLUTで量子化しながら直接書き込む
+        if dy > 0:
+            out[:dy] = self.pad_value
+            out[dy + nh:] = self.pad_value
+        if dx > 0:
+            out[dy:dy + nh, :dx] = self.pad_value
+            out[dy:dy + nh, dx + nw:] = self.pad_value
+        cv2.LUT(geom.rgb, self.lut, dst=out[dy:dy + nh, dx:dx + nw])
+
+        return geom.scale, (dx, dy)
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import random
+import time
+
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+# Raspberry Pi のファームウェアが公開している スロットリング状態 (vcgencmd get_throttled と同じ値)
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+# MaxInterval を指定しない場合、高温時に周期を伸ばす上限 (通常の最長周期の倍数)
+THERMAL_BACKOFF = 4
+
+
+def device_offset(device_id, jitter):
+    """
+    端末ごとに固定の位相オフセット [0, jitter) 秒
+    DevEUI などから決めるので、再起動しても同じ端末は同じ位相になる
+    """
+    if jitter <= 0:
+        return 0.0
+    if device_id:
+        digest = hashlib.sha256(str(device_id).encode()).digest()
+        fraction = int.from_bytes(digest[:8], "big") / 2 ** 64
+    else:
+        fraction = random.random()
+    return fraction * jitter
+
+
+class SamplingScheduler:
+    """
+    撮影周期のスケジューラ
+
+    次の撮影時刻は monotonic 時計上の「基準時刻 + k * 周期」で決めるため、処理時間や送信時間が
+    周期に積み重ならない (処理が周期を超えた場合は次の格子点まで飛ばす)。
+      - align: 壁時計の周期の倍数 (+ 端末ごとのオフセット) に揃える (例: 60秒周期なら毎分0秒付近)
+      - jitter: 端末ごとのオフセットの幅。同じ周期の端末群がゲートウェイで衝突しないよう位相をずらす
+      - 直近に検出があれば active_interval、idle_after 周期続けて検出がなければ idle_interval にする
+      - SoC温度が temp_soft を超えたら thermal_interval (max_interval、未指定なら通常の最長周期の
+        THERMAL_BACKOFF 倍) に向けて周期を伸ばし、temp_hard 以上またはスロットリング中は thermal_interval にする
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None, active_interval=None, idle_interval=None,
+                 idle_after=5, align=False, jitter=0.0, device_id=None, temp_soft=70.0, temp_hard=80.0,
+                 thermal_zone=THERMAL_ZONE, throttled_path=THROTTLED_PATH, thermal_check=10.0):
+        """
+        :param interval: 基本の周期 [秒]
+        :param min_interval, max_interval: 周期の下限・上限 [秒] (None なら interval・active_interval・idle_interval
+                                          の最小・最大。max_interval は高温時に伸ばす上限も兼ねる)
+        :param active_interval: 検出があるときの周期 (None なら interval)
+        :param idle_interval: 検出がないときの周期 (None なら interval)
+        :param idle_after: この周期数続けて検出がなければ idle_interval にする
+        :param align: 撮影時刻を壁時計の周期の倍数に揃える
+        :param jitter: 端末ごとの位相オフセットの幅 [秒]
+        :param device_id: オフセットを決める端末ID (DevEUI)。None なら起動ごとにランダム
+        :param temp_soft, temp_hard: 周期を伸ばし始める温度・上限にする温度 [℃]
+        :param thermal_check: 温度を読む間隔 [秒]
+        """
+        self.device_id = device_id
+        self.configure(interval, min_interval, max_interval, active_interval, idle_interval, idle_after,
+                       align, jitter)
+        self.temp_soft = temp_soft
+        self.temp_hard = temp_hard
+        self.thermal_zone = thermal_zone
+        self.throttled_path = throttled_path
+        self.thermal_check = thermal_check
+
+        self.period = self._clamp(interval)
+        self._anchor = None
+        self._index = 0
+        self._empty_cycles = 0
+        self._last_thermal = None
+        self.temperature = None
+        self.throttled = False
+
+        # カウンタ
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped_slots = 0
+
+    def configure(self, interval, min_interval=None, max_interval=None, active_interval=None, idle_interval=None,
+                  idle_after=5, align=False, jitter=0.0):
+        """
+        周期の設定を変更する (稼働中に呼んでもよい)
+        周期・整列・オフセットが変わった場合だけ、次の next_wait で格子を作り直す
+        """
+        before = self._timing() if hasattr(self, "interval") else None
+        self.interval = interval
+        self.active_interval = active_interval if active_interval is not None else interval
+        self.idle_interval = idle_interval if idle_interval is not None else interval
+        levels = (interval, self.active_interval, self.idle_interval)
+        self.min_interval = min_interval if min_interval is not None else min(levels)
+        self.max_interval = max_interval if max_interval is not None else max(levels)
+        self.thermal_interval = max_interval if max_interval is not None else max(levels) * THERMAL_BACKOFF
+        self.idle_after = idle_after
+        self.align = align
+        self.offset = device_offset(self.device_id, jitter)
+        if self._timing() != before:
+            self._reconfigured = True
+
+    def _timing(self):
+        return (self.interval, self.min_interval, self.max_interval, self.active_interval, self.idle_interval,
+                self.align, self.offset)
+
+    def _clamp(self, period, upper=None):
+        return min(max(period, self.min_interval), self.max_interval if upper is None else upper)
+
+    # ------------------------------------------------------------------
+    def start(self, now=None, wall=None):
+        """
+        スケジュールを開始する
+        :return: 最初の撮影までの待ち時間 [秒] (揃えない場合は 0)
+        """
+        now = time.monotonic() if now is None else now
+        self._reconfigured = False
+        self._reanchor(now, wall, first=True)
+        return max(0.0, self._anchor - now)
+
+    def _reanchor(self, now, wall=None, first=False):
+        """周期が変わったときなどに、次の撮影時刻を基準に格子を作り直す"""
+        if self.align:
+            wall = time.time() if wall is None else wall
+            # 壁時計で次の (周期の倍数 + オフセット) の時刻
+            slot = (wall - self.offset) // self.period + 1
+            target = slot * self.period + self.offset
+            self._anchor = now + (target - wall)
+        else:
+            self._anchor = now + (self.offset if first else self.period)
+        self._index = 0
+
+    @property
+    def next_deadline(self):
+        return self._anchor + self._index * self.period
+
+    def observe(self, counts):
+        """
+        周期ごとの検出数を渡して活動量を更新する
+        :param counts: {クラス名: 数}
+        """
+        if any(counts.values()):
+            self._empty_cycles = 0
+        else:
+            self._empty_cycles += 1
+
+    def next_wait(self, now=None, wall=None):
+        """
+        撮影が終わったら呼ぶ。次の撮影時刻を決めて待ち時間 [秒] を返す
+        """
+        now = time.monotonic() if now is None else now
+        self.cycles += 1
+
+        period = self._target_period(now)
+        if period != self.period or self._reconfigured:
+            self._reconfigured = False
+            self.period = period
+            self._reanchor(now, wall)
+            return max(0.0, self.next_deadline - now)
+
+        self._index += 1
+        if self.next_deadline < now:
+            # 処理が周期を超えた: 格子は保ったまま次の未来の時刻まで飛ばす
+            self.overruns += 1
+            missed = int((now - self.next_deadline) // self.period) + 1
+            self._index += missed
+            self.skipped_slots += missed
+        return max(0.0, self.next_deadline - now)
+
+    # ------------------------------------------------------------------
+    def _target_period(self, now):
+        if self._empty_cycles == 0:
+            period = self.active_interval
+        elif self._empty_cycles >= self.idle_after:
+            period = self.idle_interval
+        else:
+            period = self.interval
+
+        self._read_thermal(now)
+        if self.throttled or (self.temperature is not None and self.temperature >= self.temp_hard):
+            period = self.thermal_interval
+        elif self.temperature is not None and self.temperature > self.temp_soft:
+            ratio = (self.temperature - self.temp_soft) / (self.temp_hard - self.temp_soft)
+            period = period + (self.thermal_interval - period) * ratio
+        # 温度のわずかな変化で格子を作り直さないよう 0.1 秒単位に丸める
+        return round(self._clamp(period, max(self.max_interval, self.thermal_interval)), 1)
+
+    def _read_thermal(self, now):
+        if self._last_thermal is not None and now - self._last_thermal < self.thermal_check:
+            return
+        self._last_thermal = now
+        if self.thermal_zone and os.path.exists(self.thermal_zone):
+            try:
+                with open(self.thermal_zone) as f:
+                    self.temperature = int(f.read().strip()) / 1000.0
+            except (OSError, ValueError):
+                self.temperature = None
+        if self.throttled_path and os.path.exists(self.throttled_path):
+            try:
+                with open(self.throttled_path) as f:
+                    value = int(f.read().strip(), 16)
+                # bit1: 周波数制限中, bit2: スロットリング中
+                self.throttled = bool(value & 0x6)
+            except (OSError, ValueError):
+                self.throttled = False
+
+    def stats(self):
+        return {
+            "period": self.period,
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "skipped_slots": self.skipped_slots,
+            "offset": self.offset,
+            "temperature": self.temperature,
+            "throttled": self.throttled,
+        }
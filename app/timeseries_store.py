@@ -0,0 +1,352 @@
+"""
+検出数・LoRa通信ログの時系列ストア (SQLite, WALモード)
+
+時刻はCSVと同じくローカル時刻をそのまま秒に変換した整数 (1970-01-01 00:00:00 からの秒) で保持する。
+タイムゾーン変換をしないため、時・日の集計はローカル時刻の区切りになる。
+
+テーブル:
+  detections (ts, class, count, carried_over)
+                                      : 周期ごとの検出数 (person は0人でも記録)
+                                        carried_over は推論を省略して前回の結果を引き継いだ周期なら 1
+  lora (ts, type, payload, status)    : LoRa通信ログ
+  cycles_<level> (bucket, cycles)     : 区間内の検出周期数
+  rollup_<level> (bucket, class, samples, total, min, max)
+                                      : 区間内のクラス別集計 (level = minute / hour / day)
+集計テーブルは書き込み時に更新するので、期間集計は集計テーブルの範囲検索だけで済む。
+"""
+import calendar
+import datetime
+import sqlite3
+import threading
+
+LEVELS = {"minute": 60, "hour": 3600, "day": 86400}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_ts(dt):
+    """datetime (ローカル時刻) -> 整数秒"""
+    return calendar.timegm(dt.timetuple())
+
+
+def from_ts(ts):
+    return _EPOCH + datetime.timedelta(seconds=ts)
+
+
+class TimeSeriesStore:
+    def __init__(self, db_path="data/logs/loracam.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WALでは NORMAL でも電源断でDBは壊れない (直近の数件が失われる可能性はある)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS detections (ts INTEGER NOT NULL, class TEXT NOT NULL, "
+                "count INTEGER NOT NULL, carried_over INTEGER NOT NULL DEFAULT 0)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(detections)")]
+            if "carried_over" not in columns:
+                # 以前の形式のDB (引き継いだ周期かどうかは分からないので 0 とする)
+                self.conn.execute("ALTER TABLE detections ADD COLUMN carried_over INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS lora (ts INTEGER NOT NULL, type TEXT, payload TEXT, status TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_lora_ts ON lora (ts)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS imported_files (name TEXT PRIMARY KEY, size INTEGER)")
+            for level in LEVELS:
+                self.conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS cycles_{level} ("
+                    "bucket INTEGER PRIMARY KEY, cycles INTEGER NOT NULL)")
+                self.conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS rollup_{level} ("
+                    "bucket INTEGER NOT NULL, class TEXT NOT NULL, samples INTEGER NOT NULL, "
+                    "total INTEGER NOT NULL, min INTEGER NOT NULL, max INTEGER NOT NULL, "
+                    "PRIMARY KEY (bucket, class)) WITHOUT ROWID")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # ------------------------------------------------------------------
+    # 書き込み
+    # ------------------------------------------------------------------
+    def record(self, dt, counts, carried_over=False):
+        """
+        1周期分の検出数を記録し、集計テーブルを更新する
+        :param counts: {クラス名: 数} (検出されなかったクラスは含めなくてよい)
+        :param carried_over: 推論を省略して前回の結果を引き継いだ周期か
+        """
+        ts = to_ts(dt)
+        rows = [(ts, cname, int(count)) for cname, count in counts.items()]
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT INTO detections (ts, class, count, carried_over) VALUES (?, ?, ?, ?)",
+                                  [row + (int(bool(carried_over)),) for row in rows])
+            for level, width in LEVELS.items():
+                bucket = ts - ts % width
+                self.conn.execute(
+                    f"INSERT INTO cycles_{level} (bucket, cycles) VALUES (?, 1) "
+                    "ON CONFLICT (bucket) DO UPDATE SET cycles = cycles + 1", (bucket,))
+                self.conn.executemany(
+                    f"INSERT INTO rollup_{level} (bucket, class, samples, total, min, max) VALUES (?, ?, 1, ?, ?, ?) "
+                    "ON CONFLICT (bucket, class) DO UPDATE SET samples = samples + 1, total = total + excluded.total, "
+                    "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                    [(bucket, cname, count, count, count) for _, cname, count in rows])
+
+    def record_lora(self, dt, comm_type, payload, status):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT INTO lora (ts, type, payload, status) VALUES (?, ?, ?, ?)",
+                              (to_ts(dt), comm_type, payload, status))
+
+    def bulk_insert(self, detections=(), cycles=(), lora=()):
+        """
+        集計テーブルを更新せずにまとめて追加する (取り込み用。最後に rebuild_rollups を呼ぶこと)
+        :param detections: [(ts, class, count[, carried_over]), ...]
+        :param cycles: [ts, ...] 検出周期の時刻
+        :param lora: [(ts, type, payload, status), ...]
+        """
+        with self._lock, self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS pending_cycles (ts INTEGER NOT NULL)")
+            self.conn.executemany("INSERT INTO detections (ts, class, count, carried_over) VALUES (?, ?, ?, ?)",
+                                  ((tuple(row) + (0,))[:4] for row in detections))
+            self.conn.executemany("INSERT INTO temp.pending_cycles (ts) VALUES (?)", ((ts,) for ts in cycles))
+            self.conn.executemany("INSERT INTO lora (ts, type, payload, status) VALUES (?, ?, ?, ?)", lora)
+
+    def rebuild_rollups(self):
+        """detections から集計テーブルを作り直す"""
+        with self._lock, self.conn:
+            # 周期数は生データから復元できないため、既存の集計に取り込み分を足す
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS pending_cycles (ts INTEGER NOT NULL)")
+            for level, width in LEVELS.items():
+                self.conn.execute(
+                    f"INSERT INTO cycles_{level} (bucket, cycles) "
+                    f"SELECT ts - ts % {width} AS b, COUNT(*) FROM temp.pending_cycles WHERE true GROUP BY b "
+                    "ON CONFLICT (bucket) DO UPDATE SET cycles = cycles + excluded.cycles")
+                self.conn.execute(f"DELETE FROM rollup_{level}")
+                self.conn.execute(
+                    f"INSERT INTO rollup_{level} (bucket, class, samples, total, min, max) "
+                    f"SELECT ts - ts % {width} AS b, class, COUNT(*), SUM(count), MIN(count), MAX(count) "
+                    "FROM detections GROUP BY b, class")
+            self.conn.execute("DELETE FROM temp.pending_cycles")
+
+    def is_imported(self, name, size):
+        row = self.conn.execute("SELECT size FROM imported_files WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == size
+
+    def mark_imported(self, name, size):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO imported_files (name, size) VALUES (?, ?)", (name, size))
+
+    # ------------------------------------------------------------------
+    # 検索
+    # ------------------------------------------------------------------
+    def query_range(self, start, end, classes=None, with_carried_over=False):
+        """
+        期間内の生データ [start, end)
+        :param with_carried_over: 前回の結果を引き継いだ周期か (bool) を4番目の要素に加える
+        :return: [(datetime, クラス名, 数), ...]
+        """
+        sql = "SELECT ts, class, count, carried_over FROM detections WHERE ts >= ? AND ts < ?"
+        params = [to_ts(start), to_ts(end)]
+        sql, params = self._filter_classes(sql, params, classes)
+        rows = self.conn.execute(sql + " ORDER BY ts", params).fetchall()
+        if with_carried_over:
+            return [(from_ts(ts), cname, count, bool(carried)) for ts, cname, count, carried in rows]
+        return [(from_ts(ts), cname, count) for ts, cname, count, _ in rows]
+
+    def aggregate(self, start, end, level="hour", classes=None):
+        """
+        区間ごとのクラス別集計 [start, end)
+        :param level: "minute" / "hour" / "day"
+        :return: [{"time", "class", "cycles", "total", "mean", "min", "max"}, ...]
+                 mean は区間内の1周期あたりの平均 (検出されなかった周期は0として数える)
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}")
+        sql = (f"SELECT r.bucket, r.class, c.cycles, r.samples, r.total, r.min, r.max "
+               f"FROM rollup_{level} r JOIN cycles_{level} c ON c.bucket = r.bucket "
+               "WHERE r.bucket >= ? AND r.bucket < ?")
+        params = [to_ts(start), to_ts(end)]
+        sql, params = self._filter_classes(sql, params, classes, column="r.class")
+        results = []
+        for bucket, cname, cycles, samples, total, lo, hi in self.conn.execute(sql + " ORDER BY r.bucket, r.class", params):
+            cycles = max(cycles, samples)
+            results.append({
+                "time": from_ts(bucket),
+                "class": cname,
+                "cycles": cycles,
+                "total": total,
+                "mean": total / cycles,
+                "min": lo if samples >= cycles else 0,
+                "max": hi,
+            })
+        return results
+
+    def totals(self, start, end, classes=None, level="hour"):
+        """
+        期間全体のクラス別集計 [start, end)
+        level の区切りに揃っていない端の区間は丸ごと含まれる
+        :return: {クラス名: {"cycles", "total", "mean", "max"}}
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}")
+        lo_ts, hi_ts = to_ts(start), to_ts(end)
+        cycles = self.conn.execute(
+            f"SELECT COALESCE(SUM(cycles), 0) FROM cycles_{level} WHERE bucket >= ? AND bucket < ?",
+            (lo_ts - lo_ts % LEVELS[level], hi_ts)).fetchone()[0]
+        sql = (f"SELECT class, SUM(total), MAX(max) FROM rollup_{level} WHERE bucket >= ? AND bucket < ?")
+        params = [lo_ts - lo_ts % LEVELS[level], hi_ts]
+        sql, params = self._filter_classes(sql, params, classes)
+        results = {}
+        for cname, total, hi in self.conn.execute(sql + " GROUP BY class", params):
+            results[cname] = {
+                "cycles": cycles,
+                "total": total,
+                "mean": total / cycles if cycles else 0.0,
+                "max": hi,
+            }
+        return results
+
+    def lora_log(self, start, end, comm_type=None):
+        """期間内のLoRa通信ログ [(datetime, 種別, ペイロード, 状態), ...]"""
+        sql = "SELECT ts, type, payload, status FROM lora WHERE ts >= ? AND ts < ?"
+        params = [to_ts(start), to_ts(end)]
+        if comm_type:
+            sql += " AND type = ?"
+            params.append(comm_type)
+        rows = self.conn.execute(sql + " ORDER BY ts", params).fetchall()
+        return [(from_ts(ts), t, payload, status) for ts, t, payload, status in rows]
+
+    def _filter_classes(self, sql, params, classes, column="class"):
+        if classes:
+            sql += f" AND {column} IN ({','.join('?' * len(classes))})"
+            params = params + list(classes)
+        return sql, params
+
+
+# ----------------------------------------------------------------------
+# 既存CSVログの取り込み
+# ----------------------------------------------------------------------
+def _open_log(path):
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, 'rt', newline='', encoding='utf-8')
+    return open(path, newline='', encoding='utf-8')
+
+
+def _iter_csv_rows(path):
+    """ヘッダーを除いた行を (ts, 残りの列) で返す"""
+    import csv
+    day_cache = {}
+    with _open_log(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 3:
+                continue
+            date_str, time_str = row[0], row[1]
+            try:
+                day = day_cache.get(date_str)
+                if day is None:
+                    y, m, d = date_str.split("-")
+                    day = day_cache[date_str] = calendar.timegm((int(y), int(m), int(d), 0, 0, 0))
+                hh, mm, ss = time_str.split(":")
+                ts = day + int(hh) * 3600 + int(mm) * 60 + int(ss)
+            except ValueError:
+                continue
+            yield ts, row[2:]
+
+
+def _log_files(log_dir, name):
+    """退避済み (name.<日付>.csv / .csv.gz) と現在のファイルを古い順に返す"""
+    import glob
+    import os
+    rotated = sorted(glob.glob(os.path.join(log_dir, f"{name}.*.csv*")))
+    current = os.path.join(log_dir, f"{name}.csv")
+    return rotated + ([current] if os.path.isfile(current) else [])
+
+
+def import_csv_logs(store, log_dir="data/logs", batch_size=10000):
+    """
+    logPerson / logAll / logLoRa (退避済みの .gz も含む) をストアに取り込む
+    取り込み済みのファイル (同名・同サイズ) は飛ばす。ストアに既に記録がある場合は、
+    最も古い記録より前の行だけを取り込む (稼働中に記録した分との重複を防ぐ)
+    :return: {"cycles": 周期数, "detections": 行数, "lora": 行数}
+    """
+    import os
+    cutoff = store.conn.execute("SELECT MIN(ts) FROM detections").fetchone()[0]
+    lora_cutoff = store.conn.execute("SELECT MIN(ts) FROM lora").fetchone()[0]
+    imported = {"cycles": 0, "detections": 0, "lora": 0}
+
+    def _pending(path):
+        size = os.path.getsize(path)
+        if store.is_imported(os.path.basename(path), size):
+            print(f"Skip (already imported): {path}")
+            return None
+        return size
+
+    def _flush(detections, cycles, lora):
+        store.bulk_insert(detections, cycles, lora)
+        imported["detections"] += len(detections)
+        imported["cycles"] += len(cycles)
+        imported["lora"] += len(lora)
+        detections.clear()
+        cycles.clear()
+        lora.clear()
+
+    detections, cycles, lora = [], [], []
+    # logPerson は person が0人でも毎周期書かれるので、周期数はこちらから数える
+    for name in ("logPerson", "logAll"):
+        for path in _log_files(log_dir, name):
+            size = _pending(path)
+            if size is None:
+                continue
+            print(f"Importing {path}")
+            for ts, (cname, count, *rest) in _iter_csv_rows(path):
+                if cutoff is not None and ts >= cutoff:
+                    continue
+                if name == "logPerson":
+                    cycles.append(ts)
+                elif cname == "person":
+                    continue  # logPerson と重複
+                # CarriedOver 列のない以前の形式は 0 とする
+                carried = int(rest[0] == "1") if rest else 0
+                detections.append((ts, cname, int(count), carried))
+                if len(detections) >= batch_size:
+                    _flush(detections, cycles, lora)
+            _flush(detections, cycles, lora)
+            store.mark_imported(os.path.basename(path), size)
+
+    for path in _log_files(log_dir, "logLoRa"):
+        size = _pending(path)
+        if size is None:
+            continue
+        print(f"Importing {path}")
+        for ts, values in _iter_csv_rows(path):
+            if lora_cutoff is not None and ts >= lora_cutoff:
+                continue
+            lora.append((ts, *(values + ["", ""])[:3]))
+            if len(lora) >= batch_size:
+                _flush(detections, cycles, lora)
+        _flush(detections, cycles, lora)
+        store.mark_imported(os.path.basename(path), size)
+
+    store.rebuild_rollups()
+    return imported
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import LoRaCam CSV logs into the time-series store")
+    parser.add_argument("--log-dir", default="data/logs")
+    parser.add_argument("--db", default="data/logs/loracam.db")
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.db)
+    result = import_csv_logs(store, args.log_dir)
+    store.close()
+    print(f"Imported {result['cycles']} cycles, {result['detections']} detection rows, {result['lora']} LoRa rows")
@@ -0,0 +1,402 @@
+"""
+検出結果に重ねる複数物体トラッカー
+
+YOLOの推論は detect_every フレームに1回だけ行い、その間のフレームは
+疎なオプティカルフロー (Lucas-Kanade) で各トラックの枠を動かす。
+推論フレームではIoUで検出とトラックを対応付け (貪欲法)、カルマンフィルタ (等速モデル) で位置を更新する。
+トラックIDが付くので、ユニーク訪問者数やラインの通過数を数えられる。
+人物どうしがすれ違うときは、他のトラックの枠と重なる部分の特徴点を使わず、相手の動きに引きずられないようにする。
+それでも見失うことがあるため、新しいトラックは確定する前に、直前に見失ったトラックの位置・速度から
+推定した位置と照らし合わせ、同じ人物ならIDを引き継いで訪問者に数え直さない。
+
+Detection.Interval が数秒以下の短い周期で使うことを想定している (周期が長いとフレーム間で対応が取れない)。
+"""
+import cv2
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    IoU行列
+    :param boxes_a: (N, 4) [left, top, width, height]
+    :param boxes_b: (M, 4)
+    :return: (N, M)
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    iw = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    ih = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    inter = iw * ih
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def greedy_match(iou, threshold):
+    """
+    IoUの大きい組から順に対応付ける
+    :return: (対応 [(i, j), ...], 対応しなかった行, 対応しなかった列)
+    """
+    rows, cols = iou.shape
+    matches = []
+    if rows and cols:
+        order = np.argsort(iou, axis=None)[::-1]
+        used_rows = np.zeros(rows, dtype=bool)
+        used_cols = np.zeros(cols, dtype=bool)
+        for flat in order:
+            i, j = divmod(int(flat), cols)
+            if iou[i, j] < threshold:
+                break
+            if used_rows[i] or used_cols[j]:
+                continue
+            used_rows[i] = used_cols[j] = True
+            matches.append((i, j))
+    matched_rows = {i for i, _ in matches}
+    matched_cols = {j for _, j in matches}
+    return (matches,
+            [i for i in range(rows) if i not in matched_rows],
+            [j for j in range(cols) if j not in matched_cols])
+
+
+class KalmanBoxFilter:
+    """
+    枠の中心・大きさと、その速度を状態に持つ等速モデルのカルマンフィルタ
+    状態: [cx, cy, w, h, vx, vy, vw, vh]
+    """
+    # ノイズは枠の大きさに比例させる
+    STD_POSITION = 1.0 / 20
+    STD_VELOCITY = 1.0 / 160
+
+    _F = np.eye(8)
+    _F[:4, 4:] = np.eye(4)
+    _H = np.eye(4, 8)
+
+    def __init__(self, box):
+        left, top, width, height = box
+        self.x = np.array([left + width / 2, top + height / 2, width, height, 0, 0, 0, 0], dtype=np.float64)
+        size = max(width, height)
+        std = np.array([2 * self.STD_POSITION * size] * 4 + [10 * self.STD_VELOCITY * size] * 4)
+        self.P = np.diag(std ** 2)
+
+    def predict(self):
+        size = max(self.x[2], self.x[3])
+        q = np.array([self.STD_POSITION * size] * 4 + [self.STD_VELOCITY * size] * 4) ** 2
+        self.x = self._F @ self.x
+        self.P = self._F @ self.P @ self._F.T + np.diag(q)
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+
+    def update(self, box, noise_scale=1.0):
+        """
+        :param noise_scale: 観測ノイズの倍率 (オプティカルフローによる観測は検出より信頼度を下げる)
+        """
+        left, top, width, height = box
+        z = np.array([left + width / 2, top + height / 2, width, height])
+        size = max(self.x[2], self.x[3])
+        r = np.diag((np.array([self.STD_POSITION * size] * 4) * noise_scale) ** 2)
+        y = z - self._H @ self.x
+        S = self._H @ self.P @ self._H.T + r
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self._H) @ self.P
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return [cx - w / 2, cy - h / 2, w, h]
+
+    @property
+    def center(self):
+        return float(self.x[0]), float(self.x[1])
+
+
+class Track:
+    def __init__(self, track_id, detection):
+        self.id = track_id
+        self.class_id = detection["class_id"]
+        self.class_name = detection["class_name"]
+        self.score = detection["score"]
+        self.kf = KalmanBoxFilter(detection["box"])
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+        self.last_center = self.kf.center
+        self.created = 0      # 作成したフレーム
+        self.seen_frame = 0   # 最後に検出と対応したフレーム
+        # そのときの状態と共分散 (見失った後の位置の推定に使う)
+        self.seen_state = self.kf.x.copy()
+        self.seen_cov = self.kf.P.copy()
+
+    def mark_seen(self, frame_index):
+        self.seen_frame = frame_index
+        self.seen_state = self.kf.x.copy()
+        self.seen_cov = self.kf.P.copy()
+
+    def expected_center(self, frame_index):
+        """
+        最後に検出されたときの位置・速度から推定した frame_index での中心
+        :return: (cx, cy, 標準偏差 x, 標準偏差 y)
+        """
+        cx, cy, _, _, vx, vy = self.seen_state[:6]
+        elapsed = frame_index - self.seen_frame
+        P = self.seen_cov
+        var_x = P[0, 0] + 2 * elapsed * P[0, 4] + elapsed ** 2 * P[4, 4]
+        var_y = P[1, 1] + 2 * elapsed * P[1, 5] + elapsed ** 2 * P[5, 5]
+        return cx + vx * elapsed, cy + vy * elapsed, np.sqrt(var_x), np.sqrt(var_y)
+
+    def to_result(self):
+        return {
+            "box": [int(v) for v in self.kf.box],
+            "score": self.score,
+            "class_id": self.class_id,
+            "class_name": self.class_name,
+            "track_id": self.id,
+        }
+
+
+class MultiObjectTracker:
+    def __init__(self, detect_every=5, iou_threshold=0.3, max_misses=3, min_hits=2, lines=None,
+                 flow=True, flow_points=12, reassociate_gate=0.5):
+        """
+        :param detect_every: 推論するフレームの間隔 (1 なら毎フレーム推論し、フローは使わない)
+        :param iou_threshold: 検出とトラックを対応付けるIoUの下限
+        :param max_misses: 推論フレームで連続してこの回数を超えて見つからなければトラックを消す
+        :param min_hits: この回数検出されたトラックを確定とし、結果・訪問者数に含める
+        :param lines: 通過数を数えるライン [{"name": str, "points": [[x1, y1], [x2, y2]]}, ...] (正規化座標)
+                      通過の向きは画面上で points[0] -> points[1] を上から下へ引いた縦線のとき
+                      左から右が "in"、右から左が "out" (斜めの線もこの向きを回転させたもの)
+        :param flow: 推論しないフレームでオプティカルフローを使う (False ならカルマンの予測のみ)
+        :param flow_points: 1トラックあたりの特徴点の最大数
+        :param reassociate_gate: 新しいトラックを見失ったトラックと同じ人物とみなす中心のずれの上限 (枠の大きさに対する割合。
+                                 見失ってからの位置の推定の標準偏差を加える)
+        """
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.lines = lines or []
+        self.flow = flow
+        self.flow_points = flow_points
+        self.reassociate_gate = reassociate_gate
+
+        self.tracks = []
+        self._lost = []  # 見失って消した確定トラック (引き継ぎの候補)
+        self.frame_index = 0
+        self._next_id = 1
+        self._prev_gray = None
+        self._image_size = None
+
+        # カウンタ
+        self.visitors = {}  # クラス名 -> 確定したトラック数
+        self.crossings = {line["name"]: {"in": 0, "out": 0} for line in self.lines}
+        self.detections_run = 0
+        self.frames_propagated = 0
+
+    def needs_detection(self):
+        """このフレームで推論が必要か"""
+        return self.frame_index % self.detect_every == 0
+
+    def update(self, image, detections=None):
+        """
+        1フレーム分トラッカーを進める
+        :param image: 推論に使ったのと同じ座標系の画像 (BGR)
+        :param detections: YoloDetector.detect の結果。推論しないフレームでは None
+        :return: 確定したトラックの結果 (detect と同じ形式に track_id を加えたもの)
+        """
+        self._image_size = image.shape[1], image.shape[0]
+        gray = None
+        if self.flow and (detections is None or self.detect_every > 1):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        for track in self.tracks:
+            track.last_center = track.kf.center
+            track.kf.predict()
+
+        if detections is None:
+            self.frames_propagated += 1
+            if gray is not None and self._prev_gray is not None:
+                self._propagate(self._prev_gray, gray)
+        else:
+            self.detections_run += 1
+            self._associate(detections)
+
+        for track in self.tracks:
+            self._count_crossings(track)
+
+        self._prev_gray = gray
+        self.frame_index += 1
+        return [track.to_result() for track in self.tracks if track.confirmed]
+
+    def _associate(self, detections):
+        boxes = [d["box"] for d in detections]
+        iou = iou_matrix([t.kf.box for t in self.tracks], boxes)
+        if iou.size:
+            # 違うクラス同士は対応付けない
+            same_class = (np.array([t.class_id for t in self.tracks])[:, None]
+                          == np.array([d["class_id"] for d in detections])[None, :])
+            iou = np.where(same_class, iou, 0.0)
+        matches, lost, new = greedy_match(iou, self.iou_threshold)
+
+        confirming = []
+        for i, j in matches:
+            track = self.tracks[i]
+            track.kf.update(detections[j]["box"])
+            track.score = detections[j]["score"]
+            track.hits += 1
+            track.misses = 0
+            track.mark_seen(self.frame_index)
+            if not track.confirmed and track.hits >= self.min_hits:
+                confirming.append(track)
+        for i in lost:
+            self.tracks[i].misses += 1
+
+        for j in new:
+            track = Track(self._next_id, detections[j])
+            self._next_id += 1
+            track.created = track.seen_frame = self.frame_index
+            if self.min_hits <= 1:
+                confirming.append(track)
+            self.tracks.append(track)
+        for track in confirming:
+            self._confirm(track)
+
+        self._lost += [t for t in self.tracks if t.misses > self.max_misses and t.confirmed]
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        # 候補の期間内に作られたトラックが確定するまで残す
+        keep = self._reassociate_window() + (self.min_hits - 1) * self.detect_every
+        self._lost = [t for t in self._lost if self.frame_index - t.seen_frame <= keep]
+
+    def _confirm(self, track):
+        previous = self._reassociate(track)
+        if previous is not None:
+            # 交差・遮蔽で見失った人物: IDを引き継ぎ、訪問者として数え直さない
+            # 前のトラックの位置から今の位置までの移動でラインの通過を数える
+            track.id = previous.id
+            track.last_center = previous.kf.center
+            track.confirmed = True
+            self._count_crossings(track)
+            track.last_center = track.kf.center
+            return
+        track.confirmed = True
+        self.visitors[track.class_name] = self.visitors.get(track.class_name, 0) + 1
+
+    def _reassociate_window(self):
+        """
+        見失ったトラックを引き継ぎの候補にする期間 [フレーム]
+        トラックが消えるまで (max_misses + 1 回の推論) と、消えてから max_misses 回の推論の間
+        """
+        return (2 * self.max_misses + 1) * self.detect_every
+
+    def _reassociate(self, track):
+        """
+        確定する前のトラックを、見失った確定トラック (検出と対応しなくなったもの・消したもの) と対応付ける
+        最後に検出されたときの位置・速度から推定した中心が最も近く、ずれが枠の大きさ × reassociate_gate (と推定の標準偏差) 以内のものを選び、候補から外す
+        :return: 引き継ぐトラック (なければ None)
+        """
+        candidates = [t for t in self.tracks if t.confirmed and t.misses > 0] + self._lost
+        candidates = [t for t in candidates
+                      if t.class_id == track.class_id
+                      and 0 < track.created - t.seen_frame <= self._reassociate_window()]
+        if not candidates:
+            return None
+        # 推定した中心とのずれ (枠の大きさ × reassociate_gate と推定の標準偏差を合わせた大きさで割ったもの)
+        # 検出された回数が少ないトラックは速度が不確かなので、見失ってからの時間に応じて広く探す
+        cx, cy, width, height = track.kf.x[:4]
+        distance = []
+        for candidate in candidates:
+            ex, ey, sx, sy = candidate.expected_center(self.frame_index)
+            distance.append(np.hypot((ex - cx) / np.hypot(width * self.reassociate_gate, sx),
+                                     (ey - cy) / np.hypot(height * self.reassociate_gate, sy)))
+        best = int(np.argmin(distance))
+        if distance[best] > 1.0:
+            return None
+        previous = candidates[best]
+        if previous in self._lost:
+            self._lost.remove(previous)
+        else:
+            self.tracks.remove(previous)
+        return previous
+
+    def _propagate(self, prev_gray, gray):
+        """各トラックの枠内の特徴点を追跡し、移動量の中央値で枠を動かす"""
+        height, width = gray.shape[:2]
+        owners = []
+        points = []
+        boxes = np.array([track.kf.box for track in self.tracks]).reshape(-1, 4)
+        for k, track in enumerate(self.tracks):
+            left, top, w, h = boxes[k]
+            x0, y0 = max(int(left), 0), max(int(top), 0)
+            x1, y1 = min(int(left + w), width), min(int(top + h), height)
+            if x1 - x0 < 8 or y1 - y0 < 8:
+                continue
+            # 枠の部分だけで特徴点を探す
+            found = cv2.goodFeaturesToTrack(prev_gray[y0:y1, x0:x1], self.flow_points, 0.01, 3)
+            if found is None:
+                continue
+            found = found.reshape(-1, 2) + (x0, y0)
+            # 他のトラックの枠と重なる部分の点はどちらの動きか分からないので使わない
+            # (すれ違う人物に引きずられて枠が止まらないように。点が残らなければカルマンの予測で進める)
+            others = np.delete(boxes, k, axis=0)
+            if len(others):
+                inside = ((found[:, None, 0] >= others[:, 0]) & (found[:, None, 0] <= others[:, 0] + others[:, 2])
+                          & (found[:, None, 1] >= others[:, 1]) & (found[:, None, 1] <= others[:, 1] + others[:, 3]))
+                found = found[~inside.any(axis=1)]
+                if not len(found):
+                    continue
+            points.append(found)
+            owners.extend([track] * len(found))
+        if not points:
+            return
+
+        # 全トラックの特徴点をまとめて1回で追跡する (ピラミッドの作成は1回で済む)
+        points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2)
+        shifts = (moved - points).reshape(-1, 2)
+        ok = status.reshape(-1) == 1
+        owners = np.array(owners, dtype=object)
+        for track in set(owners):
+            mine = (owners == track) & ok
+            if mine.sum() < 2:
+                continue
+            shift = np.median(shifts[mine], axis=0)
+            # 移動前の枠 (予測前の中心) を動かしたものを観測として使う
+            px, py = track.last_center
+            _, _, bw, bh = track.kf.box
+            observed = [px + shift[0] - bw / 2, py + shift[1] - bh / 2, bw, bh]
+            track.kf.update(observed, noise_scale=2.0)
+
+    def _count_crossings(self, track):
+        if not self.lines or not track.confirmed:
+            return
+        width, height = self._image_size
+        p = np.array(track.last_center)
+        q = np.array(track.kf.center)
+        for line in self.lines:
+            (ax, ay), (bx, by) = line["points"]
+            a = np.array([ax * width, ay * height])
+            b = np.array([bx * width, by * height])
+            side_p = _cross(b - a, p - a)
+            side_q = _cross(b - a, q - a)
+            if side_p == 0 or side_q == 0 or (side_p > 0) == (side_q > 0):
+                continue
+            # 移動の線分がラインの線分と交わるか
+            side_a = _cross(q - p, a - p)
+            side_b = _cross(q - p, b - p)
+            if (side_a > 0) == (side_b > 0):
+                continue
+            self.crossings[line["name"]]["in" if side_q < 0 else "out"] += 1
+
+    def stats(self):
+        return {
+            "active": sum(1 for t in self.tracks if t.confirmed),
+            "visitors": dict(self.visitors),
+            "crossings": {name: dict(c) for name, c in self.crossings.items()},
+            "detections_run": self.detections_run,
+            "frames_propagated": self.frames_propagated,
+        }
+
+
+def _cross(u, v):
+    return u[0] * v[1] - u[1] * v[0]
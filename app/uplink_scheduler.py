@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import deque
+
+from .airtime import AS923_DATA_RATES, lorawan_time_on_air
+from .payload_codec import WindowAggregator
+
+# AS923 のデータレートごとの最大アプリケーションペイロード長 N [byte] (RP002-1.0.3, FOptsなし)
+AS923_MAX_PAYLOAD = {0: 51, 1: 51, 2: 51, 3: 115, 4: 242, 5: 242, 6: 242}
+# UplinkDwellTime=1 (400ms制限) の場合
+AS923_MAX_PAYLOAD_DWELL = {0: 0, 1: 0, 2: 11, 3: 53, 4: 125, 5: 242, 6: 242}
+
+
+def max_payload(data_rate, dwell_time=False):
+    """データレートの最大アプリケーションペイロード長 [byte]"""
+    return (AS923_MAX_PAYLOAD_DWELL if dwell_time else AS923_MAX_PAYLOAD)[data_rate]
+
+
+class UplinkScheduler:
+    """
+    送信時間 (airtime) とデューティ比を考慮したアップリンクのスケジューラ
+
+    検出結果は Window 周期ごとにレコードにまとめて送信待ちに積み、
+    送信可能になった時点で現在のデータレートの最大ペイロードに収まるだけ詰めて1回で送る。
+    送信可否は
+      - 直前の送信後の休止時間 (airtime * (1/duty_cycle - 1))
+      - 直近 budget_window 秒間の合計送信時間が duty_cycle * budget_window 以下
+    の両方で判定する。
+    outbox を指定すると、レコードは送信が確認できるまでディスクにも保管され、再起動後に送信待ちへ戻される。
+    add_sample は撮影側のスレッド、poll / on_sent は送信側のスレッドから呼ばれる。
+    """
+
+    def __init__(self, codec, window_size=1, data_rate=2, duty_cycle=0.01, budget_window=3600,
+                 max_latency=0, max_pending=1000, dwell_time=False, outbox=None, order="oldest",
+                 confirmed=False):
+        """
+        :param codec: PayloadCodec
+        :param window_size: 1レコードにまとめる周期数
+        :param data_rate: AS923のデータレート番号
+        :param duty_cycle: デューティ比 (例: 0.01 = 1%)
+        :param budget_window: 送信時間を集計する期間 [秒]
+        :param max_latency: 最大ペイロードに満たなくても、最古のレコードがこの秒数待ったら送る (0 なら送信可能になり次第送る)
+        :param max_pending: 送信待ちレコードの上限 (超えたら古いものから捨てる)
+        :param dwell_time: UplinkDwellTime=1 の最大ペイロード表を使う
+        :param outbox: Outbox。送信待ちレコードをディスクに保管する (None なら メモリのみ)
+        :param order: 溜まったレコードを送る順 ("oldest": 古い順 / "newest": 新しい順)。1回の送信の中は常に時刻順
+        :param confirmed: Confirmed アップリンクで送る (ネットワークの受信確認が取れたものだけを送信済みにする)
+        """
+        self.codec = codec
+        self.window = WindowAggregator(codec.classes, size=window_size)
+        self.duty_cycle = duty_cycle
+        self.budget_window = budget_window
+        self.max_latency = max_latency
+        self.dwell_time = dwell_time
+        self.set_data_rate(data_rate)
+        if order not in ("oldest", "newest"):
+            raise ValueError(f"Unknown order: {order}")
+        self.order = order
+        self.outbox = outbox
+        self.confirmed = confirmed
+
+        self.pending = deque(maxlen=max_pending)
+        self._pending_since = deque(maxlen=max_pending)
+        self._pending_seq = deque(maxlen=max_pending)  # Outbox の seq (保管していなければ None)
+        self._history = deque()  # (送信完了時刻, 送信時間)
+        self._next_allowed = 0.0
+        self._inflight = []  # poll() で詰めたレコード (on_sent で送信待ちから外す)
+        self._lock = threading.Lock()
+
+        self.frames_sent = 0
+        self.frames_failed = 0
+        self.records_sent = 0
+        self.records_dropped = 0
+        self.airtime_total = 0.0
+
+        if outbox is not None:
+            # 前回までに送信が確認できなかったレコードを送信待ちに戻す
+            now = time.monotonic()
+            for seq, record in outbox.pending()[-max_pending:]:
+                self.pending.append(record)
+                self._pending_since.append(now)
+                self._pending_seq.append(seq)
+
+    def set_data_rate(self, data_rate):
+        self.data_rate = data_rate
+        self.sf, self.bw = AS923_DATA_RATES[data_rate]
+        self.max_payload = max_payload(data_rate, self.dwell_time)
+
+    def min_payload(self):
+        """1レコードを送るのに必要なペイロード長の目安 [byte] (ヘッダ1byte + 1レコード)"""
+        return 1 + self.codec.record_size(with_stats=self.window.size > 1)
+
+    def airtime(self, payload_len):
+        return lorawan_time_on_air(payload_len, sf=self.sf, bw=self.bw)
+
+    def airtime_used(self, now=None):
+        """直近 budget_window 秒間の合計送信時間 [秒]"""
+        now = time.monotonic() if now is None else now
+        while self._history and self._history[0][0] < now - self.budget_window:
+            self._history.popleft()
+        return sum(airtime for _, airtime in self._history)
+
+    @property
+    def budget(self):
+        return self.duty_cycle * self.budget_window
+
+    def add_sample(self, dt, counts, now=None):
+        """1周期分の検出数を追加する。窓が埋まったらレコードとして送信待ちに積む"""
+        with self._lock:
+            self.window.add(dt, counts)
+            if not self.window.full:
+                return
+            record = self.window.flush()
+            if self.window.size == 1:
+                record.pop("stats")
+            if len(self.pending) == self.pending.maxlen:
+                self.records_dropped += 1
+            self.pending.append(record)
+            self._pending_since.append(time.monotonic() if now is None else now)
+            self._pending_seq.append(self.outbox.append(record) if self.outbox is not None else None)
+
+    def _ordered(self):
+        """送る順に並べた送信待ちレコード"""
+        records = list(self.pending)
+        if self.order == "newest":
+            records.reverse()
+        return records
+
+    def _encode(self, records, sent_at=None):
+        # 時刻は差分で符号化するので、1回の送信の中は時刻順にする
+        return self.codec.encode(records[::-1] if self.order == "newest" else records, sent_at=sent_at)
+
+    def _pack(self, sent_at=None):
+        """最大ペイロードに収まるだけレコードを詰める -> (payload, レコード数)"""
+        records = self._ordered()
+        payload = None
+        count = 0
+        for n in range(1, len(records) + 1):
+            candidate = self._encode(records[:n], sent_at=sent_at)
+            if len(candidate) > self.max_payload:
+                break
+            payload, count = candidate, n
+        return payload, count
+
+    def poll(self, now=None, sent_at=None):
+        """
+        今送信すべきペイロードがあれば返す
+        :return: (payload, レコード数) または None
+        """
+        with self._lock:
+            if not self.pending:
+                return None
+            now = time.monotonic() if now is None else now
+            if now < self._next_allowed:
+                return None
+
+            payload, count = self._pack(sent_at)
+            if payload is None:
+                # 1レコードも入らない場合は単独で送る (データレートが低すぎる)
+                payload, count = self._encode(self._ordered()[:1], sent_at=sent_at), 1
+
+            full = count < len(self.pending) or len(payload) + self.codec.record_size() > self.max_payload
+            waited = now - self._pending_since[0]
+            if not full and waited < self.max_latency:
+                return None
+            if self.airtime_used(now) + self.airtime(len(payload)) > self.budget:
+                return None
+            self._inflight = self._ordered()[:count]
+            return payload, count
+
+    def on_sent(self, payload, count, success, now=None, transmissions=1):
+        """
+        送信結果を反映する。成功したレコードは送信待ちから外す
+        :param transmissions: 実際に電波を出した回数 (nbtrials による繰り返し・再送を含む)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            airtime = self.airtime(len(payload)) * transmissions
+            # 失敗しても電波は出ている可能性があるため送信時間として数える
+            self._history.append((now, airtime))
+            self.airtime_total += airtime
+            # on_sent は送信完了後に呼ばれるため、ここから休止時間を数える
+            self._next_allowed = now + airtime * (1 / self.duty_cycle - 1)
+
+            inflight, self._inflight = self._inflight, []
+            if not success:
+                self.frames_failed += 1
+                return
+            self.frames_sent += 1
+            self.records_sent += count
+            # poll() の後に積まれたレコードや、上限で捨てられたレコードがあっても、送ったものだけを外す
+            sent = {id(record) for record in inflight[:count]}
+            rows = list(zip(self.pending, self._pending_since, self._pending_seq))
+            acked = [seq for record, _, seq in rows if id(record) in sent]
+            self.pending.clear()
+            self._pending_since.clear()
+            self._pending_seq.clear()
+            for record, since, seq in rows:
+                if id(record) not in sent:
+                    self.pending.append(record)
+                    self._pending_since.append(since)
+                    self._pending_seq.append(seq)
+            if self.outbox is not None:
+                self.outbox.ack(seq for seq in acked if seq is not None)
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            used = self.airtime_used(now)
+        return {
+            "data_rate": self.data_rate,
+            "max_payload": self.max_payload,
+            "frames_sent": self.frames_sent,
+            "frames_failed": self.frames_failed,
+            "records_sent": self.records_sent,
+            "records_pending": len(self.pending),
+            "records_dropped": self.records_dropped,
+            "airtime_total_s": self.airtime_total,
+            "airtime_window_s": used,
+            "budget_s": self.budget,
+            "budget_used": used / self.budget if self.budget > 0 else 0.0,
+            "outbox": self.outbox.stats() if self.outbox is not None else None,
+        }
@@ -0,0 +1,463 @@
+"""
+最新フレームを配信する組み込みHTTPサーバー
+
+撮影ループの最新フレームと検出結果はメモリ上 (FrameStore) に置き、
+描画とJPEGエンコードは閲覧されたときにだけ行う (同じフレームの2回目以降はキャッシュを返す)。
+見ている人がいなければ描画・エンコード・SDカードへの書き込みは発生しない。
+
+エンドポイント:
+  /              簡易ビューア
+  /latest.jpg    最新の検出結果画像 (ETag / If-None-Match 対応)
+  /latest.json   最新の撮影日時・検出数
+  /stream.mjpg   MJPEGストリーム
+  /logs/         ログ一覧。/logs/<name> は Range リクエスト (末尾だけの取得など) に対応
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+import cv2
+
+try:
+    import simplejpeg
+except ImportError:  # 開発環境などで入っていなければ OpenCV でエンコードする
+    simplejpeg = None
+
+from .metrics import metrics
+
+
+def encode_jpeg(image, quality=80):
+    """BGR画像をJPEGにする"""
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(image, quality=quality, colorspace="BGR", fastdct=True)
+    ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return data.tobytes()
+
+
+class FrameStore:
+    """
+    最新フレームと検出結果を保持する (パイプラインのスレッドとHTTPサーバーで共有)
+    画像は要求されたときに描画・エンコードし、フレームが変わるまで使い回す
+    """
+
+    def __init__(self, draw_results=None, quality=80):
+        """
+        :param draw_results: 検出結果を画像に描く関数 (YoloDetector.draw_results)
+        :param quality: JPEG品質
+        """
+        self.draw_results = draw_results
+        self.quality = quality
+        self.version = 0  # フレームが変わるごとに増える
+        self._frame = None
+        self._frame_info = None
+        self._info = None
+        self._cache = None  # (version, etag, jpeg)
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    def update(self, dt, results, counts, frame=None, note=""):
+        """
+        撮影周期ごとに呼ぶ
+        :param frame: フル解像度画像 (このストアが所有し、描画で書き換える)。None なら画像は前回のまま
+        """
+        info = {
+            "time": dt.isoformat(),
+            "counts": counts,
+            "detections": len(results),
+            "note": note,
+        }
+        with self._lock:
+            self._info = info
+            if frame is not None:
+                self._frame = frame
+                self._frame_info = (dt, results, note)
+                self.version += 1
+
+    def info(self):
+        with self._lock:
+            info = dict(self._info) if self._info else {}
+            if self._frame_info is not None:
+                info["frame_time"] = self._frame_info[0].isoformat()
+            info["version"] = self.version
+        return info
+
+    def jpeg(self):
+        """
+        :return: (version, etag, JPEGのバイト列)。まだフレームがなければ None
+        """
+        with self._encode_lock:
+            with self._lock:
+                cache = self._cache
+                version, frame, frame_info = self.version, self._frame, self._frame_info
+            if frame is None:
+                return None
+            if cache is not None and cache[0] == version:
+                return cache
+
+            dt, results, note = frame_info
+            with metrics.timer("web_encode"):
+                # 描画はこのフレームにつき1回だけなので、コピーせずに書き込む
+                if self.draw_results is not None:
+                    frame = self.draw_results(frame, results)
+                label = dt.strftime('%Y-%m-%d %H:%M:%S') + (f" {note}" if note else "")
+                cv2.putText(frame, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                data = encode_jpeg(frame, self.quality)
+            etag = '"' + hashlib.blake2b(data, digest_size=8).hexdigest() + '"'
+            cache = (version, etag, data)
+            with self._lock:
+                self._cache = cache
+            return cache
+
+
+class SnapshotSaver:
+    """
+    検出結果画像をディスクへ保存する (イベント発生時だけ)
+      mode: "none"      保存しない
+            "change"    人数が前回保存時から変わったとき
+            "detection" 何か検出されたとき
+            "always"    フレームが来るたび (従来の動作)
+    min_interval 秒以内の連続した保存はしない (SDカードの書き込みを抑える)
+    """
+    MODES = ("none", "change", "detection", "always")
+
+    def __init__(self, store, path="data/images/latest_result.jpg", mode="change", min_interval=60.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown snapshot mode: {mode}")
+        self.store = store
+        self.path = path
+        self.mode = mode
+        self.min_interval = min_interval
+        self.saved = 0
+        self._last_saved = None
+        self._last_count = None
+
+    def maybe_save(self, person_count, total_count):
+        """フレームを更新した直後に呼ぶ。保存したら True"""
+        if self.mode == "none":
+            return False
+        if self.mode == "change" and person_count == self._last_count:
+            return False
+        if self.mode == "detection" and total_count == 0:
+            return False
+        now = time.monotonic()
+        if self._last_saved is not None and now - self._last_saved < self.min_interval:
+            return False
+
+        encoded = self.store.jpeg()
+        if encoded is None:
+            return False
+        with metrics.timer("snapshot_write"):
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(encoded[2])
+            os.replace(tmp, self.path)
+        self._last_saved = now
+        self._last_count = person_count
+        self.saved += 1
+        return True
+
+
+class WebMonitor:
+    """FrameStore とログディレクトリを配信する asyncio のHTTPサーバー (専用スレッドで動く)"""
+    CHUNK_SIZE = 64 * 1024
+    CONTENT_TYPES = {".csv": "text/csv; charset=utf-8", ".gz": "application/gzip",
+                     ".json": "application/json", ".jpg": "image/jpeg", ".db": "application/octet-stream"}
+
+    def __init__(self, store, host="0.0.0.0", port=8000, log_dir="data/logs", stream_fps=2.0, max_streams=4):
+        """
+        :param stream_fps: MJPEGストリームの最大フレームレート
+        :param max_streams: 同時に配信するMJPEGストリーム数の上限
+        """
+        self.store = store
+        self.host = host
+        self.port = port
+        self.log_dir = log_dir
+        self.stream_fps = stream_fps
+        self.max_streams = max_streams
+        self.streams = 0
+        self.requests = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    # ------------------------------------------------------------------
+    # 起動・停止
+    # ------------------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="web-monitor", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        print(f"Web monitor: http://{self.host}:{self.port}/")
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            self._loop.close()
+            return
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # 配信中のストリームなどを終わらせてからループを閉じる
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def stop(self):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    # ------------------------------------------------------------------
+    # リクエスト処理
+    # ------------------------------------------------------------------
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), timeout=10)
+            if request is None:
+                return
+            method, path, headers = request
+            self.requests += 1
+            if method not in ("GET", "HEAD"):
+                await self._send(writer, 405, b"Method Not Allowed\n", head=False)
+                return
+            head = method == "HEAD"
+            path = path.split("?", 1)[0]
+            if path == "/":
+                await self._send(writer, 200, INDEX_HTML.encode(), "text/html; charset=utf-8", head=head)
+            elif path == "/latest.jpg":
+                await self._send_latest(writer, headers, head)
+            elif path == "/latest.json":
+                body = json.dumps(self.store.info()).encode()
+                await self._send(writer, 200, body, "application/json", {"Cache-Control": "no-cache"}, head)
+            elif path == "/stream.mjpg":
+                await self._send_stream(writer)
+            elif path == "/logs" or path == "/logs/":
+                await self._send_log_index(writer, head)
+            elif path.startswith("/logs/"):
+                await self._send_log(writer, path[len("/logs/"):], headers, head)
+            else:
+                await self._send(writer, 404, b"Not Found\n", head=head)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass  # 停止時に配信中のストリームを打ち切った
+        except Exception as e:
+            print(f"[WebMonitor] Request failed: {e}")
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) < 2:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return parts[0].upper(), parts[1], headers
+
+    async def _send(self, writer, status, body=b"", content_type="text/plain; charset=utf-8", extra=None, head=False):
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        headers.update(extra or {})
+        writer.write(self._header(status, headers))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    @staticmethod
+    def _header(status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _encoded(self):
+        # エンコードはCPUを使うのでイベントループを止めないよう別スレッドで行う
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.jpeg)
+
+    async def _send_latest(self, writer, headers, head):
+        encoded = await self._encoded()
+        if encoded is None:
+            await self._send(writer, 503, b"No frame yet\n", extra={"Retry-After": "5"}, head=head)
+            return
+        _, etag, data = encoded
+        cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            writer.write(self._header(304, cache_headers))
+            await writer.drain()
+            return
+        await self._send(writer, 200, data, "image/jpeg", cache_headers, head)
+
+    async def _send_stream(self, writer):
+        if self.streams >= self.max_streams:
+            await self._send(writer, 503, b"Too many streams\n", extra={"Retry-After": "10"})
+            return
+        self.streams += 1
+        try:
+            writer.write(self._header(200, {
+                "Content-Type": "multipart/x-mixed-replace; boundary=frame",
+                "Cache-Control": "no-cache",
+            }))
+            sent_version = None
+            while True:
+                # 新しいフレームが来たときだけ送る
+                if self.store.version != sent_version:
+                    encoded = await self._encoded()
+                    if encoded is not None:
+                        sent_version, _, data = encoded
+                        writer.write(b"--frame\r\nContent-Type: image/jpeg\r\n"
+                                     + f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+                        await writer.drain()
+                await asyncio.sleep(1.0 / self.stream_fps)
+        finally:
+            self.streams -= 1
+
+    # ------------------------------------------------------------------
+    # ログ
+    # ------------------------------------------------------------------
+    async def _send_log_index(self, writer, head):
+        rows = []
+        if os.path.isdir(self.log_dir):
+            for name in sorted(os.listdir(self.log_dir)):
+                path = os.path.join(self.log_dir, name)
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    modified = datetime.datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+                    rows.append(f'<tr><td><a href="/logs/{name}">{name}</a></td>'
+                                f'<td align="right">{stat.st_size}</td><td>{modified}</td></tr>')
+        body = ("<!DOCTYPE html><html><head><meta charset='utf-8'><title>LoRaCam logs</title></head><body>"
+                "<h1>Logs</h1><table><tr><th>Name</th><th>Bytes</th><th>Modified</th></tr>"
+                + "".join(rows) + "</table></body></html>")
+        await self._send(writer, 200, body.encode(), "text/html; charset=utf-8", head=head)
+
+    async def _send_log(self, writer, name, headers, head):
+        # ログディレクトリ直下のファイルだけを返す
+        if "/" in name or "\\" in name or name.startswith("."):
+            await self._send(writer, 404, b"Not Found\n", head=head)
+            return
+        path = os.path.join(self.log_dir, name)
+        if not os.path.isfile(path):
+            await self._send(writer, 404, b"Not Found\n", head=head)
+            return
+
+        size = os.path.getsize(path)
+        content_type = self.CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+        start, end = 0, size - 1
+        status = 200
+        range_header = headers.get("range")
+        if range_header:
+            parsed = parse_range(range_header, size)
+            if parsed is None:
+                writer.write(self._header(416, {"Content-Range": f"bytes */{size}", "Content-Length": "0"}))
+                await writer.drain()
+                return
+            start, end = parsed
+            status = 206
+
+        length = max(0, end - start + 1)
+        response_headers = {"Content-Type": content_type, "Content-Length": str(length), "Accept-Ranges": "bytes"}
+        if status == 206:
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        writer.write(self._header(status, response_headers))
+        if not head:
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(self.CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    writer.write(chunk)
+                    await writer.drain()
+        await writer.drain()
+
+
+def parse_range(header, size):
+    """
+    Range ヘッダ (bytes=0-99, bytes=100-, bytes=-500) を (先頭, 末尾) に直す
+    複数範囲の指定は最初の範囲だけを使う。満たせない範囲なら None
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    first, _, last = spec.split(",")[0].strip().partition("-")
+    try:
+        if not first:
+            # 末尾から last バイト
+            length = int(last)
+            if length <= 0 or size == 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+STATUS_TEXT = {200: "OK", 206: "Partial Content", 304: "Not Modified", 404: "Not Found",
+               405: "Method Not Allowed", 416: "Range Not Satisfiable", 503: "Service Unavailable"}
+
+INDEX_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>LoRaCam</title>
+<style>body{font-family:sans-serif;margin:1em}img{max-width:100%}</style></head>
+<body>
+<h1>LoRaCam</h1>
+<p id="info">-</p>
+<img id="latest" src="/latest.jpg" alt="latest result">
+<p><a href="/stream.mjpg">MJPEG stream</a> | <a href="/logs/">logs</a></p>
+<script>
+async function refresh() {
+  try {
+    const info = await (await fetch("/latest.json")).json();
+    document.getElementById("info").textContent =
+      `${info.time || "-"}  ${JSON.stringify(info.counts || {})} ${info.note || ""}`;
+    const img = document.getElementById("latest");
+    if (img.dataset.version !== String(info.version)) {
+      img.dataset.version = info.version;
+      img.src = "/latest.jpg?v=" + info.version;
+    }
+  } catch (e) {}
+}
+refresh();
+setInterval(refresh, 2000);
+</script>
+</body></html>
+"""
@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+
+# COCOデータセットのクラス名
+CLASSES = [
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
+    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
+    "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard",
+    "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple",
+    "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch",
+    "potted plant", "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard", "cell phone",
+    "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors", "teddy bear",
+    "hair drier", "toothbrush"
+]
+
+
+def resolve_class_ids(classes):
+    """
+    クラス名またはクラスIDのリストをCOCOのクラスID配列に変換する
+    :param classes: ["person", 2, ...] のようなリスト。None または空なら全クラス
+    :return: np.ndarray (int) または None (全クラス)
+    """
+    if not classes:
+        return None
+    ids = []
+    for c in classes:
+        if isinstance(c, str):
+            if c not in CLASSES:
+                raise ValueError(f"Unknown class name: {c}")
+            ids.append(CLASSES.index(c))
+        else:
+            ids.append(int(c))
+    return np.array(sorted(set(ids)), dtype=np.intp)
+
+
+class YoloDecoder:
+    """
+    YOLOv8出力テンソル (1, 4+クラス数, 候補数) のデコードとNMS
+
+    閾値判定は量子化された整数のまま行い、閾値を超えた候補列だけを
+    デクオンタイズする。Pythonループを使わず全てNumPyの配列演算で処理する。
+    """
+
+    def __init__(self, input_size, conf_threshold=0.4, nms_threshold=0.45,
+                 classes=None, top_k=300, output_dtype=np.float32, quantization=(0.0, 0)):
+        """
+        :param input_size: モデル入力サイズ (Width, Height)
+        :param classes: スコアを計算するクラス (名前またはID)。None なら全クラス
+        :param top_k: NMSに渡す候補の上限 (スコア上位のみ残す)。None なら上限なし
+        :param output_dtype: 出力テンソルの型
+        :param quantization: 出力テンソルの (scale, zero_point)
+        """
+        self.input_size = input_size
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        self.output_dtype = np.dtype(output_dtype)
+        self.output_scale, self.output_zero_point = quantization
+        self.quantized = (self.output_dtype in (np.int8, np.uint8)) and self.output_scale > 0
+
+        self.class_ids = resolve_class_ids(classes)
+        self.set_conf_threshold(conf_threshold)
+
+    def set_conf_threshold(self, conf_threshold):
+        self.conf_threshold = conf_threshold
+        if self.quantized:
+            # 取りうる全ての整数値を従来と同じ式でデクオンタイズし、
+            # 閾値を超える最小の量子化値を求める (単調増加なので比較だけで済む)
+            info = np.iinfo(self.output_dtype)
+            q_values = np.arange(info.min, info.max + 1)
+            deq = self._dequantize(q_values.astype(self.output_dtype))
+            above = np.nonzero(deq > conf_threshold)[0]
+            self.q_threshold = int(q_values[above[0]]) if len(above) > 0 else info.max + 1
+
+    def _dequantize(self, data):
+        return (data.astype(np.float32) - self.output_zero_point) * self.output_scale
+
+    def decode(self, output):
+        """
+        閾値判定・クラス選択・ボックス変換を行う
+        :param output: 出力テンソルのバッチ0 (4+クラス数, 候補数)。量子化されたままでよい
+        :return: (boxes[K,4] = [left, top, w, h] (int), scores[K] (float32), class_ids[K] (int))
+        """
+        # 対象クラスのスコアのみ取り出す
+        if self.class_ids is None:
+            scores = output[4:]
+        else:
+            scores = output[4 + self.class_ids]
+
+        max_scores = scores.max(axis=0)
+        if self.quantized:
+            valid = np.nonzero(max_scores >= self.q_threshold)[0]
+        else:
+            valid = np.nonzero(max_scores > self.conf_threshold)[0]
+
+        if len(valid) == 0:
+            return np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.intp)
+
+        # 上位top_k件に制限 (候補の並び順は元の行順を維持する)
+        if self.top_k is not None and len(valid) > self.top_k:
+            part = np.argpartition(-max_scores[valid], self.top_k - 1)[:self.top_k]
+            valid = valid[np.sort(part)]
+
+        conf = max_scores[valid]
+        class_ids = scores[:, valid].argmax(axis=0)
+        if self.class_ids is not None:
+            class_ids = self.class_ids[class_ids]
+
+        xywh = output[:4, valid]
+        if self.quantized:
+            conf = self._dequantize(conf)
+            xywh = self._dequantize(xywh)
+        conf = conf.astype(np.float32)
+
+        # 正規化座標 -> モデル入力座標 (従来と同じくfloat64で計算し、0方向へ切り捨て)
+        w_in, h_in = self.input_size
+        xywh = xywh.astype(np.float64)
+        cx = xywh[0] * w_in
+        cy = xywh[1] * h_in
+        w = xywh[2] * w_in
+        h = xywh[3] * h_in
+
+        boxes = np.empty((len(valid), 4), dtype=np.int64)
+        boxes[:, 0] = cx - w / 2
+        boxes[:, 1] = cy - h / 2
+        boxes[:, 2] = w
+        boxes[:, 3] = h
+        return boxes, conf, class_ids
+
+    def nms(self, boxes, scores):
+        """NMSを実行し、残った候補のインデックスを返す"""
+        if len(boxes) == 0:
+            return np.empty(0, dtype=np.intp)
+        indices = cv2.dnn.NMSBoxes(boxes, scores, self.conf_threshold, self.nms_threshold)
+        return np.asarray(indices, dtype=np.intp).reshape(-1)
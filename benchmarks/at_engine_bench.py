@@ -0,0 +1,62 @@
+"""
+LoRaCommunicator のATコマンド処理の所要時間を疑似モデム (pty) で測定する
+
+Join (connect_network) と送信 (send_data) にかかった時間と、
+変更前の固定待ち時間 (IREBOOT 2秒, DTRX 2秒, DULSTAT 1秒+2秒間隔 など) を比較する。
+
+使い方:
+    python -m benchmarks.at_engine_bench [--sends 10] [--join-time 3.0] [--tx-time 0.4]
+"""
+import argparse
+import math
+import time
+
+from app.lora_serial import LoRaCommunicator
+from benchmarks.fake_modem import FakeModem
+
+# 変更前の固定待ち時間
+LEGACY_SETUP_WAIT = 2 + 0.1 * 7 + 1  # IREBOOT, 設定コマンド7個, DJOIN
+LEGACY_POLL_WAIT = 1 + 2  # DULSTAT? の待ち + ポーリング間隔
+LEGACY_SEND_WAIT = 2  # DTRX
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AT command engine latency benchmark")
+    parser.add_argument("--sends", type=int, default=10)
+    parser.add_argument("--join-time", type=float, default=3.0)
+    parser.add_argument("--tx-time", type=float, default=0.4)
+    parser.add_argument("--join-urc", action="store_true", help="Join結果を通知で受け取る")
+    args = parser.parse_args()
+
+    modem = FakeModem(join_time=args.join_time, tx_time=args.tx_time, join_urc=args.join_urc).start()
+    lora = LoRaCommunicator(port=modem.port)
+    lora.debug = False
+
+    try:
+        t0 = time.perf_counter()
+        joined = lora.connect_network("0" * 16, "0" * 16, "0" * 32)
+        t_join = time.perf_counter() - t0
+
+        send_times = []
+        for i in range(args.sends):
+            t0 = time.perf_counter()
+            ok = lora.send_data(f"2026-01-01 00:00:{i:02d} 3")
+            send_times.append(time.perf_counter() - t0)
+            if not ok:
+                print(f"send {i} failed")
+    finally:
+        lora.close()
+        modem.stop()
+
+    # 変更前: Join完了後、最初のポーリングで成功を検出するまで
+    legacy_join = LEGACY_SETUP_WAIT + math.ceil(args.join_time / LEGACY_POLL_WAIT) * LEGACY_POLL_WAIT
+    mean_send = sum(send_times) / len(send_times)
+
+    print(f"joined: {joined}, AT timeouts: {lora.timeouts}")
+    print(f"{'':>6} {'engine[s]':>10} {'legacy[s]':>10}")
+    print(f"{'join':>6} {t_join:>10.3f} {legacy_join:>10.3f}")
+    print(f"{'send':>6} {mean_send:>10.3f} {LEGACY_SEND_WAIT:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
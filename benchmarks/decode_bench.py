@@ -0,0 +1,135 @@
+"""
+YoloDetector のデコード処理マイクロベンチマーク
+
+合成した出力テンソル (1, 84, 8400) に対して、従来のPythonループ版デコードと
+ベクトル化版デコード (YoloDecoder) の処理時間を比較し、結果が一致することを確認する。
+
+使い方:
+    python -m benchmarks.decode_bench [--repeat 50] [--classes person]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.yolo_decoder import YoloDecoder
+
+INPUT_SIZE = (640, 640)
+NUM_ANCHORS = 8400
+NUM_CLASSES = 80
+OUTPUT_SCALE = 1.0 / 255.0
+OUTPUT_ZERO_POINT = -128
+
+
+def make_output(density, dtype=np.int8, seed=0):
+    """
+    合成出力テンソルを作る
+    :param density: 閾値を超えるスコアを持つ候補の割合
+    """
+    rng = np.random.default_rng(seed)
+    out = np.empty((4 + NUM_CLASSES, NUM_ANCHORS), dtype=np.float32)
+    out[0:2] = rng.uniform(0.0, 1.0, size=(2, NUM_ANCHORS))
+    out[2:4] = rng.uniform(0.02, 0.3, size=(2, NUM_ANCHORS))
+    out[4:] = rng.uniform(0.0, 0.1, size=(NUM_CLASSES, NUM_ANCHORS))
+    hot = rng.random(NUM_ANCHORS) < density
+    hot_classes = rng.integers(0, NUM_CLASSES, size=NUM_ANCHORS)
+    out[4 + hot_classes[hot], np.nonzero(hot)[0]] = rng.uniform(0.3, 0.95, size=int(hot.sum()))
+
+    if dtype == np.float32:
+        return out[np.newaxis]
+    q = np.round(out / OUTPUT_SCALE + OUTPUT_ZERO_POINT)
+    return np.clip(q, -128, 127).astype(np.int8)[np.newaxis]
+
+
+def legacy_decode(raw, conf_threshold, nms_threshold, class_ids=None):
+    """変更前の YoloDetector.detect のデコード処理 (比較用)"""
+    output_data = raw[0].transpose()
+    if output_data.dtype == np.int8 or output_data.dtype == np.uint8:
+        output_data = (output_data.astype(np.float32) - OUTPUT_ZERO_POINT) * OUTPUT_SCALE
+
+    boxes_candidate = []
+    confidences = []
+    class_list = []
+
+    all_scores = output_data[:, 4:]
+    if class_ids is not None:
+        all_scores = all_scores[:, class_ids]
+    max_scores = np.max(all_scores, axis=1)
+    max_indices = np.argmax(all_scores, axis=1)
+    valid_rows = np.where(max_scores > conf_threshold)[0]
+
+    for i in valid_rows:
+        score = float(max_scores[i])
+        class_id = int(max_indices[i])
+        if class_ids is not None:
+            class_id = int(class_ids[class_id])
+        row = output_data[i]
+
+        cx = row[0] * INPUT_SIZE[0]
+        cy = row[1] * INPUT_SIZE[1]
+        w = row[2] * INPUT_SIZE[0]
+        h = row[3] * INPUT_SIZE[1]
+
+        left = int(cx - w/2)
+        top = int(cy - h/2)
+
+        boxes_candidate.append([left, top, int(w), int(h)])
+        confidences.append(score)
+        class_list.append(class_id)
+
+    indices = cv2.dnn.NMSBoxes(boxes_candidate, confidences, conf_threshold, nms_threshold)
+    return [(boxes_candidate[i], confidences[i], class_list[i]) for i in np.asarray(indices).reshape(-1)]
+
+
+def vectorized_decode(decoder, raw):
+    boxes, scores, class_ids = decoder.decode(raw[0])
+    indices = decoder.nms(boxes, scores)
+    return [(boxes[i].tolist(), float(scores[i]), int(class_ids[i])) for i in indices]
+
+
+def bench(func, repeat):
+    func()  # ウォームアップ
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    return np.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO decode micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--nms", type=float, default=0.45)
+    parser.add_argument("--classes", nargs="*", default=None, help="スコアを計算するクラス (例: person)")
+    parser.add_argument("--float", action="store_true", help="float32出力モデルを想定する")
+    args = parser.parse_args()
+
+    dtype = np.float32 if args.float else np.int8
+    quant = (0.0, 0) if args.float else (OUTPUT_SCALE, OUTPUT_ZERO_POINT)
+    # 結果を比較するため top_k は無効にする
+    decoder = YoloDecoder(INPUT_SIZE, conf_threshold=args.conf, nms_threshold=args.nms,
+                          classes=args.classes, top_k=None, output_dtype=dtype, quantization=quant)
+    decoder_topk = YoloDecoder(INPUT_SIZE, conf_threshold=args.conf, nms_threshold=args.nms,
+                               classes=args.classes, top_k=300, output_dtype=dtype, quantization=quant)
+
+    print(f"{'density':>8} {'cands':>6} {'legacy[ms]':>11} {'vector[ms]':>11} {'top300[ms]':>11} {'speedup':>8} match")
+    for density in (0.0, 0.001, 0.01, 0.05, 0.2):
+        raw = make_output(density, dtype=dtype)
+        cands = len(decoder.decode(raw[0])[0])
+
+        expected = legacy_decode(raw, args.conf, args.nms, decoder.class_ids)
+        actual = vectorized_decode(decoder, raw)
+        match = expected == actual
+
+        t_legacy = bench(lambda: legacy_decode(raw, args.conf, args.nms, decoder.class_ids), args.repeat)
+        t_vector = bench(lambda: vectorized_decode(decoder, raw), args.repeat)
+        t_topk = bench(lambda: vectorized_decode(decoder_topk, raw), args.repeat)
+        print(f"{density:>8.3f} {cands:>6d} {t_legacy:>11.3f} {t_vector:>11.3f} {t_topk:>11.3f} "
+              f"{t_legacy / t_vector:>7.1f}x {'OK' if match else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+YoloDetector のステージ別マイクロベンチマークと検出結果の回帰確認
+
+次のステージを個別に測り、p50/p95 を表示する。
+  - preprocess/<W>x<H>: Letterbox前処理 (固定の画像サイズごと)
+  - invoke: 推論 (--model 省略時はスタブ)
+  - decode/<密度> / nms/<密度> / postprocess/<密度>: 閾値判定・NMS・元画像座標への変換
+    (閾値を超える候補の割合を変えた合成出力テンソルで測る)
+  - detect/<W>x<H>: 1フレーム分の detect() 全体
+あわせて正解データ (golden set) に対して、クラスごとの検出数と枠の一致 (IoU) を確認する。
+
+正解データ:
+  --golden を省略するとスタブ推論の合成ケースを使う。人物を置いたモデル入力上の位置から元画像での枠を
+  計算して期待値とするので、Letterboxの配置・座標の戻し・デコード・NMS の誤りを検出できる。
+  実画像とモデルで確認する場合は、一度 manifest を作って中身を目視で確認・修正し、正解として使う:
+      python -m benchmarks.detector_bench --model models/yolov8n_full_integer_quant.tflite \\
+          --golden data/golden/manifest.json --update-golden data/golden/images
+      python -m benchmarks.detector_bench --model models/yolov8n_full_integer_quant.tflite \\
+          --golden data/golden/manifest.json
+
+基準値:
+  --json で結果を保存し、後の実行で --baseline にそのファイルを渡すと、各ステージの p50 (--metric) が基準値より
+  --threshold % を超えて、かつ --min-delta-ms と計測のばらつき (四分位範囲の --noise 倍) を超えて遅くなったものを
+  回帰として報告する。基準値は固定の処理 (calibration) の時間の比で今回の環境の速さに換算してから比べるので、
+  他の処理との同居などで環境全体が遅くなっただけでは回帰にならない。各ステージは --rounds 回に分けて交互に測る。
+  既定値 (--repeat 30 --rounds 5 --threshold 20 --min-delta-ms 0.05 --noise 3) で、変更のないコードに対する
+  連続10回の実行がすべて成功し、NMS を2倍遅くすると回帰として検出されることを確認している。
+  回帰または正解データとの不一致があれば終了コード 1 で終わる。
+      python -m benchmarks.detector_bench --json data/benchmarks/detector_baseline.json
+      python -m benchmarks.detector_bench --baseline data/benchmarks/detector_baseline.json --threshold 15
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from app import YoloDetector
+from app.tracker import greedy_match, iou_matrix
+from benchmarks.stub_interpreter import StubInterpreter
+
+FRAME_SIZES = ["640x480", "1280x720", "1920x1080"]
+DENSITIES = [0.0, 0.001, 0.01, 0.05, 0.2]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# スタブ推論の合成ケース (画像の幅, 高さ, 人数)
+SYNTHETIC_CASES = [(1280, 720, 1), (1280, 720, 3), (1920, 1080, 4), (640, 480, 2), (720, 1280, 1)]
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def make_output(shape, density, dtype, quantization, seed=0):
+    """
+    YOLOv8形式の合成出力テンソル (4+クラス数, 候補数) を作る
+    :param density: 閾値を超えるスコアを持つ候補の割合
+    """
+    rng = np.random.default_rng(seed)
+    channels, anchors = shape
+    out = np.empty((channels, anchors), dtype=np.float32)
+    out[0:2] = rng.uniform(0.0, 1.0, size=(2, anchors))
+    out[2:4] = rng.uniform(0.02, 0.3, size=(2, anchors))
+    out[4:] = rng.uniform(0.0, 0.1, size=(channels - 4, anchors))
+    hot = np.nonzero(rng.random(anchors) < density)[0]
+    out[4 + rng.integers(0, channels - 4, size=len(hot)), hot] = rng.uniform(0.3, 0.95, size=len(hot))
+
+    scale, zero_point = quantization
+    if np.dtype(dtype) not in (np.int8, np.uint8) or scale <= 0:
+        return out.astype(dtype)
+    info = np.iinfo(dtype)
+    return np.clip(np.round(out / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def measure(func, repeat, warmup=3):
+    """func を repeat 回実行した時間 [秒] のリスト"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def summarize(samples):
+    p25, p50, p75, p95 = np.percentile(samples, [25, 50, 75, 95]) * 1000
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "mean_ms": float(np.mean(samples) * 1000),
+            "min_ms": float(np.min(samples) * 1000), "iqr_ms": float(p75 - p25), "samples": len(samples)}
+
+
+def create_detector(model, conf, classes, persons=(0, 3)):
+    if model:
+        return YoloDetector(model_path=model, conf_threshold=conf, classes=classes)
+    return YoloDetector(model_path=None, conf_threshold=conf, classes=classes,
+                        interpreter=StubInterpreter(persons=persons))
+
+
+# ----------------------------------------------------------------------
+# ステージ別の処理時間
+# ----------------------------------------------------------------------
+def calibration_workload():
+    """
+    マシンの速さの目安にする固定の処理 (リサイズ・ソート)
+    基準値を取ったときと今回とで同じ処理の時間を比べ、環境全体の速さの違い (他の処理との同居・周波数) を差し引く
+    """
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+    values = rng.random(50000, dtype=np.float32)
+
+    def _run():
+        cv2.resize(image, (640, 360), interpolation=cv2.INTER_LINEAR)
+        np.sort(values)
+    return _run
+
+
+def bench_stages(detector, frame_sizes, densities, repeat, rounds=5):
+    """
+    各ステージを rounds 回に分けて交互に測る (一時的な遅れが特定のステージに偏らないように)
+    ステージごとに calibration_workload() も測り、"calibration" として返す
+    :return: {ステージ名: summarize() の結果}
+    """
+    rng = np.random.default_rng(0)
+    frames = {size: rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8) for size in frame_sizes}
+    jobs = []  # (ステージ名, 関数, 付加情報)
+    for (width, height), frame in frames.items():
+        jobs.append((f"preprocess/{width}x{height}", lambda frame=frame: detector.preprocess(frame), {}))
+    jobs.append(("invoke", detector.interpreter.invoke, {}))
+
+    # 候補の多さで処理時間が変わるステージは、合成した出力テンソルで測る
+    decoder = detector.decoder
+    shape = tuple(detector.output_details[0]["shape"][1:])
+    quantization = (detector.output_scale, detector.output_zero_point)
+    scale, pad = detector.preprocess(frames[frame_sizes[0]])
+    for density in densities:
+        output = make_output(shape, density, detector.output_dtype, quantization)
+        boxes, scores, class_ids = decoder.decode(output)
+        indices = decoder.nms(boxes, scores)
+        jobs.append((f"decode/{density:g}", lambda output=output: decoder.decode(output), {}))
+        jobs.append((f"nms/{density:g}", lambda boxes=boxes, scores=scores: decoder.nms(boxes, scores), {}))
+        jobs.append((f"postprocess/{density:g}",
+                     lambda args=(boxes, scores, class_ids, indices): detector.to_results(*args, scale, pad),
+                     {"detections": len(indices)}))
+
+    for (width, height), frame in frames.items():
+        jobs.append((f"detect/{width}x{height}", lambda frame=frame: detector.detect(frame), {}))
+
+    calibrate = calibration_workload()
+    per_round = max(1, repeat // rounds)
+    samples = {name: [] for name, _, _ in jobs}
+    calibration = []
+    for _ in range(rounds):
+        for name, func, _ in jobs:
+            samples[name] += measure(func, per_round, warmup=1)
+            calibration += measure(calibrate, 2, warmup=0)
+
+    stages = {}
+    for name, _, extra in jobs:
+        stages[name] = dict(summarize(samples[name]), **extra)
+    stages["calibration"] = summarize(calibration)
+    return stages
+
+
+# ----------------------------------------------------------------------
+# 正解データ
+# ----------------------------------------------------------------------
+def synthetic_expected(width, height, persons, input_size=640):
+    """
+    スタブ推論が置く人物 (モデル入力上で横に等間隔、中心 y=0.5・高さ 0.3) の元画像での枠
+    Letterbox は縦横比を保って縮小し、余白は上下 (左右) に均等に入る
+    """
+    scale = min(input_size / width, input_size / height)
+    dx = (input_size - int(width * scale)) // 2
+    dy = (input_size - int(height * scale)) // 2
+    boxes = []
+    for i in range(persons):
+        cx, w = (i + 0.5) / persons * input_size, 0.5 / persons * input_size
+        cy, h = 0.5 * input_size, 0.3 * input_size
+        boxes.append({"class_name": "person",
+                      "box": [(cx - w / 2 - dx) / scale, (cy - h / 2 - dy) / scale, w / scale, h / scale]})
+    return boxes
+
+
+def synthetic_cases(conf):
+    """:return: [(名前, 検出器, 画像, 期待する検出)]"""
+    cases = []
+    for width, height, persons in SYNTHETIC_CASES:
+        detector = create_detector(None, conf, None, persons=persons)
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        cases.append((f"synthetic {width}x{height} x{persons}", detector, image,
+                      synthetic_expected(width, height, persons, detector.model_input_size[0])))
+    return cases
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def golden_cases(manifest, manifest_path, detector):
+    root = os.path.dirname(manifest_path)
+    cases = []
+    for case in manifest["cases"]:
+        image = cv2.imread(os.path.join(root, case["image"]))
+        if image is None:
+            raise SystemExit(f"Cannot read golden image: {case['image']}")
+        cases.append((case["image"], detector, image, case["detections"]))
+    return cases
+
+
+def compare_detections(results, expected, box_iou, count_tolerance):
+    """
+    検出結果と正解を比べる
+    :return: (一致したか, 説明, 一致した枠の平均IoU)
+    """
+    problems = []
+    ious = []
+    for class_name in sorted({r["class_name"] for r in results} | {e["class_name"] for e in expected}):
+        found = [r["box"] for r in results if r["class_name"] == class_name]
+        wanted = [e["box"] for e in expected if e["class_name"] == class_name]
+        if abs(len(found) - len(wanted)) > count_tolerance:
+            problems.append(f"{class_name}: {len(found)} detected, {len(wanted)} expected")
+        matrix = iou_matrix(wanted, found)
+        matches, _, _ = greedy_match(matrix, box_iou)
+        ious.extend(matrix[i, j] for i, j in matches)
+        missed = len(wanted) - len(matches)
+        if missed > count_tolerance:
+            problems.append(f"{class_name}: {missed} box(es) below IoU {box_iou}")
+    return not problems, "; ".join(problems) or "ok", float(np.mean(ious)) if ious else None
+
+
+def check_golden(cases, box_iou, count_tolerance):
+    details = []
+    for name, detector, image, expected in cases:
+        ok, message, mean_iou = compare_detections(detector.detect(image), expected, box_iou, count_tolerance)
+        details.append({"case": name, "ok": ok, "message": message, "mean_iou": mean_iou})
+    return {"cases": len(details), "failed": sum(not d["ok"] for d in details), "details": details}
+
+
+def update_golden(detector, image_dir, manifest_path, args):
+    """現在の検出結果から manifest を作る (正解として使う前に目視で確認すること)"""
+    root = os.path.dirname(manifest_path) or "."
+    paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    cases = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        detections = [{"class_name": r["class_name"], "box": r["box"], "score": round(r["score"], 3)}
+                      for r in detector.detect(image)]
+        cases.append({"image": os.path.relpath(path, root), "detections": detections})
+    manifest = {"model": args.model, "conf": args.conf, "classes": args.classes,
+                "box_iou": args.box_iou, "count_tolerance": args.count_tolerance, "cases": cases}
+    os.makedirs(root, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {len(cases)} case(s) to {manifest_path}. Review the boxes before using it as the golden set.")
+
+
+# ----------------------------------------------------------------------
+# 基準値との比較
+# ----------------------------------------------------------------------
+def environment():
+    return {"machine": platform.machine(), "processor": platform.processor(), "python": platform.python_version(),
+            "numpy": np.__version__, "opencv": cv2.__version__, "cpus": os.cpu_count()}
+
+
+def speed_factor(stages, baseline, metric="p50_ms"):
+    """今回の環境が基準値を取ったときより何倍遅いか (calibration の比。記録がなければ 1)"""
+    base = baseline["stages"].get("calibration")
+    now = stages.get("calibration")
+    if not base or not now or base.get(metric, 0) <= 0:
+        return 1.0
+    return now[metric] / base[metric]
+
+
+def expected_stage(base, factor):
+    """基準値を今回の環境の速さに換算する"""
+    return {key: value * factor if key.endswith("_ms") else value for key, value in base.items()}
+
+
+def regression_limit(base, stage, threshold, min_delta_ms, noise, metric="p50_ms"):
+    """
+    回帰とみなす増加量 [ms]
+    増加率 threshold %・min_delta_ms・計測のばらつき (基準値と今回の四分位範囲の大きい方の noise 倍) の最大
+    """
+    spread = max(base.get("iqr_ms", 0.0), stage.get("iqr_ms", 0.0))
+    return max(base[metric] * threshold / 100, min_delta_ms, noise * spread)
+
+
+def compare_baseline(stages, baseline, threshold, min_delta_ms, metric="p50_ms", noise=3.0):
+    """
+    基準値 (calibration で今回の環境の速さに換算したもの) と比べる
+    :return: 回帰したステージのリスト [(名前, 換算した基準値, 今回の値)]
+    """
+    factor = speed_factor(stages, baseline, metric)
+    regressions = []
+    for name, stage in stages.items():
+        base = baseline["stages"].get(name)
+        if name == "calibration" or base is None or metric not in base:
+            continue
+        expected = expected_stage(base, factor)
+        if stage[metric] - expected[metric] > regression_limit(expected, stage, threshold, min_delta_ms, noise,
+                                                               metric):
+            regressions.append((name, expected[metric], stage[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YoloDetector stage benchmark and accuracy regression suite")
+    parser.add_argument("--model", default=None, help="tfliteモデル (省略時はスタブ)")
+    parser.add_argument("--sizes", nargs="+", default=FRAME_SIZES, help="前処理・検出を測る画像サイズ (WxH)")
+    parser.add_argument("--densities", type=float, nargs="+", default=DENSITIES,
+                        help="合成出力テンソルで閾値を超える候補の割合")
+    parser.add_argument("--repeat", type=int, default=30, help="ステージごとの計測回数")
+    parser.add_argument("--rounds", type=int, default=5, help="計測を何回に分けてステージ間で交互に行うか")
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--classes", nargs="*", default=None, help="検出対象クラス (例: person)")
+    parser.add_argument("--golden", default=None, help="正解データの manifest (省略時はスタブの合成ケース)")
+    parser.add_argument("--update-golden", default=None, metavar="IMAGE_DIR",
+                        help="画像ディレクトリの現在の検出結果で --golden の manifest を作る")
+    parser.add_argument("--box-iou", type=float, default=0.7, help="正解の枠と一致とみなすIoU")
+    parser.add_argument("--count-tolerance", type=int, default=0, help="クラスごとの検出数の許容差")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存する (--baseline に渡す基準値になる)")
+    parser.add_argument("--baseline", default=None, help="比較する基準値 (以前の --json の出力)")
+    parser.add_argument("--threshold", type=float, default=20.0, help="回帰とみなす増加率 [%%]")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "min_ms", "mean_ms", "p95_ms"],
+                        help="基準値と比べる値")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="これより小さい増加は回帰とみなさない (計測のばらつき対策) [ms]")
+    parser.add_argument("--noise", type=float, default=3.0,
+                        help="四分位範囲 (基準値と今回の大きい方) のこの倍数以内の増加は回帰とみなさない")
+    parser.add_argument("--skip-golden", action="store_true")
+    args = parser.parse_args()
+
+    detector = create_detector(args.model, args.conf, args.classes)
+    if args.update_golden:
+        if not args.golden:
+            raise SystemExit("--update-golden needs --golden")
+        update_golden(detector, args.update_golden, args.golden, args)
+        return
+
+    sizes = [parse_size(size) for size in args.sizes]
+    print(f"Model: {args.model or 'stub'} {detector.model_input_size}, repeat {args.repeat}")
+    stages = bench_stages(detector, sizes, args.densities, args.repeat, args.rounds)
+
+    baseline = None
+    if args.baseline:
+        baseline = load_manifest(args.baseline)
+        if baseline.get("environment") != environment():
+            print(f"[Warning] Baseline was recorded on a different environment: {baseline.get('environment')}")
+        if "calibration" not in baseline["stages"]:
+            print("[Warning] Baseline has no calibration. Comparing without correcting for machine speed")
+        if baseline.get("model") != args.model:
+            print(f"[Warning] Baseline model {baseline.get('model') or 'stub'} differs from {args.model or 'stub'}")
+    regressions = (compare_baseline(stages, baseline, args.threshold, args.min_delta_ms, args.metric, args.noise)
+                   if baseline else [])
+    regressed = {name for name, _, _ in regressions}
+
+    metric = args.metric
+    factor = speed_factor(stages, baseline, metric) if baseline else 1.0
+    if baseline:
+        print(f"Speed vs baseline (calibration): x{factor:.2f}. Baseline values below are scaled by it")
+    print(f"{'stage':>24} {'p50 ms':>9} {'p95 ms':>9} {'min ms':>9} {'baseline':>9} {'change':>8}")
+    for name, stage in stages.items():
+        base = baseline["stages"].get(name) if baseline else None
+        if base is not None and metric not in base:
+            base = None
+        if base is not None and name != "calibration":
+            base = expected_stage(base, factor)
+        change = f"{(stage[metric] / base[metric] - 1) * 100:+.0f}%" if base and base[metric] > 0 else ""
+        print(f"{name:>24} {stage['p50_ms']:>9.3f} {stage['p95_ms']:>9.3f} {stage['min_ms']:>9.3f} "
+              f"{base[metric] if base else float('nan'):>9.3f} {change:>8}"
+              + ("  REGRESSION" if name in regressed else ""))
+
+    golden = None
+    if not args.skip_golden:
+        if args.golden:
+            manifest = load_manifest(args.golden)
+            if manifest.get("model") != args.model:
+                print(f"[Warning] Golden set was recorded with {manifest.get('model') or 'stub'}")
+            # 正解を作ったときと同じ閾値・クラスで検出する
+            golden_detector = create_detector(args.model, manifest.get("conf", args.conf),
+                                              manifest.get("classes", args.classes))
+            cases = golden_cases(manifest, args.golden, golden_detector)
+            box_iou = manifest.get("box_iou", args.box_iou)
+            count_tolerance = manifest.get("count_tolerance", args.count_tolerance)
+        else:
+            cases = synthetic_cases(args.conf)
+            box_iou, count_tolerance = args.box_iou, args.count_tolerance
+        golden = check_golden(cases, box_iou, count_tolerance)
+        for detail in golden["details"]:
+            iou = f"{detail['mean_iou']:.3f}" if detail["mean_iou"] is not None else "-"
+            print(f"{'OK' if detail['ok'] else 'FAIL':>4} {detail['case']} (mean IoU {iou}): {detail['message']}")
+        print(f"Golden set: {golden['cases'] - golden['failed']}/{golden['cases']} passed")
+
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump({"model": args.model, "environment": environment(), "repeat": args.repeat,
+                       "stages": stages, "golden": golden}, f, indent=2)
+        print(f"Saved: {args.json}")
+
+    for name, base, current in regressions:
+        print(f"Regression: {name} {metric} {base:.3f} -> {current:.3f} ms (+{(current / base - 1) * 100:.0f}%, "
+              f"threshold {args.threshold:g}%)")
+    if regressions or (golden and golden["failed"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
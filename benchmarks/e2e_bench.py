@@ -0,0 +1,219 @@
+"""
+ハードウェア不要のエンドツーエンドベンチマーク
+
+実機の代わりに以下を使って main.py の監視ループ (build_pipeline / run_monitoring) をそのまま動かし、
+ステージごとの処理時間・周期・スループットを測定する。
+  - カメラ: ReplayCamera (画像ディレクトリ / 動画。省略時は合成画像)
+  - LoRaモジュール: FakeModem (pty上の疑似A660)
+  - 推論: StubInterpreter (--model 指定時は tflite_runtime の実モデル)
+
+使い方:
+    python -m benchmarks.e2e_bench --duration 30 --interval 1.0
+    python -m benchmarks.e2e_bench --frames data/replay --model models/yolov8n_full_integer_quant.tflite
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import main
+from app import LoggerHandler, LoRaCommunicator, ReplayCamera, YoloDetector, fit_lores_size
+from benchmarks.fake_modem import FakeModem
+from benchmarks.stub_interpreter import StubInterpreter
+
+
+class StageTimer:
+    """関数呼び出しの所要時間を記録する"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def wrap(self, name, func):
+        def _timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - t0)
+        return _timed
+
+    def summary(self):
+        rows = {}
+        for name, values in self.samples.items():
+            ms = np.array(values) * 1000
+            rows[name] = {
+                "count": len(values),
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)),
+                "max_ms": float(ms.max()),
+            }
+        return rows
+
+
+def make_synthetic_frames(directory, count=10, width=1280, height=720):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(directory, f"frame_{i:03d}.jpg"), frame)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Hardware-free end-to-end benchmark")
+    parser.add_argument("--frames", default=None, help="画像ディレクトリまたは動画ファイル (省略時は合成画像)")
+    parser.add_argument("--model", default=None, help="tfliteモデル (省略時はスタブ)")
+    parser.add_argument("--duration", type=float, default=20.0, help="測定時間 [秒]")
+    parser.add_argument("--interval", type=float, default=1.0, help="Detection.Interval [秒]")
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--no-lores", action="store_true", help="推論にフル解像度画像を使う")
+    parser.add_argument("--snapshot-interval", type=float, default=0.0, help="Camera.SnapshotInterval [秒]")
+    parser.add_argument("--policy", default="drop_oldest", choices=["drop_oldest", "block"])
+    parser.add_argument("--invoke-time", type=float, default=0.0, help="スタブ推論の擬似処理時間 [秒]")
+    parser.add_argument("--persons", type=int, nargs=2, default=[0, 3], metavar=("MIN", "MAX"))
+    parser.add_argument("--modem-latency", type=float, default=0.01)
+    parser.add_argument("--join-time", type=float, default=1.0)
+    parser.add_argument("--join-failures", type=int, default=0)
+    parser.add_argument("--tx-time", type=float, default=0.4)
+    parser.add_argument("--duty-cycle", type=float, default=None)
+    parser.add_argument("--downlinks", type=int, default=0, help="キューに積んでおくダウンリンク数")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    parser.add_argument("--verbose", action="store_true", help="監視ループの出力を表示する")
+    args = parser.parse_args()
+
+    frames = os.path.abspath(args.frames) if args.frames else None
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # main.py は data/images などの相対パスに書き込むため、一時ディレクトリで動かす
+    workdir = tempfile.mkdtemp(prefix="loracam_bench_")
+    os.makedirs(os.path.join(workdir, "data", "images"))
+    if frames is None:
+        frames = os.path.join(workdir, "frames")
+        os.makedirs(frames)
+        make_synthetic_frames(frames)
+    os.chdir(workdir)
+
+    timer = StageTimer()
+    modem = FakeModem(latency=args.modem_latency, join_time=args.join_time, tx_time=args.tx_time,
+                      join_failures=args.join_failures, duty_cycle=args.duty_cycle).start()
+    for i in range(args.downlinks):
+        modem.downlinks.append(f"cmd{i}".encode())
+
+    if args.model:
+        detector = YoloDetector(model_path=args.model)
+    else:
+        stub = StubInterpreter(invoke_time=args.invoke_time, persons=tuple(args.persons))
+        detector = YoloDetector(model_path=None, interpreter=stub)
+    lores_size = None if args.no_lores else fit_lores_size((1280, 720), detector.model_input_size)
+    camera = ReplayCamera(frames, width=1280, height=720, lores_size=lores_size)
+    logger = LoggerHandler(log_dir=os.path.join(workdir, "data", "logs"))
+    lora = LoRaCommunicator(port=modem.port)
+    lora.debug = False
+
+    out = io.StringIO()
+    redirect = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(out)
+    with redirect:
+        t0 = time.perf_counter()
+        joined = False
+        for _ in range(args.join_failures + 1):
+            if lora.connect_network("0" * 16, "0" * 16, "0" * 32):
+                joined = True
+                break
+        timer.record("join", time.perf_counter() - t0)
+        if not joined:
+            raise SystemExit("join failed")
+
+        config = {"Pipeline": {"QueueSize": args.queue_size, "Policy": args.policy}}
+        uplink_scheduler = main.build_uplink_scheduler(config)
+        pipeline = main.build_pipeline(config, detector, logger, lora, uplink_scheduler=uplink_scheduler)
+
+        # 計測用のラッパーを差し込む
+        camera.capture_frames = timer.wrap("capture", camera.capture_frames)
+        detector.detect = timer.wrap("detect", detector.detect)
+        detector.preprocess = timer.wrap("preprocess", detector.preprocess)
+        detector.interpreter.invoke = timer.wrap("invoke", detector.interpreter.invoke)
+        lora.send_data = timer.wrap("lora.send_data", lora.send_data)
+        lora.receive_data = timer.wrap("lora.receive_data", lora.receive_data)
+        for worker in pipeline.workers:
+            worker.handler = timer.wrap(f"stage.{worker.name}", worker.handler)
+        pipeline.inline = [(name, timer.wrap(f"stage.{name}", handler)) for name, handler in pipeline.inline]
+
+        capture_times = []
+        publish = pipeline.publish
+
+        def _publish(item):
+            capture_times.append(time.monotonic())
+            publish(item)
+        pipeline.publish = _publish
+
+        stopper = threading.Timer(args.duration, pipeline.stop_event.set)
+        stopper.start()
+        pipeline.start()
+        t_start = time.perf_counter()
+        try:
+            main.run_monitoring(camera, detector, pipeline, args.interval,
+                                snapshot_interval=args.snapshot_interval)
+        finally:
+            elapsed = time.perf_counter() - t_start
+            stopper.cancel()
+            t0 = time.perf_counter()
+            pipeline.shutdown()
+            timer.record("shutdown", time.perf_counter() - t0)
+            logger.close()
+            camera.stop()
+            lora.close()
+            modem.stop()
+
+    periods = np.diff(capture_times) if len(capture_times) > 1 else np.array([0.0])
+    report = {
+        "duration_s": elapsed,
+        "interval_s": args.interval,
+        "frames": len(capture_times),
+        "throughput_fps": len(capture_times) / elapsed,
+        "cycle_mean_s": float(periods.mean()),
+        "cycle_std_s": float(periods.std()),
+        "cycle_max_s": float(periods.max()),
+        "stages": timer.summary(),
+        "dropped": {w.name: w.queue.dropped for w in pipeline.workers},
+        "processed": {w.name: w.processed for w in pipeline.workers},
+        "uplink_records": {key: uplink_scheduler.stats()[key]
+                           for key in ("records_sent", "records_pending", "records_dropped")}
+                          if uplink_scheduler is not None else None,
+        "uplinks_received": len(modem.received),
+        "uplinks_rejected": modem.rejected,
+        "at_timeouts": lora.timeouts,
+        "logs": logger.stats(),
+    }
+
+    print(f"frames: {report['frames']} in {elapsed:.1f} s ({report['throughput_fps']:.2f} fps)")
+    print(f"cycle: mean {report['cycle_mean_s']:.3f} s, std {report['cycle_std_s']:.3f} s, "
+          f"max {report['cycle_max_s']:.3f} s (interval {args.interval} s)")
+    print(f"{'stage':>20} {'count':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  [ms]")
+    for name, row in report["stages"].items():
+        print(f"{name:>20} {row['count']:>6d} {row['mean_ms']:>9.2f} {row['p50_ms']:>9.2f} "
+              f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['max_ms']:>9.2f}")
+    print(f"processed: {report['processed']}, dropped: {report['dropped']}")
+    print(f"uplink records: {report['uplink_records']}")
+    print(f"uplinks received by modem: {report['uplinks_received']}, rejected: {report['uplinks_rejected']}, "
+          f"AT timeouts: {report['at_timeouts']}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved: {json_path}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,219 @@
+"""
+A660 LoRaモジュールの疑似モデム (pty)
+
+LoRaCommunicator が使うATコマンドに応答する。実機の代わりに pty のスレーブ側パスを
+LoRaCommunicator(port=...) に渡して使う。
+
+    modem = FakeModem(join_time=3.0)
+    modem.start()
+    lora = LoRaCommunicator(port=modem.port)
+"""
+import binascii
+import os
+import select
+import threading
+import time
+import tty
+
+
+class FakeModem:
+    # AT+DULSTAT? の状態番号
+    STATUS_IDLE = 0
+    STATUS_JOINING = 1
+    STATUS_JOINED = 4
+    STATUS_JOIN_FAILED = 5
+
+    def __init__(self, latency=0.01, reboot_time=0.3, join_time=3.0, tx_time=0.4,
+                 join_urc=False, downlink_urc=False, join_failures=0, duty_cycle=None,
+                 uplink_snr=0.0, rssi=-90, snr=5):
+        """
+        :param latency: コマンド受信から応答までの遅延 [秒]
+        :param reboot_time: AT+IREBOOT 後、応答できるようになるまでの時間 [秒]
+        :param join_time: Join要求から結果が出るまでの時間 [秒]
+        :param tx_time: 送信 (OK+SEND) から送信完了 (OK+SENT) までの時間 [秒]
+        :param join_urc: Join結果を +CJOIN 通知で知らせる
+        :param downlink_urc: ダウンリンクを OK+RECV 通知で知らせる (False なら AT+DRX? で取得)
+        :param join_failures: 最初の何回のJoinを失敗させるか
+        :param duty_cycle: デューティ比 (例: 0.01)。送信後 tx_time*(1/duty_cycle-1) 秒間の送信を拒否する
+        :param uplink_snr: ゲートウェイでの上りのSNR [dB] (リンクチェックの復調マージンの計算に使う)
+        :param rssi: リンクチェックで返すダウンリンクのRSSI [dBm]
+        :param snr: リンクチェックで返すダウンリンクのSNR [dB]
+        """
+        self.latency = latency
+        self.reboot_time = reboot_time
+        self.join_time = join_time
+        self.tx_time = tx_time
+        self.join_urc = join_urc
+        self.downlink_urc = downlink_urc
+        self.join_failures = join_failures
+        self.duty_cycle = duty_cycle
+        self.uplink_snr = uplink_snr
+        self.rssi = rssi
+        self.snr = snr
+        self.data_rate = 2
+        self.adr = True
+        self.link_check = 0
+
+        self.status = self.STATUS_IDLE
+        self.downlinks = []  # 送信後に届くダウンリンク (bytes)
+        self.received = []  # 受け取ったアップリンク (bytes)
+        self.commands = []  # 受け取ったコマンド
+        self.join_attempts = 0
+        self.rejected = 0  # デューティ比制限で拒否した送信数
+        self._next_tx_allowed = 0.0
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._busy_until = 0.0
+        self._buffer = b""
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._timers = []
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="fake-modem", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        for timer in self._timers:
+            timer.cancel()
+        if self._thread:
+            self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+    # ------------------------------------------------------------------
+    def _loop(self):
+        while self._running:
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            self._buffer += data
+            while b"\r" in self._buffer:
+                raw, self._buffer = self._buffer.split(b"\r", 1)
+                command = raw.decode("utf-8", errors="ignore").strip()
+                if command:
+                    self._handle(command)
+
+    def _write(self, line):
+        with self._write_lock:
+            os.write(self._master, (line + "\r\n").encode("utf-8"))
+
+    def _emit(self, lines, delay=None):
+        """delay 秒後に応答行を送る"""
+        delay = self.latency if delay is None else delay
+        timer = threading.Timer(delay, lambda: [self._write(line) for line in lines])
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+
+    def _handle(self, command):
+        self.commands.append(command)
+        if time.monotonic() < self._busy_until:
+            return  # 再起動中は応答しない
+
+        name, _, args = command.partition("=")
+        name = name.upper()
+
+        if name == "AT":
+            self._emit(["OK"])
+        elif name == "AT+IREBOOT":
+            self._emit(["OK"])
+            self._busy_until = time.monotonic() + self.latency + self.reboot_time
+            self.status = self.STATUS_IDLE
+        elif name in ("AT+RREGION", "AT+CCLASS", "AT+CJOINMODE", "AT+CDEVEUI",
+                      "AT+CAPPEUI", "AT+CAPPKEY", "AT+CSAVE"):
+            self._emit(["OK"])
+        elif name == "AT+DJOIN":
+            self._emit(["OK"])
+            self._start_join()
+        elif name == "AT+DULSTAT?":
+            self._emit([f"+DULSTAT:{self.status:02d}", "OK"])
+        elif name == "AT+CDATARATE?":
+            self._emit([f"+CDATARATE:{self.data_rate}", "OK"])
+        elif name == "AT+CDATARATE" and args.isdigit() and int(args) <= 6:
+            self.data_rate = int(args)
+            self._emit(["OK"])
+        elif name == "AT+CADR" and args in ("0", "1"):
+            self.adr = args == "1"
+            self._emit(["OK"])
+        elif name == "AT+CLINKCHECK" and args in ("0", "1", "2"):
+            self.link_check = int(args)
+            self._emit(["OK"])
+        elif name == "AT+DTRX":
+            self._handle_dtrx(args)
+        elif name == "AT+DRX?":
+            if self.downlinks and not self.downlink_urc:
+                data = self.downlinks.pop(0)
+                self._emit([f"+DRX={len(data)},{binascii.hexlify(data).decode().upper()}", "OK"])
+            else:
+                self._emit(["+DRX=0", "OK"])
+        else:
+            self._emit(["ERROR"])
+
+    def _start_join(self):
+        self.status = self.STATUS_JOINING
+
+        def _finish():
+            self.status = self._join_result()
+            if self.join_urc:
+                self._write("+CJOIN:OK" if self.status == self.STATUS_JOINED else "+CJOIN:FAIL")
+
+        timer = threading.Timer(self.join_time, _finish)
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+
+    def _join_result(self):
+        self.join_attempts += 1
+        if self.join_attempts <= self.join_failures:
+            return self.STATUS_JOIN_FAILED
+        return self.STATUS_JOINED
+
+    def _handle_dtrx(self, args):
+        try:
+            confirm, nbtrials, length, payload = args.split(",", 3)
+            data = binascii.unhexlify(payload)
+            if len(data) != int(length):
+                raise ValueError("length mismatch")
+        except ValueError:
+            self._emit(["ERROR"])
+            return
+
+        if self.status != self.STATUS_JOINED:
+            self._emit(["ERROR"])
+            return
+
+        # デューティ比制限 (実機の拒否応答は未確認のため ERROR を返す)
+        now = time.monotonic()
+        if self.duty_cycle and now < self._next_tx_allowed:
+            self.rejected += 1
+            self._emit(["ERROR"])
+            return
+        if self.duty_cycle:
+            self._next_tx_allowed = now + self.tx_time / self.duty_cycle
+
+        self.received.append(data)
+        self._emit([f"OK+SEND:{len(data):02X}"])
+        lines = []
+        if self.link_check:
+            # 復調マージン = 上りのSNR - 拡散率の復調限界 (DR0=SF12: -20dB ... DR5=SF7: -7.5dB)
+            margin = max(0, round(self.uplink_snr + 20.0 - 2.5 * min(self.data_rate, 5)))
+            lines.append(f"+CLINKCHECK: 0,{margin},1,{self.rssi},{self.snr}")
+            if self.link_check == 1:
+                self.link_check = 0
+        lines.append("OK+SENT:01")
+        if self.downlinks and self.downlink_urc:
+            down = self.downlinks.pop(0)
+            lines.append(f"OK+RECV:02,01,{len(down):02X},{binascii.hexlify(down).decode().upper()}")
+        self._emit(lines, delay=self.latency + self.tx_time)
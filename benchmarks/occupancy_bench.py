@@ -0,0 +1,119 @@
+"""
+在室人数レポート (tools/occupancy_report.py) の処理速度の測定
+
+1分周期の合成 logPerson.csv を devices 台分 (合計 rows 行) 作り、
+  - csv モジュールで1行ずつ読んで集計する素朴な方法 (先頭 baseline_rows 行のみ)
+  - チャンク読み込み + NumPy 解析 (1プロセス / workers プロセス)
+の行数/秒を比べる。集計結果 (合計・行数・最大) が一致することも確認する。
+
+使い方:
+    python -m benchmarks.occupancy_bench [--rows 20000000] [--devices 4] [--workers 4] [--dir /tmp/occupancy_bench]
+"""
+import argparse
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from tools.occupancy_report import make_tasks, run_report
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def generate(path, rows, seed=0, block=1440 * 7):
+    """1分周期・昼に多く夜に少ない人数の logPerson.csv を書く"""
+    rng = np.random.default_rng(seed)
+    time_labels = [f"{m // 60:02d}:{m % 60:02d}:00" for m in range(1440)]
+    with open(path, "w") as f:
+        f.write("Date,Time,Class,Count,CarriedOver\n")
+        for offset in range(0, rows, block):
+            minutes = np.arange(offset, min(offset + block, rows))
+            hour = (minutes % 1440) / 60.0
+            counts = rng.poisson(np.clip(6 * np.sin((hour - 6) / 12 * np.pi), 0.2, None))
+            lines = []
+            for day in range(minutes[0] // 1440, minutes[-1] // 1440 + 1):
+                date = (START + datetime.timedelta(days=int(day))).strftime("%Y-%m-%d")
+                sel = minutes // 1440 == day
+                lines.extend(f"{date},{time_labels[m % 1440]},person,{c},0"
+                             for m, c in zip(minutes[sel].tolist(), counts[sel].tolist()))
+            f.write("\n".join(lines) + "\n")
+
+
+def naive(path, limit):
+    """csv.reader と datetime で1行ずつ集計する (比較用)"""
+    totals = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for i, (date, time_str, cname, count, *_) in enumerate(reader):
+            if i >= limit:
+                break
+            dt = datetime.datetime.strptime(f"{date} {time_str}", "%Y-%m-%d %H:%M:%S")
+            key = (cname, dt.replace(minute=0, second=0))
+            s, n, m = totals.get(key, (0, 0, 0))
+            c = int(count)
+            totals[key] = (s + c, n + 1, max(m, c))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Occupancy report benchmark")
+    parser.add_argument("--rows", type=int, default=20_000_000, help="全端末の合計行数")
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--baseline-rows", type=int, default=500_000)
+    parser.add_argument("--dir", default=None, help="合成ログの置き場所 (既にあれば再利用する。省略時は一時ディレクトリ)")
+    args = parser.parse_args()
+
+    root = args.dir or tempfile.mkdtemp(prefix="occupancy_bench_")
+    sources = []
+    t0 = time.perf_counter()
+    for device in range(args.devices):
+        directory = os.path.join(root, f"cam{device}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "logPerson.csv")
+        if not os.path.exists(path):
+            generate(path, args.rows // args.devices, seed=device)
+        sources.append(directory)
+    size = sum(os.path.getsize(os.path.join(s, "logPerson.csv")) for s in sources)
+    print(f"Synthetic logs: {args.rows:,} rows, {size / 1e6:.0f} MB in {root} ({time.perf_counter() - t0:.1f} sec)")
+
+    first = os.path.join(sources[0], "logPerson.csv")
+    t0 = time.perf_counter()
+    baseline = naive(first, args.baseline_rows)
+    elapsed = time.perf_counter() - t0
+    print(f"{'csv.reader':>22}: {args.baseline_rows / elapsed:>12,.0f} rows/sec ({args.baseline_rows:,} rows)")
+
+    results = {}
+    for workers in sorted({1, args.workers}):
+        tasks = make_tasks(sources)
+        t0 = time.perf_counter()
+        series, rows = run_report(tasks, workers)
+        elapsed = time.perf_counter() - t0
+        results[workers] = series
+        print(f"{f'numpy x{workers} ({len(tasks)} tasks)':>22}: {rows / elapsed:>12,.0f} rows/sec "
+              f"({rows:,} rows in {elapsed:.1f} sec)")
+
+    # 結果の確認: プロセス数によらず同じ、先頭の時間帯は素朴な集計と同じ
+    reference = results[1]
+    same = all(all(np.array_equal(a, b) for a, b in zip(reference[k], series[k])) and reference.keys() == series.keys()
+               for series in results.values() for k in reference)
+    hours, sums, samples, maxima = reference[(os.path.basename(sources[0]), "person")]
+    epoch = datetime.datetime(1970, 1, 1)
+    checked = [key for key in baseline if baseline[key][1] == 60][:24]
+    matches = all(
+        (int(sums[i]), int(samples[i]), int(maxima[i])) == baseline[key]
+        for key in checked
+        for i in [int(np.searchsorted(hours, (key[1] - epoch) // datetime.timedelta(hours=1)))]
+    )
+    print(f"Workers agree: {same}, matches csv.reader on {len(checked)} hours: {matches}")
+    if not args.dir:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
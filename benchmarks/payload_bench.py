@@ -0,0 +1,49 @@
+"""
+アップリンクペイロードの送信時間 (airtime) の比較
+
+PayloadCodec のバイナリ形式と従来のテキスト形式 ("YYYY-MM-DD HH:MM:SS N") の
+ペイロード長・送信時間を拡散率ごとに比較する。
+エンコード / デコードの一致は tests/test_payload_codec.py で確認する。
+
+使い方:
+    python -m benchmarks.payload_bench
+"""
+import datetime
+
+from app.airtime import lorawan_time_on_air
+from app.payload_codec import PayloadCodec
+
+
+def airtime_table():
+    now = datetime.datetime(2026, 10, 18, 12, 34, 56)
+    text = (now.strftime('%Y-%m-%d %H:%M:%S') + " " + str(3)).encode()
+    record = {"dt": now, "counts": {"person": 3}}
+    stats_record = dict(record, stats={"person": (0, 7, 2.4)})
+    formats = [
+        ("text", text),
+        ("binary/epoch", PayloadCodec(time_mode="epoch").encode([record])),
+        ("binary/age", PayloadCodec(time_mode="age").encode([record], sent_at=now)),
+        ("binary/epoch+stats", PayloadCodec(time_mode="epoch").encode([stats_record])),
+        ("binary/age x4 windows", PayloadCodec(time_mode="age").encode(
+            [dict(record, dt=now + datetime.timedelta(seconds=60 * i)) for i in range(4)],
+            sent_at=now + datetime.timedelta(seconds=180))),
+    ]
+
+    print(f"{'format':>22} {'bytes':>6} " + " ".join(f"{'SF' + str(sf) + '[ms]':>12}" for sf in range(7, 13)))
+    text_airtime = {sf: lorawan_time_on_air(len(text), sf=sf) for sf in range(7, 13)}
+    for name, payload in formats:
+        cells = []
+        for sf in range(7, 13):
+            t = lorawan_time_on_air(len(payload), sf=sf)
+            saving = 1 - t / text_airtime[sf]
+            cells.append(f"{t * 1000:.0f}" + (f" (-{saving:.0%})" if name != "text" else ""))
+        print(f"{name:>22} {len(payload):>6} " + " ".join(f"{c:>12}" for c in cells))
+    print("(括弧内はテキスト形式に対する送信時間の削減率。LoRaWANヘッダ13byteを含む)")
+
+
+def main():
+    airtime_table()
+
+
+if __name__ == "__main__":
+    main()
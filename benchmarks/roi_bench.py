@@ -0,0 +1,56 @@
+"""
+ROI・タイル推論の構成ごとの比較
+
+画面全体 / ROI / ROI+タイル の各構成について、1フレームあたりの invoke 回数・処理時間と
+元画像1pxがモデル入力で何pxになるか (倍率。大きいほど小さな人物が潰れにくい) を表示する。
+
+使い方:
+    python -m benchmarks.roi_bench [--roi 0 0.25 1 0.5] [--model models/yolov8n_full_integer_quant.tflite]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app import YoloDetector
+from benchmarks.stub_interpreter import StubInterpreter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ROI / tiled inference benchmark")
+    parser.add_argument("--model", default=None, help="tfliteモデル (省略時はスタブ)")
+    parser.add_argument("--roi", type=float, nargs=4, default=[0.0, 0.25, 1.0, 0.5], metavar=("X", "Y", "W", "H"))
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    image = np.random.default_rng(0).integers(0, 256, size=(args.height, args.width, 3), dtype=np.uint8)
+    configs = [
+        ("full frame", {}),
+        ("roi", {"rois": [args.roi]}),
+        ("roi + tiles", {"rois": [args.roi], "tiled": True}),
+        ("full + tiles", {"tiled": True}),
+    ]
+
+    print(f"{'config':>14} {'invokes':>8} {'scale':>7} {'source Mpx':>10} {'ms/frame':>9} {'detections':>11}")
+    for name, options in configs:
+        if args.model:
+            detector = YoloDetector(model_path=args.model, **options)
+        else:
+            detector = YoloDetector(model_path=None, interpreter=StubInterpreter(persons=2), **options)
+        windows = detector.windows(image.shape)
+        mw, mh = detector.model_input_size
+        scale = min(min(mw / w, mh / h) for _, _, w, h in windows)
+        source_px = sum(w * h for _, _, w, h in windows) / 1e6
+
+        detector.detect(image)
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            results = detector.detect(image)
+        ms = (time.perf_counter() - t0) / args.repeat * 1000
+        print(f"{name:>14} {len(windows):>8d} {scale:>7.2f} {source_px:>10.2f} {ms:>9.1f} {len(results):>11d}")
+
+
+if __name__ == "__main__":
+    main()
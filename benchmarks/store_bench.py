@@ -0,0 +1,101 @@
+"""
+時系列ストア (TimeSeriesStore) の書き込み・範囲集計の速度測定
+
+1分周期で days 日分の合成データを入れたDBを作り、
+  - 稼働時と同じ record() 1周期あたりの書き込み時間
+  - 期間・粒度ごとの aggregate / totals の応答時間
+を測定する。
+
+使い方:
+    python -m benchmarks.store_bench [--days 180] [--db /tmp/loracam_bench.db]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.timeseries_store import TimeSeriesStore, to_ts
+
+CLASSES = ["person", "car", "bicycle"]
+
+
+def populate(store, start, days, interval, seed=0):
+    rng = np.random.default_rng(seed)
+    base = to_ts(start)
+    ts = np.arange(base, base + days * 86400, interval, dtype=np.int64)
+    # 昼に多く夜に少ない人数
+    hour = (ts % 86400) / 3600.0
+    lam = 0.2 + 3.0 * np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None)
+    persons = rng.poisson(lam)
+    cars = rng.poisson(lam / 3)
+
+    batch = 50000
+    for i in range(0, len(ts), batch):
+        rows = [(int(t), "person", int(n)) for t, n in zip(ts[i:i + batch], persons[i:i + batch])]
+        rows += [(int(t), "car", int(n)) for t, n in zip(ts[i:i + batch], cars[i:i + batch]) if n > 0]
+        store.bulk_insert(rows, ts[i:i + batch].tolist())
+    store.rebuild_rollups()
+    return len(ts)
+
+
+def timed(func, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - t0)
+    return np.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-series store benchmark")
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--interval", type=int, default=60, help="検出周期 [秒]")
+    parser.add_argument("--db", default=None, help="DBファイル (省略時は一時ファイル)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="loracam_store_"), "bench.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    store = TimeSeriesStore(db_path)
+    start = datetime.datetime(2025, 1, 1)
+
+    t0 = time.perf_counter()
+    cycles = populate(store, start, args.days, args.interval)
+    print(f"populate: {cycles} cycles ({args.days} days) in {time.perf_counter() - t0:.1f} s")
+
+    # 稼働時の書き込み (1周期 = 1トランザクション)
+    dt = start + datetime.timedelta(days=args.days)
+    samples = []
+    for i in range(500):
+        t0 = time.perf_counter()
+        store.record(dt + datetime.timedelta(seconds=args.interval * i), {"person": i % 4, "car": i % 2})
+        samples.append(time.perf_counter() - t0)
+    ms = np.array(samples) * 1000
+    print(f"record: mean {ms.mean():.3f} ms, p95 {np.percentile(ms, 95):.3f} ms, max {ms.max():.3f} ms")
+
+    end = start + datetime.timedelta(days=args.days)
+    week = end - datetime.timedelta(days=7)
+    queries = [
+        ("hourly, last week", lambda: store.aggregate(week, end, "hour", ["person"])),
+        ("hourly, all", lambda: store.aggregate(start, end, "hour")),
+        ("daily, all", lambda: store.aggregate(start, end, "day")),
+        ("minute, last day", lambda: store.aggregate(end - datetime.timedelta(days=1), end, "minute")),
+        ("totals, all (day)", lambda: store.totals(start, end, level="day")),
+        ("totals, 30 days (hour)", lambda: store.totals(end - datetime.timedelta(days=30), end)),
+        ("raw, last hour", lambda: store.query_range(end - datetime.timedelta(hours=1), end)),
+    ]
+    print(f"{'query':>24} {'median [ms]':>12} {'rows':>8}")
+    for name, func in queries:
+        median, result = timed(func)
+        print(f"{name:>24} {median:>12.2f} {len(result):>8d}")
+
+    store.close()
+    print(f"DB: {db_path} ({os.path.getsize(db_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
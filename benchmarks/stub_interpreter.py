@@ -0,0 +1,92 @@
+"""
+tflite_runtime.interpreter.Interpreter の代わりに使うスタブ
+
+YoloDetector が使うAPI (allocate_tensors, get_input_details, get_output_details,
+tensor, set_tensor, invoke, get_tensor) だけを実装し、invoke では指定人数分の
+person検出を含むYOLOv8形式の量子化出力 (1, 84, 8400) を生成する。
+"""
+import time
+
+import numpy as np
+
+INPUT_INDEX = 0
+OUTPUT_INDEX = 1
+OUTPUT_SCALE = 1.0 / 255.0
+OUTPUT_ZERO_POINT = -128
+
+
+class StubInterpreter:
+    def __init__(self, input_size=640, num_anchors=8400, num_classes=80,
+                 invoke_time=0.0, persons=(0, 3), seed=0):
+        """
+        :param invoke_time: invoke 1回あたりの擬似処理時間 [秒] (スリープ)
+        :param persons: 1フレームあたりの人数 (int または (最小, 最大) の範囲)
+        """
+        self.input_size = input_size
+        self.num_anchors = num_anchors
+        self.num_classes = num_classes
+        self.invoke_time = invoke_time
+        self.persons = persons
+        self.invocations = 0
+        self._rng = np.random.default_rng(seed)
+        self._input = np.zeros((1, input_size, input_size, 3), dtype=np.int8)
+        self._output = np.empty((1, 4 + num_classes, num_anchors), dtype=np.int8)
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{
+            "index": INPUT_INDEX,
+            "shape": np.array(self._input.shape),
+            "dtype": np.int8,
+            "quantization": (1.0 / 255.0, -128),
+        }]
+
+    def get_output_details(self):
+        return [{
+            "index": OUTPUT_INDEX,
+            "shape": np.array(self._output.shape),
+            "dtype": np.int8,
+            "quantization": (OUTPUT_SCALE, OUTPUT_ZERO_POINT),
+        }]
+
+    def tensor(self, index):
+        target = self._input if index == INPUT_INDEX else self._output
+        return lambda: target
+
+    def set_tensor(self, index, value):
+        self._input[...] = value
+
+    def get_tensor(self, index):
+        return self._output.copy()
+
+    def _quantize(self, values):
+        q = np.round(values / OUTPUT_SCALE + OUTPUT_ZERO_POINT)
+        return np.clip(q, -128, 127).astype(np.int8)
+
+    def invoke(self):
+        if self.invoke_time > 0:
+            time.sleep(self.invoke_time)
+        self.invocations += 1
+
+        rng = self._rng
+        out = np.empty((4 + self.num_classes, self.num_anchors), dtype=np.float32)
+        out[0:2] = rng.uniform(0.0, 1.0, size=(2, self.num_anchors))
+        out[2:4] = rng.uniform(0.02, 0.2, size=(2, self.num_anchors))
+        out[4:] = rng.uniform(0.0, 0.1, size=(self.num_classes, self.num_anchors))
+
+        if isinstance(self.persons, int):
+            count = self.persons
+        else:
+            count = int(rng.integers(self.persons[0], self.persons[1] + 1))
+        # 離れた位置に人を配置する (NMSで1人1件に絞られる)
+        anchors = rng.choice(self.num_anchors, size=count, replace=False)
+        for i, anchor in enumerate(anchors):
+            out[0, anchor] = (i + 0.5) / max(count, 1)
+            out[1, anchor] = 0.5
+            out[2, anchor] = 0.5 / max(count, 1)
+            out[3, anchor] = 0.3
+            out[4, anchor] = rng.uniform(0.6, 0.95)
+
+        self._output[0] = self._quantize(out)
@@ -0,0 +1,122 @@
+"""
+トラッキングモード (N フレームに1回推論 + オプティカルフロー) の効果測定
+
+合成映像 (テクスチャのある背景の上を人物に見立てた矩形が横切る) に対し、
+DetectEvery を変えて 1フレームあたりの処理時間・実効フレームレートと、
+ユニーク訪問者数・ライン通過数が正解とどれだけ合うかを比較する。
+推論はスタブ (--model 指定時は実モデル) を実行し、トラッカーには正解の枠にノイズを加えて渡す。
+スタブの推論時間は --invoke-time で実機相当に設定する (Pi Zero 2 W の yolov8n int8 は数百ms)。
+映像の描画時間は測定に含めない。
+
+使い方:
+    python -m benchmarks.tracker_bench [--people 6] [--frames 400] [--every 1 3 5 10]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app import MultiObjectTracker, YoloDetector
+from benchmarks.stub_interpreter import StubInterpreter
+
+WIDTH, HEIGHT = 640, 360
+LINE = {"name": "center", "points": [[0.5, 0.0], [0.5, 1.0]]}
+
+
+def make_scene(people, frames, seed=0):
+    """人物ごとの出現フレーム・速度・テクスチャ"""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8), (0, 0), 2)
+    actors = []
+    for i in range(people):
+        direction = 1 if i % 2 == 0 else -1
+        speed = rng.uniform(3, 6) * direction
+        actors.append({
+            "start": int(rng.integers(0, frames // 2)),
+            "x0": -40.0 if direction > 0 else WIDTH - 10.0,
+            "y": float(rng.integers(20, HEIGHT - 140)),
+            "speed": speed,
+            "texture": rng.integers(0, 256, (110, 45, 3), dtype=np.uint8),
+        })
+    return background, actors
+
+
+def render(background, actors, index):
+    image = background.copy()
+    boxes = []
+    for actor in actors:
+        if index < actor["start"]:
+            continue
+        x = actor["x0"] + (index - actor["start"]) * actor["speed"]
+        left, top = int(x), int(actor["y"])
+        h, w = actor["texture"].shape[:2]
+        x0, x1 = max(left, 0), min(left + w, WIDTH)
+        if x1 - x0 < 10:
+            continue
+        image[top:top + h, x0:x1] = actor["texture"][:, x0 - left:x1 - left]
+        boxes.append([x0, top, x1 - x0, h])
+    return image, boxes
+
+
+def true_crossings(actors, frames):
+    counts = {"in": 0, "out": 0}
+    for actor in actors:
+        center_start = actor["x0"] + 22
+        center_end = center_start + (frames - 1 - actor["start"]) * actor["speed"]
+        if actor["speed"] > 0 and center_start < WIDTH / 2 <= center_end:
+            counts["in"] += 1
+        elif actor["speed"] < 0 and center_end <= WIDTH / 2 < center_start:
+            counts["out"] += 1
+    return counts
+
+
+def run(detector, background, actors, frames, every, rng):
+    tracker = MultiObjectTracker(detect_every=every, lines=[LINE])
+    elapsed = 0.0
+    for index in range(frames):
+        image, boxes = render(background, actors, index)
+        t0 = time.perf_counter()
+        detections = None
+        if tracker.needs_detection():
+            detector.detect(image)  # 推論のCPU負荷
+            detections = [
+                {"box": [b[0] + int(rng.integers(-2, 3)), b[1] + int(rng.integers(-2, 3)), b[2], b[3]],
+                 "score": 0.9, "class_id": 0, "class_name": "person"}
+                for b in boxes
+            ]
+        tracker.update(image, detections)
+        elapsed += time.perf_counter() - t0
+    return elapsed, tracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracker benchmark")
+    parser.add_argument("--model", default=None, help="tfliteモデル (省略時はスタブ)")
+    parser.add_argument("--people", type=int, default=6)
+    parser.add_argument("--frames", type=int, default=400)
+    parser.add_argument("--invoke-time", type=float, default=0.05, help="スタブ推論の擬似処理時間 [秒]")
+    parser.add_argument("--every", type=int, nargs="+", default=[1, 3, 5, 10])
+    args = parser.parse_args()
+
+    background, actors = make_scene(args.people, args.frames)
+    expected = true_crossings(actors, args.frames)
+    visible = sum(1 for a in actors if a["start"] < args.frames)
+    print(f"people: {visible}, expected crossings: {expected}")
+
+    print(f"{'every':>6} {'ms/frame':>9} {'fps':>7} {'visitors':>9} {'in':>4} {'out':>4}")
+    for every in args.every:
+        if args.model:
+            detector = YoloDetector(model_path=args.model)
+        else:
+            stub = StubInterpreter(persons=0, invoke_time=args.invoke_time)
+            detector = YoloDetector(model_path=None, interpreter=stub)
+        elapsed, tracker = run(detector, background, actors, args.frames, every, np.random.default_rng(1))
+        stats = tracker.stats()
+        crossing = stats["crossings"][LINE["name"]]
+        print(f"{every:>6d} {elapsed / args.frames * 1000:>9.2f} {args.frames / elapsed:>7.1f} "
+              f"{stats['visitors'].get('person', 0):>9d} {crossing['in']:>4d} {crossing['out']:>4d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 import time
 import datetime
-import cv2
 import os
 import sys
-from app import Camera, YoloDetector, LoggerHandler, LoRaCommunicator,ConfigManager, SystemInitializer
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# cv2 / numpy / tflite_runtime / picamera2 を使うクラスは、並行初期化のスレッド内や有効なときだけ読み込む
+from app import LoggerHandler, LoRaCommunicator, ConfigManager, SystemInitializer, Pipeline, PayloadCodec, UplinkScheduler, TimeSeriesStore, SamplingScheduler, MetricsExporter, ConfigWatcher
+from app.metrics import metrics
+from app.payload_codec import DEFAULT_EPOCH
 
 MODEL_PATH = "models/yolov8n_full_integer_quant.tflite"
 
 def main():
+    boot_start = time.monotonic()
     print("YOLO Person detection system activated!")
 
     # 設定の読み込み
@@ -47,95 +52,757 @@ def main():
 
     # カメラ部分の抽出
     camera_focus = config.get("Camera", {}).get("Focus",0.0)
+    camera_lores = config.get("Camera", {}).get("Lores",1)
+    snapshot_interval = config.get("Camera", {}).get("SnapshotInterval",0)
     detect_conf = config.get("Detection",{}).get("CONF_THRESHOLD",0.4)
     interval = config.get("Detection",{}).get("Interval",5)
+    detect_classes = config.get("Detection",{}).get("Classes",None)
+    detect_rois = config.get("Detection",{}).get("ROIs",[])
+    detect_tiled = config.get("Detection",{}).get("Tiled",0)
+    tile_size = config.get("Detection",{}).get("TileSize",None)
+    tile_overlap = config.get("Detection",{}).get("TileOverlap",0.2)
+    detect_models = config.get("Detection",{}).get("Models",[])
+    detect_threads = config.get("Detection",{}).get("Threads",4)
+    detect_backend = config.get("Detection",{}).get("Backend","tflite")
+    latency_budget = config.get("Detection",{}).get("LatencyBudget",None)
     print("Loaded Detection Configuration:")
     print(f" - Focus: {camera_focus}")
+    print(f" - Lores stream: {lores_enabled(camera_lores, detect_tiled, detect_rois)}"
+          f"{' (off: ROIs/Tiled use the main stream)' if camera_lores and (detect_rois or detect_tiled) else ''}, "
+          f"Snapshot Interval: {snapshot_interval} sec")
     print(f" - Conf Threshold: {detect_conf}")
     print(f" - Interval: {interval} sec")
+    print(f" - Classes: {detect_classes if detect_classes else 'all'}")
+    print(f" - ROIs: {detect_rois if detect_rois else 'full frame'}")
+    print(f" - Tiled: {bool(detect_tiled)} (size {tile_size or 'model input'}, overlap {tile_overlap})")
+    print(f" - Models: {[m.get('Name', m['Path']) for m in detect_models] if detect_models else MODEL_PATH}")
+    print(f" - Backend: {detect_backend}, Threads: {detect_threads}, Latency Budget: {latency_budget} sec")
 
     # LoRa部分の抽出
     DEV_EUI = config.get("LoRa",{}).get("DEVEUI","0000000000000000")
     APP_EUI = config.get("LoRa",{}).get("APPEUI","0000000000000000")
     APP_KEY = config.get("LoRa",{}).get("APPKEY","00000000000000000000000000000000")
-    IS_JOINED = config.get("LoRa",{}).get("IsJoined",0)
+    IS_JOINED = config_mgr.is_joined()
     print("Loaded LoRa Configuration:")
     print(f" - DEV_EUI: {DEV_EUI}")
     print(f" - APP_EUI: {APP_EUI}")
     print(f" - APP_KEY: {APP_KEY}")    
 
-    # クラス初期化
-    camera = Camera(width=1280, height=720, focus_val=camera_focus)
-    detector = YoloDetector(model_path=MODEL_PATH, conf_threshold=detect_conf)
-    logger = LoggerHandler(log_dir="data/logs")
+    # クラス初期化 (モデル読み込み・カメラ起動・LoRaモジュールの確認を並行して行う)
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="init") as executor:
+        detector_future = executor.submit(build_detector, detect_conf, detect_classes, detect_rois,
+                                          detect_tiled, tile_size, tile_overlap,
+                                          detect_models, detect_threads, latency_budget, detect_backend)
+        # 推論はISPで縮小した lores ストリームで行う
+        # (タイル推論・ROIはフル解像度から切り出して小さな対象を拾うためのものなので使わない)
+        camera_future = executor.submit(build_camera, detector_future, camera_focus,
+                                        lores_enabled(camera_lores, detect_tiled, detect_rois))
+        lora_future = executor.submit(open_lora, '/dev/ttyS0', bool(IS_JOINED),
+                                      config.get("Link",{}).get("Window",20))
 
-    # LoRa joinプロセス
+        exporter = build_metrics(config)
+        logger = build_logger(config)
+        motion_gate = build_motion_gate(config)
+        scheduler = build_sampling_scheduler(config, interval, DEV_EUI)
+        tracker = build_tracker(config)
+
+        detector = detector_future.result()
+        camera = camera_future.result()
+        lora = lora_future.result()
+    if lora is None:
+        camera.stop()
+        sys.exit(1)
+
+    frame_store, web_monitor = build_web_monitor(config, detector)
+    uplink_scheduler = build_uplink_scheduler(config)
+    link_adapter = build_link_adapter(config, lora, uplink_scheduler)
+    pipeline = build_pipeline(config, detector, logger, lora, frame_store, uplink_scheduler, link_adapter)
+    pipeline.install_signal_handlers()
+    pipeline.start()
+
+    # Joinは監視と並行して行い、完了するまで送信データは溜めておく
+    if not lora.joined.is_set():
+        start_join(config, config_mgr, lora, pipeline.stop_event)
+
+    config_watcher = build_config_watcher(config_mgr, camera, detector, scheduler, motion_gate, tracker,
+                                          logger, uplink_scheduler, link_adapter)
+
+    boot_time = time.monotonic() - boot_start
+    metrics.observe("boot", boot_time)
+    print(f"Start monitoring loop... (initialized in {boot_time:.1f} sec)")
+
+    try:
+        run_monitoring(camera, detector, pipeline, scheduler, motion_gate, snapshot_interval, tracker,
+                       config_watcher)
+    finally:
+        if config_watcher:
+            config_watcher.stop()
+        print("Stopping pipeline...")
+        pipeline.shutdown()
+        logger.close()
+        if uplink_scheduler and uplink_scheduler.outbox:
+            print(f"Outbox: {uplink_scheduler.outbox.stats()}")
+            uplink_scheduler.outbox.close()
+        if link_adapter:
+            print(f"Link: {link_adapter.stats()}")
+        if motion_gate:
+            print(f"Motion gate: skipped {motion_gate.skipped}/{motion_gate.frames} inferences")
+        if tracker:
+            print(f"Tracker: {tracker.stats()}")
+        print(f"Sampling: {scheduler.stats()}")
+        print(f"Detector: {detector.stats()}")
+        camera.stop()
+        lora.close()
+        if web_monitor:
+            web_monitor.stop()
+        if exporter:
+            exporter.stop()
+        print("Stopped.")
+
+def build_detector(conf_threshold, classes, rois, tiled, tile_size, tile_overlap,
+                   models=None, num_threads=4, latency_budget=None, backend="tflite"):
+    """
+    モデルを読み込んで DetectorManager を作る (tflite_runtime と cv2 の読み込みもこのスレッドで行う)
+    :param models: config.json の Detection.Models。空なら MODEL_PATH だけを使う
+    :param latency_budget: 1フレームあたりの処理時間の予算 [秒]。複数モデルのときに起動時に計測し、予算に収まるものを選ぶ
+    :param backend: 推論バックエンド (Models の各要素の Backend で上書きできる)
+    """
+    from app import YoloDetector, DetectorManager, ModelSpec
+    t0 = time.monotonic()
+    specs = [ModelSpec.from_config(entry, num_threads, backend) for entry in models or []]
+    if not specs:
+        specs = [ModelSpec(MODEL_PATH, num_threads=num_threads, backend=backend)]
+
+    def _load(spec):
+        return YoloDetector(model_path=spec.path, num_threads=spec.num_threads, backend=spec.backend,
+                            input_size=spec.input_size, conf_threshold=conf_threshold,
+                            classes=classes, rois=rois, tiled=bool(tiled),
+                            tile_size=tuple(tile_size) if tile_size else None, tile_overlap=tile_overlap)
+
+    # タイル推論はフル解像度で行うので、計測もその大きさで行う
+    detector = DetectorManager(specs, _load, budget=latency_budget,
+                               frame_size=(1280, 720) if tiled else None)
+    print(f"Model loaded in {time.monotonic() - t0:.1f} sec")
+    return detector
+
+def lores_enabled(lores, tiled, rois):
+    """推論に lores ストリームを使うか (ROI・タイル推論はフル解像度から切り出す)"""
+    return bool(lores) and not tiled and not rois
+
+def build_camera(detector_future, focus, use_lores):
+    """
+    カメラを起動する
+    picamera2 の読み込みはモデルの読み込みと並行して行い、lores の大きさを決めるためにモデルの入力サイズを待つ
+    """
+    from app import Camera, fit_lores_size
+    t0 = time.monotonic()
+    import picamera2  # noqa: F401 (読み込みに数秒かかるので先に済ませる)
+    lores_size = None
+    if use_lores:
+        lores_size = fit_lores_size((1280, 720), detector_future.result().model_input_size)
+    camera = Camera(width=1280, height=720, focus_val=focus, lores_size=lores_size)
+    print(f"Camera started in {time.monotonic() - t0:.1f} sec")
+    return camera
+
+def open_lora(port, resume, link_window=20):
+    """
+    シリアルポートを開く
+    :param resume: 前回のJoinが記録されていれば、モジュールにセッションが残っているか AT+DULSTAT? で確認する
+    :param link_window: リンク情報の統計を取る直近の送信回数
+    :return: LoRaCommunicator。ポートが開けなければ None
+    """
     print("Start LoRa connection process!")
     print("opening serial port...")
     try:
-        lora = LoRaCommunicator(port='/dev/ttyS0')
+        lora = LoRaCommunicator(port=port, link_window=link_window)
         print("Serial port opened successfully.")
     except Exception as e:
         print(f"Failed to open serial port: {e}")
-        sys.exit(1)
+        return None
+    if resume:
+        lora.resume_session()
+    return lora
 
-    if IS_JOINED:
-        print("Already joined! Skip join process...")
-    else:
-        print(f"Joining with DevEUI: {DEV_EUI} ...")
-        if lora.connect_network(DEV_EUI, APP_EUI, APP_KEY):
+def start_join(config, config_mgr, lora, stop_event):
+    """
+    バックグラウンドでJoinする (失敗したら間隔を伸ばして再試行)
+    成功したら data/lora_join.json に記録し、次回の起動では再Joinせずにセッションを確認するだけにする
+    """
+    lora_conf = config.get("LoRa",{})
+    dev_eui = lora_conf.get("DEVEUI","0000000000000000")
+    app_eui = lora_conf.get("APPEUI","0000000000000000")
+    app_key = lora_conf.get("APPKEY","00000000000000000000000000000000")
+    base_delay = lora_conf.get("JoinBackoff",15)
+    max_delay = lora_conf.get("JoinBackoffMax",600)
+    print(f" - Join backoff: {base_delay} sec (max {max_delay} sec)")
+
+    def _join():
+        if lora.join_with_backoff(dev_eui, app_eui, app_key, stop_event=stop_event,
+                                  base_delay=base_delay, max_delay=max_delay):
             print("Result: Success!")
-        else:
-            print("Result: Failed.")
-            sys.exit(1)
+            if not config_mgr.is_joined():
+                config_mgr.update_lora_join_status(1, dev_eui, app_eui)
+
+    thread = threading.Thread(target=_join, name="lora-join", daemon=True)
+    thread.start()
+    return thread
+
+def build_pipeline(config, detector, logger, lora, frame_store=None, uplink_scheduler=None, link_adapter=None):
+    """
+    後段ステージ (最新フレームの更新・CSV記録・送信待ちへの追加・LoRa送信) を組み立てる
+    :param frame_store: WebMonitor が配信する FrameStore。None なら画像の保存だけに使うものを作る
+    :param uplink_scheduler: 送信スケジューラ。None なら設定から作る
+    :param link_adapter: LinkAdapter。None ならデータレート・再送回数は固定
+    """
+    queue_size = config.get("Pipeline",{}).get("QueueSize",2)
+    queue_policy = config.get("Pipeline",{}).get("Policy","drop_oldest")
+    print("Loaded Pipeline Configuration:")
+    print(f" - QueueSize: {queue_size}")
+    print(f" - Policy: {queue_policy}")
 
+    pipeline = Pipeline(maxsize=queue_size, policy=queue_policy)
+    from app import FrameStore
+    if frame_store is None:
+        frame_store = FrameStore(detector.draw_results)
+    saver = build_snapshot_saver(config, frame_store)
+    pipeline.add_stage("annotate", lambda item: publish_frame(frame_store, saver, item))
+    pipeline.add_stage("logger", lambda item: save_detection_log(logger, item))
+    scheduler = uplink_scheduler if uplink_scheduler is not None else build_uplink_scheduler(config)
+    if scheduler is not None:
+        # 送信待ちへの追加 (Outbox への保管を含む) は、送信中でも捨てられないよう撮影側のスレッドで行う
+        pipeline.add_inline_stage("uplink", lambda item: scheduler.add_sample(item["dt"], item["counts"]))
+    pipeline.add_stage("lora", lambda item: send_uplink(lora, logger, item, scheduler, link_adapter))
+    return pipeline
 
-    print("Start monitoring loop...")
+def build_web_monitor(config, detector):
+    """
+    最新フレームの配信設定を読み込む
+    :return: (FrameStore, 起動した WebMonitor or None)
+    """
+    web_conf = config.get("Web",{})
+    enabled = web_conf.get("Enabled",1)
+    host = web_conf.get("Host","0.0.0.0")
+    port = web_conf.get("Port",8000)
+    quality = web_conf.get("Quality",80)
+    stream_fps = web_conf.get("StreamFPS",2)
+    print("Loaded Web Configuration:")
+    print(f" - Enabled: {bool(enabled)}, Endpoint: {host}:{port}")
+    print(f" - JPEG Quality: {quality}, Stream FPS: {stream_fps}")
 
+    from app import FrameStore, WebMonitor
+    frame_store = FrameStore(detector.draw_results, quality=quality)
+    if not enabled:
+        return frame_store, None
+    monitor = WebMonitor(frame_store, host=host, port=port, log_dir="data/logs", stream_fps=stream_fps)
     try:
-        while True:
-            now_dt = datetime.datetime.now()
-
-            # 撮影・検出・保存
-            frame = camera.capture()
-            results = detector.detect(frame)
-            person_count = logger.save(now_dt, results)
-            result_img = detector.draw_results(frame.copy(), results)
-            now_str = now_dt.strftime('%Y-%m-%d %H:%M:%S')
-            cv2.putText(result_img, now_str, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            save_path = os.path.join("data/images", "latest_result.jpg")
-            cv2.imwrite(save_path, result_img)
-            print(f"[{now_str}] Count(Person): {person_count} | Saved.")
-            
-            print("Sending data via LoRa")
-            send_payload = now_str + " " + str(person_count) 
-            
-            if lora.send_data(send_payload):
-                print("Result: Sent Command Accepted")
-                logger.save_lora(now_dt, "SEND", send_payload, "Success")
-
-                print("Checking for response...")
-                import time
-                time.sleep(2)
-                
-                # 受信処理
-                data = lora.receive_data()
-                if data:
-                    print(f"Received: {data}")
-                    logger.save_lora(datetime.datetime.now(), "RECV", data, "Success")
-                else:
-                    print("No data received.")
-            else:
-                print("Result: Send Failed")
-                logger.save_lora(now_dt, "SEND", send_payload, "Failed")
+        return frame_store, monitor.start()
+    except OSError as e:
+        # ポートが使えなくても監視は続ける
+        print(f"Failed to start web monitor: {e}")
+        return frame_store, None
 
-            # 指定秒数待機
-            time.sleep(interval)
+def build_snapshot_saver(config, frame_store):
+    """検出結果画像をディスクに保存する条件を読み込む"""
+    web_conf = config.get("Web",{})
+    persist = web_conf.get("Persist","change")
+    min_interval = web_conf.get("PersistMinInterval",60)
+    print(f" - Persist snapshots: {persist} (at most every {min_interval} sec)")
+    from app import SnapshotSaver
+    return SnapshotSaver(frame_store, path=os.path.join("data/images", "latest_result.jpg"),
+                         mode=persist, min_interval=min_interval)
 
-    except KeyboardInterrupt:
-        print("\nStopped.")
-    finally:
-        camera.stop()
+def build_metrics(config):
+    """
+    処理時間・カウンタの公開方法 (Prometheus形式のHTTP・JSONスナップショット) を読み込む
+    :return: 起動した MetricsExporter。無効なら None (計測自体も止める)
+    """
+    metrics_conf = config.get("Metrics",{})
+    enabled = metrics_conf.get("Enabled",1)
+    bind = metrics_conf.get("Bind","127.0.0.1")
+    port = metrics_conf.get("Port",9108)
+    snapshot_path = metrics_conf.get("SnapshotPath","data/logs/metrics.json")
+    snapshot_interval = metrics_conf.get("SnapshotInterval",60)
+    window = metrics_conf.get("Window",1024)
+    print("Loaded Metrics Configuration:")
+    print(f" - Enabled: {bool(enabled)}")
+    metrics.configure(window=window, enabled=bool(enabled))
+    if not enabled:
+        return None
+    print(f" - Endpoint: {f'{bind}:{port}' if port else 'disabled'}, Window: {window} samples")
+    print(f" - Snapshot: {snapshot_path or 'disabled'} every {snapshot_interval} sec")
+    exporter = MetricsExporter(bind=bind, port=port, snapshot_path=snapshot_path or None,
+                               snapshot_interval=snapshot_interval)
+    try:
+        return exporter.start()
+    except OSError as e:
+        # ポートが使えなくても監視は続ける
+        print(f"Failed to start metrics endpoint: {e}")
+        return None
+
+def build_config_watcher(config_mgr, camera, detector, scheduler, motion_gate, tracker, logger, uplink_scheduler,
+                         link_adapter=None):
+    """
+    設定ファイルを監視し、変更を再起動せずに反映する
+    各ハンドラは (変更前のセクション, 変更後のセクション) を受け取って反映し、再起動が必要なキーを返す
+    :return: 起動した ConfigWatcher。無効なら None
+    """
+    watch_conf = config_mgr.get("Config",{})
+    enabled = watch_conf.get("Watch",1)
+    poll_interval = watch_conf.get("PollInterval",2)
+    print("Loaded Config Watch Configuration:")
+    print(f" - Enabled: {bool(enabled)}, Poll Interval: {poll_interval} sec")
+    if not enabled:
+        return None
+
+    watcher = ConfigWatcher(config_mgr, poll_interval=poll_interval)
+
+    def _restart_keys(old, new, keys):
+        return [key for key in keys if old.get(key) != new.get(key)]
+
+    def _sampling(detection, sampling):
+        scheduler.configure(detection.get("Interval",5),
+                            min_interval=sampling.get("MinInterval",None),
+                            max_interval=sampling.get("MaxInterval",None),
+                            active_interval=sampling.get("ActiveInterval",None),
+                            idle_interval=sampling.get("IdleInterval",None),
+                            idle_after=sampling.get("IdleAfter",5),
+                            align=bool(sampling.get("Align",0)),
+                            jitter=sampling.get("Jitter",0))
+        scheduler.temp_soft = sampling.get("TempSoft",70)
+        scheduler.temp_hard = sampling.get("TempHard",80)
+
+    def on_detection(old, new):
+        detector.set_conf_threshold(new.get("CONF_THRESHOLD",0.4))
+        detector.set_classes(new.get("Classes",None))
+        restart = _restart_keys(old, new, ["Tiled", "Models", "Threads", "Backend"])
+        rois = new.get("ROIs",[])
+        lores = lores_enabled(watcher.target.get("Camera",{}).get("Lores",1), new.get("Tiled",0), rois)
+        if old.get("ROIs",[]) != rois and lores != bool(camera.lores_size):
+            # ROIの有無で推論に使うストリームが変わる (lores から切り出すと解像度が落ちる)
+            restart.append("ROIs")
+            if camera.lores_size:
+                rois = old.get("ROIs",[])
+        detector.set_regions(rois, new.get("TileSize",None), new.get("TileOverlap",0.2))
+        detector.set_budget(new.get("LatencyBudget",None))
+        _sampling(new, watcher.target.get("Sampling",{}))
+        return restart
+
+    def on_sampling(old, new):
+        _sampling(watcher.target.get("Detection",{}), new)
+
+    def on_camera(old, new):
+        camera.set_focus(new.get("Focus",0.0))
+        return _restart_keys(old, new, ["Sensor", "Lores", "SnapshotInterval"])
+
+    def on_motion_gate(old, new):
+        if motion_gate is None:
+            return _restart_keys(old, new, new.keys() | old.keys())
+        motion_gate.threshold = new.get("Threshold",25)
+        motion_gate.min_area = new.get("MinArea",0.002)
+        motion_gate.force_every = new.get("ForceEvery",10)
+        motion_gate.set_masks(new.get("Masks",[]))
+        return _restart_keys(old, new, ["Enabled", "Mode", "Width"])
+
+    def on_tracking(old, new):
+        if tracker is None:
+            return _restart_keys(old, new, new.keys() | old.keys())
+        tracker.iou_threshold = new.get("IoUThreshold",0.3)
+        tracker.max_misses = new.get("MaxMisses",3)
+        tracker.min_hits = new.get("MinHits",2)
+        return _restart_keys(old, new, ["Enabled", "DetectEvery", "Lines"])
+
+    def on_logging(old, new):
+        logger.configure(flush_rows=new.get("FlushRows",32),
+                         flush_interval=new.get("FlushInterval",10),
+                         fsync_interval=new.get("FsyncInterval",60),
+                         rotate=new.get("Rotate","daily"),
+                         max_bytes=new.get("MaxBytes",0),
+                         compress=bool(new.get("Compress",1)))
+        return _restart_keys(old, new, ["Database"])
+
+    def on_uplink(old, new):
+        if uplink_scheduler is None:
+            return _restart_keys(old, new, new.keys() | old.keys())
+        if link_adapter is None:
+            # リンク適応が有効ならデータレートは LinkAdapter が決める
+            uplink_scheduler.set_data_rate(new.get("DataRate",2))
+        uplink_scheduler.duty_cycle = new.get("DutyCycle",0.01)
+        uplink_scheduler.budget_window = new.get("BudgetWindow",3600)
+        uplink_scheduler.max_latency = new.get("MaxLatency",0)
+        uplink_scheduler.confirmed = bool(new.get("Confirmed",0))
+        if link_adapter is not None:
+            link_adapter.policy.confirmed = bool(new.get("Confirmed",0))
+        return _restart_keys(old, new, ["Format", "Classes", "TimeMode", "Epoch", "Window", "DwellTime"])
+
+    def on_link(old, new):
+        if link_adapter is None:
+            return _restart_keys(old, new, new.keys() | old.keys())
+        link_adapter.set_policy(build_link_policy(new, watcher.target.get("Uplink",{})))
+        return _restart_keys(old, new, ["Adaptive", "LinkCheck", "Window"])
+
+    watcher.register("Detection", on_detection)
+    watcher.register("Sampling", on_sampling)
+    watcher.register("Camera", on_camera)
+    watcher.register("MotionGate", on_motion_gate)
+    watcher.register("Tracking", on_tracking)
+    watcher.register("Logging", on_logging)
+    watcher.register("Uplink", on_uplink)
+    watcher.register("Link", on_link)
+    return watcher.start()
+
+def build_sampling_scheduler(config, interval, device_id):
+    """撮影周期の調整 (壁時計への整列・端末ごとの位相・活動量と温度による周期) の設定を読み込む"""
+    sampling_conf = config.get("Sampling",{})
+    align = sampling_conf.get("Align",0)
+    jitter = sampling_conf.get("Jitter",0)
+    min_interval = sampling_conf.get("MinInterval",None)
+    max_interval = sampling_conf.get("MaxInterval",None)
+    active_interval = sampling_conf.get("ActiveInterval",None)
+    idle_interval = sampling_conf.get("IdleInterval",None)
+    idle_after = sampling_conf.get("IdleAfter",5)
+    temp_soft = sampling_conf.get("TempSoft",70)
+    temp_hard = sampling_conf.get("TempHard",80)
+    print("Loaded Sampling Configuration:")
+    print(f" - Align: {bool(align)}, Jitter: {jitter} sec")
+    print(f" - Interval: {interval} sec (min {min_interval}, max {max_interval}, "
+          f"active {active_interval}, idle {idle_interval} after {idle_after} cycles)")
+    print(f" - Thermal: soft {temp_soft} C, hard {temp_hard} C")
+    scheduler = SamplingScheduler(interval, min_interval=min_interval, max_interval=max_interval,
+                                  active_interval=active_interval, idle_interval=idle_interval,
+                                  idle_after=idle_after, align=bool(align), jitter=jitter, device_id=device_id,
+                                  temp_soft=temp_soft, temp_hard=temp_hard)
+    print(f" - Bounds: {scheduler.min_interval}-{scheduler.max_interval} sec, "
+          f"thermal back-off up to {scheduler.thermal_interval} sec")
+    print(f" - Phase offset: {scheduler.offset:.2f} sec")
+    return scheduler
+
+def build_motion_gate(config):
+    """変化検出の設定を読み込む。無効なら None"""
+    gate_conf = config.get("MotionGate",{})
+    enabled = gate_conf.get("Enabled",0)
+    print("Loaded MotionGate Configuration:")
+    print(f" - Enabled: {bool(enabled)}")
+    if not enabled:
+        return None
+
+    mode = gate_conf.get("Mode","diff")
+    width = gate_conf.get("Width",160)
+    threshold = gate_conf.get("Threshold",25)
+    min_area = gate_conf.get("MinArea",0.002)
+    force_every = gate_conf.get("ForceEvery",10)
+    masks = gate_conf.get("Masks",[])
+    print(f" - Mode: {mode}, Width: {width}, Threshold: {threshold}, MinArea: {min_area}")
+    print(f" - ForceEvery: {force_every} cycles, Masks: {len(masks)}")
+    from app import MotionGate
+    return MotionGate(width=width, threshold=threshold, min_area=min_area, mode=mode,
+                      force_every=force_every, masks=masks)
+
+def build_tracker(config):
+    """トラッキングの設定を読み込む。無効なら None"""
+    tracking_conf = config.get("Tracking",{})
+    enabled = tracking_conf.get("Enabled",0)
+    print("Loaded Tracking Configuration:")
+    print(f" - Enabled: {bool(enabled)}")
+    if not enabled:
+        return None
+
+    detect_every = tracking_conf.get("DetectEvery",5)
+    iou_threshold = tracking_conf.get("IoUThreshold",0.3)
+    max_misses = tracking_conf.get("MaxMisses",3)
+    min_hits = tracking_conf.get("MinHits",2)
+    lines = tracking_conf.get("Lines",[])
+    print(f" - DetectEvery: {detect_every} cycles, IoU: {iou_threshold}, MaxMisses: {max_misses}, MinHits: {min_hits}")
+    print(f" - Lines: {[line['name'] for line in lines]}")
+    from app import MultiObjectTracker
+    return MultiObjectTracker(detect_every=detect_every, iou_threshold=iou_threshold,
+                              max_misses=max_misses, min_hits=min_hits, lines=lines)
+
+def build_logger(config):
+    """ログ書き込みのバッファ・退避設定を読み込んで LoggerHandler を作る"""
+    logging_conf = config.get("Logging",{})
+    flush_rows = logging_conf.get("FlushRows",32)
+    flush_interval = logging_conf.get("FlushInterval",10)
+    fsync_interval = logging_conf.get("FsyncInterval",60)
+    rotate = logging_conf.get("Rotate","daily")
+    max_bytes = logging_conf.get("MaxBytes",0)
+    compress = logging_conf.get("Compress",1)
+    database = logging_conf.get("Database","data/logs/loracam.db")
+    print("Loaded Logging Configuration:")
+    print(f" - Flush: every {flush_rows} rows or {flush_interval} sec, fsync every {fsync_interval} sec")
+    print(f" - Rotate: {rotate} (max {max_bytes} bytes), compress: {bool(compress)}")
+    print(f" - Database: {database or 'disabled'}")
+
+    store = None
+    if database:
+        os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+        store = TimeSeriesStore(database)
+    return LoggerHandler(
+        log_dir="data/logs",
+        flush_rows=flush_rows,
+        flush_interval=flush_interval,
+        fsync_interval=fsync_interval,
+        rotate=rotate,
+        max_bytes=max_bytes,
+        compress=bool(compress),
+        store=store,
+    )
+
+def build_uplink_scheduler(config):
+    """
+    アップリンクのペイロード形式と送信スケジューラを設定から作る
+    :return: UplinkScheduler。テキスト形式なら None
+    """
+    uplink_conf = config.get("Uplink",{})
+    payload_format = uplink_conf.get("Format","binary")
+    print("Loaded Uplink Configuration:")
+    print(f" - Format: {payload_format}")
+    if payload_format == "text":
+        return None
+
+    classes = uplink_conf.get("Classes",["person"])
+    time_mode = uplink_conf.get("TimeMode","epoch")
+    epoch = datetime.datetime.fromisoformat(uplink_conf.get("Epoch",DEFAULT_EPOCH.isoformat()))
+    window_size = uplink_conf.get("Window",1)
+    data_rate = uplink_conf.get("DataRate",2)
+    duty_cycle = uplink_conf.get("DutyCycle",0.01)
+    budget_window = uplink_conf.get("BudgetWindow",3600)
+    max_latency = uplink_conf.get("MaxLatency",0)
+    dwell_time = uplink_conf.get("DwellTime",0)
+    confirmed = uplink_conf.get("Confirmed",0)
+    print(f" - Classes: {classes}")
+    print(f" - TimeMode: {time_mode} (epoch {epoch})")
+    print(f" - Window: {window_size}")
+    print(f" - DataRate: DR{data_rate}, DutyCycle: {duty_cycle}, MaxLatency: {max_latency} sec")
+    print(f" - Confirmed: {bool(confirmed)}")
+
+    codec = PayloadCodec(classes=classes, time_mode=time_mode, epoch=epoch)
+    outbox, order = build_outbox(config)
+    return UplinkScheduler(
+        codec,
+        window_size=window_size,
+        data_rate=data_rate,
+        duty_cycle=duty_cycle,
+        budget_window=budget_window,
+        max_latency=max_latency,
+        dwell_time=bool(dwell_time),
+        outbox=outbox,
+        order=order,
+        confirmed=bool(confirmed),
+    )
+
+def build_link_policy(link_conf, uplink_conf):
+    """config.json の Link セクションから LinkPolicy を作る"""
+    from app import LinkPolicy
+    return LinkPolicy(
+        min_data_rate=link_conf.get("MinDataRate",0),
+        max_data_rate=link_conf.get("MaxDataRate",5),
+        margin=link_conf.get("Margin",5),
+        max_trials=link_conf.get("MaxTrials",3),
+        confirmed=bool(uplink_conf.get("Confirmed",0)),
+        auto_confirm=bool(link_conf.get("AutoConfirm",1)),
+        step_up_after=link_conf.get("StepUpAfter",5),
+        failure_limit=link_conf.get("FailureLimit",2),
+    )
+
+def build_link_adapter(config, lora, uplink_scheduler):
+    """
+    リンク品質 (AT+CLINKCHECK) に応じてデータレート・再送回数・Confirmed を選ぶ LinkAdapter の設定を読み込む
+    :return: LinkAdapter。無効なら None (データレートは Uplink.DataRate、再送回数は2で固定)
+    """
+    link_conf = config.get("Link",{})
+    uplink_conf = config.get("Uplink",{})
+    adaptive = link_conf.get("Adaptive",1)
+    link_check = link_conf.get("LinkCheck",1)
+    window = link_conf.get("Window",20)
+    data_rate = uplink_conf.get("DataRate",2)
+    dwell_time = uplink_conf.get("DwellTime",0)
+    policy = build_link_policy(link_conf, uplink_conf)
+    print("Loaded Link Configuration:")
+    print(f" - Adaptive: {bool(adaptive)}, LinkCheck: {bool(link_check)}, Window: {window}")
+    print(f" - DataRate: DR{policy.min_data_rate}-DR{policy.max_data_rate}, Margin: {policy.margin} dB, "
+          f"MaxTrials: {policy.max_trials}, AutoConfirm: {policy.auto_confirm}")
+    if not adaptive:
+        return None
+    from app import LinkAdapter
+    # テキスト形式は "YYYY-MM-DD HH:MM:SS N" (約21byte) が入るデータレートに限る
+    min_payload = uplink_scheduler.min_payload() if uplink_scheduler is not None else 24
+    return LinkAdapter(lora, policy, uplink_scheduler, data_rate=data_rate, link_check=bool(link_check),
+                       min_payload=min_payload, dwell_time=bool(dwell_time))
+
+def build_outbox(config):
+    """
+    送信待ちレコードをディスクに保管する Outbox の設定を読み込む
+    :return: (Outbox or None, 溜まったレコードを送る順)
+    """
+    outbox_conf = config.get("Outbox",{})
+    enabled = outbox_conf.get("Enabled",1)
+    path = outbox_conf.get("Path","data/outbox.bin")
+    slots = outbox_conf.get("Slots",1024)
+    slot_size = outbox_conf.get("SlotSize",128)
+    order = outbox_conf.get("Order","oldest")
+    sync_interval = outbox_conf.get("SyncInterval",60)
+    print("Loaded Outbox Configuration:")
+    print(f" - Enabled: {bool(enabled)}, Path: {path}")
+    print(f" - Slots: {slots} x {slot_size} bytes, Order: {order}, Sync every {sync_interval} sec")
+    if not enabled:
+        return None, order
+    from app import Outbox
+    return Outbox(path, slots=slots, slot_size=slot_size, sync_interval=sync_interval), order
+
+def run_monitoring(camera, detector, pipeline, interval, motion_gate=None, snapshot_interval=0, tracker=None,
+                   config_watcher=None):
+    """
+    撮影・検出を一定周期で行い、結果をパイプラインの後段ステージへ渡す
+    周期は処理時間や送信時間に関係なく保たれる
+    :param interval: 周期 [秒] または SamplingScheduler (壁時計への整列・活動量や温度による周期調整)
+    :param camera: CameraBackend (推論は低解像度画像、スナップショットはフル解像度画像で行う)
+    :param motion_gate: MotionGate。指定すると画面に変化がない周期は推論を省略する
+    :param snapshot_interval: スナップショットを保存する間隔 [秒] (0 なら毎周期)。
+                              保存しない周期はフル解像度画像を取得しない
+    :param tracker: MultiObjectTracker。指定すると推論は N 周期に1回になり、結果はトラックになる
+    :param config_watcher: ConfigWatcher。設定ファイルの変更は周期の区切りで反映する
+    """
+    scheduler = interval if isinstance(interval, SamplingScheduler) else SamplingScheduler(interval)
+    next_snapshot = time.monotonic()
+    last_results = None
+    if pipeline.wait(scheduler.start()):
+        return
+    metrics.gauge("sampling_period_seconds", lambda: scheduler.period)
+    metrics.gauge("soc_temperature_celsius", lambda: scheduler.temperature)
+    while not pipeline.stopped:
+        if config_watcher is not None:
+            config_watcher.apply_pending()
+        now_dt = datetime.datetime.now()
+        cycle_start = time.perf_counter()
+
+        # 撮影・検出
+        want_snapshot = time.monotonic() >= next_snapshot
+        image, frame = camera.capture_frames(main=want_snapshot)
+        if image is None:
+            print("No more frames from camera.")
+            break
+        if want_snapshot:
+            next_snapshot = time.monotonic() + snapshot_interval
+        carried_over = motion_gate is not None and not motion_gate.check(image) and last_results is not None
+        if tracker is not None:
+            # 推論は N フレームに1回だけ行い、間のフレームはトラッカーで枠を動かす
+            detections = None
+            if tracker.needs_detection() and not carried_over:
+                detections = detector.detect(image)
+            results = camera.to_main_coords(tracker.update(image, detections))
+            last_results = results
+            carried_over = detections is None
+        elif carried_over:
+            # 前回から画面に変化がないので推論を省略し、前回の結果を使う
+            results = last_results
+        else:
+            # 検出結果はフル解像度の座標で扱う
+            results = camera.to_main_coords(detector.detect(image))
+            last_results = results
+        metrics.inc("frames")
+        if carried_over:
+            metrics.inc("frames_skipped", reason="tracked" if tracker is not None else "motion")
+        counts = {}
+        for res in results:
+            counts[res["class_name"]] = counts.get(res["class_name"], 0) + 1
+        person_count = counts.get("person", 0)
+        note = " (carried over)" if carried_over and tracker is None else ""
+        if tracker is not None:
+            note = f" (tracked, visitors: {tracker.visitors.get('person', 0)})"
+            if tracker.crossings:
+                note += " " + ", ".join(f"{name} in/out: {c['in']}/{c['out']}" for name, c in tracker.crossings.items())
+        print(f"[{now_dt.strftime('%Y-%m-%d %H:%M:%S')}] Count(Person): {person_count}{note}")
+
+        pipeline.publish({
+            "dt": now_dt,
+            "frame": frame,
+            "results": results,
+            "counts": counts,
+            "person_count": person_count,
+            "carried_over": carried_over,
+            "tracking": tracker.stats() if tracker is not None else None,
+        })
+        metrics.observe("cycle", time.perf_counter() - cycle_start)
+
+        # 次の撮影時刻まで待機 (処理が周期を超えた場合は次の撮影時刻まで飛ばし、遅れを持ち越さない)
+        scheduler.observe(counts)
+        previous_period = scheduler.period
+        wait_time = scheduler.next_wait()
+        if scheduler.period != previous_period:
+            print(f"Sampling interval changed: {previous_period} -> {scheduler.period} sec "
+                  f"(temp: {scheduler.temperature}, throttled: {scheduler.throttled})")
+        pipeline.wait(wait_time)
+
+def publish_frame(frame_store, saver, item):
+    """
+    最新フレームと検出結果を FrameStore に渡す (フレームはこのステージ専用)
+    描画・エンコードは閲覧されたときか、保存条件を満たしたときだけ行う
+    """
+    note = "(carried over)" if item.get("carried_over") else ""
+    frame_store.update(item["dt"], item["results"], item["counts"], item["frame"], note)
+    if item["frame"] is not None:
+        saver.maybe_save(item["person_count"], len(item["results"]))
+
+def save_detection_log(logger, item):
+    logger.save(item["dt"], item["results"], carried_over=item.get("carried_over", False))
+
+def send_uplink(lora, logger, item, scheduler=None, link_adapter=None):
+    now_dt = item["dt"]
+    if not lora.joined.is_set():
+        # Join完了まで送らない (バイナリ形式ならレコードはスケジューラに溜まっていく)
+        print("Not joined yet. Skip sending.")
+        return
+
+    # リンク品質からデータレート・再送回数・Confirmed を選ぶ (スケジューラの最大ペイロードもここで変わる)
+    confirm = int(scheduler.confirmed) if scheduler is not None else 0
+    nbtrials = 2
+    if link_adapter is not None:
+        confirm, nbtrials = link_adapter.prepare()
+
+    if scheduler is None:
+        # テキスト形式 (従来互換)
+        now_str = now_dt.strftime('%Y-%m-%d %H:%M:%S')
+        send_payload = now_str + " " + str(item["person_count"])
+        log_payload = send_payload
+    else:
+        # バイナリ形式: 送信可能になるまでレコードを溜め、まとめて1回で送る
+        batch = scheduler.poll()
+        if batch is None:
+            return
+        send_payload, record_count = batch
+        log_payload = send_payload.hex().upper()
+        print(f"Packed {record_count} record(s) into {len(send_payload)} bytes")
+
+    print(f"Sending data via LoRa (confirm: {confirm}, nbtrials: {nbtrials})")
+    sent = lora.send_data(send_payload, confirm=confirm, nbtrials=nbtrials)
+    if scheduler is not None:
+        # Unconfirmed は nbtrials 回すべて送る。Confirmed は受信確認が取れた時点で止まるが、何回目で取れたかは
+        # モジュールから分からないので、デューティ比の予算を超えないよう上限の nbtrials 回として数える
+        scheduler.on_sent(send_payload, record_count, sent, transmissions=nbtrials)
+        stats = scheduler.stats()
+        print(f"Airtime: {stats['airtime_window_s']:.2f}/{stats['budget_s']:.1f} sec (DR{stats['data_rate']}), "
+              f"pending records: {stats['records_pending']}")
+
+    if sent:
+        print("Result: Sent Command Accepted")
+        logger.save_lora(now_dt, "SEND", log_payload, "Success")
+
+        # 受信ウィンドウ中のダウンリンク通知を待つ (通知が来れば即座に戻る)
+        print("Checking for response...")
+        lora.wait_downlink(2)
+
+        # 受信処理
+        data = lora.receive_data()
+        if data:
+            print(f"Received: {data}")
+            logger.save_lora(datetime.datetime.now(), "RECV", data, "Success")
+        else:
+            print("No data received.")
+    else:
+        print("Result: Send Failed")
+        logger.save_lora(now_dt, "SEND", log_payload, "Failed")
+        if scheduler is not None:
+            print(f"Kept {record_count} record(s) for retry")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -15,13 +15,16 @@ $PROJECT_DIR/.venv/bin/pip install -r requirements.txt
 
 echo "サービスファイルの更新中"
 sudo cp $PROJECT_DIR/services/LoRaCam.service /etc/systemd/system
-sudo cp $PROJECT_DIR/services/WebMonitor.service /etc/systemd/system
+# Webモニターは LoRaCam.service に組み込まれたので、旧サービス (http.server) は止めて削除する
+if [ -f /etc/systemd/system/WebMonitor.service ]; then
+    sudo systemctl disable --now WebMonitor.service || true
+    sudo rm -f /etc/systemd/system/WebMonitor.service
+fi
 
 echo "サービスを再起動中"
 sudo systemctl daemon-reload
 sudo systemctl restart LoRaCam.service
-sudo systemctl restart WebMonitor.service
 
 echo "更新が完了しました"
 sudo systemctl status LoRaCam.service --no-pager
-sudo systemctl status WebMonitor.service --no-pager
+echo "Webモニター: http://$(hostname -I | awk '{print $1}'):8000/"
@@ -0,0 +1,80 @@
+"""
+ConfigWatcher の反映待ちの扱い (監視スレッドは使わず check() / apply_pending() を直接呼ぶ)
+"""
+import copy
+import json
+
+import pytest
+
+from app import ConfigWatcher
+from app.config_loader import ConfigManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    with open("config_template.json") as f:
+        data = json.load(f)
+    manager = ConfigManager()
+    manager.CONFIG_PATH = str(tmp_path / "config.json")
+    manager.LAST_GOOD_PATH = str(tmp_path / "config.last_good.json")
+    manager.config_data = copy.deepcopy(data)
+    _write(manager, data)
+    return manager
+
+
+def _write(manager, data):
+    with open(manager.CONFIG_PATH, "w") as f:
+        json.dump(data, f)
+
+
+def _watcher(manager, applied):
+    watcher = ConfigWatcher(manager)
+    watcher.register("Detection", lambda old, new: applied.append(new["CONF_THRESHOLD"]))
+    return watcher
+
+
+def test_edit_is_applied(manager):
+    applied = []
+    watcher = _watcher(manager, applied)
+    edited = copy.deepcopy(manager.config_data)
+    edited["Detection"]["CONF_THRESHOLD"] = 0.9
+    _write(manager, edited)
+
+    assert watcher.check()
+    assert watcher.apply_pending()
+    assert applied == [0.9]
+    assert manager.config_data["Detection"]["CONF_THRESHOLD"] == 0.9
+
+
+def test_reverted_edit_is_not_applied(manager):
+    """反映前に元に戻された変更は反映しない"""
+    applied = []
+    watcher = _watcher(manager, applied)
+    original = copy.deepcopy(manager.config_data)
+    edited = copy.deepcopy(original)
+    edited["Detection"]["CONF_THRESHOLD"] = 0.9
+
+    _write(manager, edited)
+    assert watcher.check()
+    _write(manager, original)
+    assert not watcher.check()
+
+    assert not watcher.apply_pending()
+    assert applied == []
+    assert manager.config_data["Detection"]["CONF_THRESHOLD"] == original["Detection"]["CONF_THRESHOLD"]
+
+
+def test_invalid_edit_discards_pending(manager):
+    """検証に通らない内容に書き換えられたら、以前の反映待ちの変更も反映しない"""
+    applied = []
+    watcher = _watcher(manager, applied)
+    edited = copy.deepcopy(manager.config_data)
+    edited["Detection"]["CONF_THRESHOLD"] = 0.9
+    _write(manager, edited)
+    assert watcher.check()
+    with open(manager.CONFIG_PATH, "w") as f:
+        f.write("{broken")
+    assert not watcher.check()
+
+    assert not watcher.apply_pending()
+    assert applied == []
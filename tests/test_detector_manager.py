@@ -0,0 +1,89 @@
+"""
+DetectorManager のモデルの切り替え (処理時間は偽の時計で決める)
+"""
+import pytest
+
+from app import detector_manager
+from app.detector_manager import DetectorManager, ModelSpec
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.slowdown = 1.0  # スロットリングなどによる処理時間の倍率
+
+    def perf_counter(self):
+        return self.now
+
+
+class _FakeDetector:
+    def __init__(self, clock, latency):
+        self.clock = clock
+        self.latency = latency
+        self.model_input_size = (64, 64)
+
+    def detect(self, image):
+        self.clock.now += self.latency * self.clock.slowdown
+        return []
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(detector_manager.time, "perf_counter", clock.perf_counter)
+    return clock
+
+
+def _manager(clock, budget, **kwargs):
+    specs = [ModelSpec("big.tflite", accuracy=2), ModelSpec("small.tflite", accuracy=1)]
+    latencies = {"big": 0.040, "small": 0.010}
+    return DetectorManager(specs, lambda spec: _FakeDetector(clock, latencies[spec.name]), budget=budget,
+                           benchmark_runs=1, **kwargs)
+
+
+def _run(manager, frames):
+    for _ in range(frames):
+        manager.detect(None)
+
+
+def test_model_within_budget_is_restored_after_a_spike(clock):
+    """予算の70-100%を使うモデルも、一時的な遅れで切り替えた後は起動時と同じ基準で戻される"""
+    manager = _manager(clock, budget=0.050)
+    assert manager.name == "big"
+
+    clock.slowdown = 1.5
+    _run(manager, 10)
+    assert manager.name == "small"
+
+    clock.slowdown = 1.0
+    _run(manager, manager.cooldown)
+    assert manager.name == "big"
+    assert manager.switches == 2
+
+
+def test_persistent_slowdown_keeps_the_fast_model(clock):
+    """遅いままなら戻さない"""
+    manager = _manager(clock, budget=0.050)
+    clock.slowdown = 1.5
+    _run(manager, 10 + 3 * manager.cooldown)
+    assert manager.name == "small"
+    assert manager.switches == 1
+
+
+def test_flapping_extends_the_cooldown(clock):
+    """戻してすぐにまた予算を超えたら、次に戻すまでの待ちを伸ばす"""
+    manager = _manager(clock, budget=0.050, window=5, cooldown=10)
+    clock.slowdown = 1.5
+    _run(manager, 5)
+    clock.slowdown = 1.0
+    _run(manager, 10)
+    assert manager.name == "big"
+
+    clock.slowdown = 1.5
+    _run(manager, 5)
+    assert manager.name == "small"
+    clock.slowdown = 1.0
+    _run(manager, 10)
+    assert manager.name == "small"
+    _run(manager, 10)
+    assert manager.name == "big"
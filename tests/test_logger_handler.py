@@ -0,0 +1,85 @@
+import csv
+import datetime
+import sqlite3
+
+import pytest
+
+from app.logger_handler import LoggerHandler
+from app.timeseries_store import TimeSeriesStore, import_csv_logs
+from tools.occupancy_report import parse_chunk
+
+DT = datetime.datetime(2026, 10, 18, 12, 0, 0)
+RESULTS = [{"class_name": "person"}, {"class_name": "person"}, {"class_name": "car"}]
+
+
+@pytest.fixture
+def logger(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / "loracam.db"))
+    handler = LoggerHandler(log_dir=str(tmp_path), rotate="none", compress=False, store=store)
+    yield handler
+    handler.close()
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_carried_over_is_recorded_in_csv_and_store(logger, tmp_path):
+    logger.save(DT, RESULTS)
+    logger.save(DT + datetime.timedelta(seconds=10), RESULTS, carried_over=True)
+    logger.flush()
+
+    person = read_rows(tmp_path / "logPerson.csv")
+    assert person[0] == ["Date", "Time", "Class", "Count", "CarriedOver"]
+    assert [row[3:] for row in person[1:]] == [["2", "0"], ["2", "1"]]
+    assert [row[2:] for row in read_rows(tmp_path / "logAll.csv")[1:]] == [
+        ["person", "2", "0"], ["car", "1", "0"], ["person", "2", "1"], ["car", "1", "1"]]
+
+    rows = logger.store.query_range(DT, DT + datetime.timedelta(minutes=1), classes=["person"],
+                                    with_carried_over=True)
+    assert [row[3] for row in rows] == [False, True]
+
+
+def test_old_format_csv_is_rotated_instead_of_appended(tmp_path):
+    (tmp_path / "logPerson.csv").write_text("Date,Time,Class,Count\n2026-10-17,12:00:00,person,1\n")
+    handler = LoggerHandler(log_dir=str(tmp_path), rotate="none", compress=False)
+    handler.save(DT, RESULTS)
+    handler.close()
+
+    assert read_rows(tmp_path / "logPerson.csv")[0][-1] == "CarriedOver"
+    rotated = [p for p in tmp_path.iterdir() if p.name.startswith("logPerson.") and p.name != "logPerson.csv"]
+    assert len(rotated) == 1 and read_rows(rotated[0])[0] == ["Date", "Time", "Class", "Count"]
+
+
+def test_store_adds_column_to_old_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE detections (ts INTEGER NOT NULL, class TEXT NOT NULL, count INTEGER NOT NULL)")
+    conn.execute("INSERT INTO detections VALUES (0, 'person', 3)")
+    conn.commit()
+    conn.close()
+
+    store = TimeSeriesStore(path)
+    store.record(DT, {"person": 1}, carried_over=True)
+    rows = store.query_range(datetime.datetime(1970, 1, 1), DT + datetime.timedelta(seconds=1),
+                             with_carried_over=True)
+    store.close()
+    assert [(count, carried) for _, _, count, carried in rows] == [(3, False), (1, True)]
+
+
+def test_csv_import_and_report_read_both_formats(tmp_path):
+    (tmp_path / "logPerson.2026-10-17.csv").write_text("Date,Time,Class,Count\n2026-10-17,12:00:00,person,4\n")
+    (tmp_path / "logPerson.csv").write_text(
+        "Date,Time,Class,Count,CarriedOver\n2026-10-18,12:00:00,person,2,0\n2026-10-18,12:00:10,person,2,1\n")
+
+    store = TimeSeriesStore(str(tmp_path / "loracam.db"))
+    import_csv_logs(store, str(tmp_path))
+    rows = store.query_range(datetime.datetime(2026, 10, 17), datetime.datetime(2026, 10, 19),
+                             with_carried_over=True)
+    store.close()
+    assert [(count, carried) for _, _, count, carried in rows] == [(4, False), (2, False), (2, True)]
+
+    for name, counts in (("logPerson.2026-10-17.csv", [4]), ("logPerson.csv", [2, 2])):
+        _, _, names, parsed = parse_chunk((tmp_path / name).read_bytes())
+        assert names == ["person"] and parsed.tolist() == counts
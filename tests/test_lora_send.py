@@ -0,0 +1,77 @@
+"""
+LoRaCommunicator.send_data の成功判定と Outbox の確認応答 (FakeModem を使う)
+"""
+import datetime
+
+import pytest
+
+from app import LoRaCommunicator, Outbox, PayloadCodec, UplinkScheduler
+from app.metrics import metrics
+from benchmarks.fake_modem import FakeModem
+
+
+@pytest.fixture
+def modem():
+    modem = FakeModem(latency=0.01, tx_time=3.0).start()
+    modem.status = FakeModem.STATUS_JOINED
+    yield modem
+    modem.stop()
+
+
+@pytest.fixture
+def lora(modem):
+    lora = LoRaCommunicator(port=modem.port)
+    lora.debug = False
+    yield lora
+    lora.close()
+
+
+def _scheduler(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.bin"), slots=16, slot_size=64)
+    scheduler = UplinkScheduler(PayloadCodec(), outbox=outbox)
+    scheduler.add_sample(datetime.datetime(2025, 1, 1, 12, 0, 0), {"person": 3})
+    return scheduler, outbox
+
+
+def test_timed_out_send_keeps_records_pending(lora, tmp_path):
+    """OK+SEND だけでタイムアウトした送信は失敗とし、Outbox のレコードを残す"""
+    scheduler, outbox = _scheduler(tmp_path)
+    payload, count = scheduler.poll()
+    pending = outbox.stats()["pending"]
+
+    timeouts = lora.timeouts
+    failures = metrics.counter("lora_send_failures")
+    sent = lora.send_data(payload, timeout=1.0)
+    scheduler.on_sent(payload, count, sent)
+
+    assert lora.timeouts == timeouts + 1
+    assert metrics.counter("lora_send_failures") == failures + 1
+    assert sent is False
+    assert outbox.stats()["pending"] == pending == 1
+    assert scheduler.stats()["records_pending"] == 1
+    # タイムアウトはリンクの失敗として記録される
+    assert lora.link.success_rate() == 0.0
+    outbox.close()
+
+
+def test_completed_send_acks_records(modem, lora, tmp_path):
+    """OK+SENT を受信した送信だけが Outbox から外れる"""
+    modem.tx_time = 0.2
+    scheduler, outbox = _scheduler(tmp_path)
+    payload, count = scheduler.poll()
+
+    sent = lora.send_data(payload)
+    scheduler.on_sent(payload, count, sent)
+
+    assert sent is True
+    assert outbox.stats()["pending"] == 0
+    outbox.close()
+
+
+def test_send_timeout_covers_slow_confirmed_retries(lora):
+    """DR0・Confirmed・3回の送信は固定の15秒では終わらないので、送信時間と受信ウィンドウから待ち時間を決める"""
+    lora.data_rate = 0
+    slow = lora.send_timeout(51, confirm=1, nbtrials=3)
+    assert slow > 3 * (2.8 + lora.RX_WINDOWS)
+    lora.data_rate = 5
+    assert lora.send_timeout(11, confirm=0, nbtrials=1) == LoRaCommunicator.COMMAND_SPECS["AT+DTRX"][1]
@@ -0,0 +1,129 @@
+import datetime
+import random
+
+import pytest
+
+from app.payload_codec import (PAYLOAD_VERSION, TIME_MODES, PayloadCodec, WindowAggregator, decode_varint,
+                               encode_varint)
+
+CLASSES = ["person", "car", "bicycle"]
+NOW = datetime.datetime(2026, 10, 18, 12, 34, 56)
+
+
+def random_records(rng, codec, count, with_stats):
+    dt = codec.epoch + datetime.timedelta(seconds=rng.randrange(0, 10 ** 8))
+    records = []
+    for _ in range(count):
+        record = {"dt": dt, "counts": {c: rng.choice([0, 0, 1, 2, 5, 130, 20000]) for c in codec.classes}}
+        if with_stats:
+            record["stats"] = {}
+            for c in codec.classes:
+                lo = rng.randrange(0, 10)
+                hi = lo + rng.randrange(0, 300)
+                record["stats"][c] = (lo, hi, round(rng.uniform(lo, hi), 1))
+        records.append(record)
+        dt += datetime.timedelta(seconds=rng.randrange(0, 4000))
+    return records
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 16383, 16384, 2 ** 32, 2 ** 63])
+def test_varint_roundtrip(value):
+    data = encode_varint(value, bytearray())
+    assert decode_varint(data, 0) == (value, len(data))
+
+
+@pytest.mark.parametrize("value, length", [(127, 1), (128, 2), (16383, 2), (16384, 3)])
+def test_varint_length_at_boundaries(value, length):
+    assert len(encode_varint(value, bytearray())) == length
+
+
+def test_varint_rejects_negative():
+    with pytest.raises(ValueError):
+        encode_varint(-1, bytearray())
+
+
+@pytest.mark.parametrize("time_mode", sorted(TIME_MODES))
+@pytest.mark.parametrize("with_stats", [False, True])
+def test_roundtrip(time_mode, with_stats):
+    rng = random.Random(0)
+    for _ in range(200):
+        codec = PayloadCodec(classes=CLASSES[:rng.randint(1, len(CLASSES))], time_mode=time_mode)
+        records = random_records(rng, codec, rng.randint(1, 6), with_stats)
+        sent_at = records[-1]["dt"] + datetime.timedelta(seconds=rng.randrange(0, 600))
+
+        decoded = codec.decode(codec.encode(records, sent_at=sent_at), received_at=sent_at)
+
+        assert len(decoded) == len(records)
+        for src, dst in zip(records, decoded):
+            assert dst["dt"] == (None if time_mode == "none" else src["dt"])
+            assert dst["counts"] == src["counts"]
+            if with_stats:
+                assert dst["stats"] == src["stats"]
+            else:
+                assert "stats" not in dst
+
+
+def test_age_without_received_at_is_relative_seconds():
+    codec = PayloadCodec(time_mode="age")
+    records = [{"dt": NOW, "counts": {"person": 1}},
+               {"dt": NOW + datetime.timedelta(seconds=60), "counts": {"person": 2}}]
+    decoded = codec.decode(codec.encode(records, sent_at=NOW + datetime.timedelta(seconds=90)))
+    assert [r["dt"] for r in decoded] == [-90, -30]
+
+
+def test_record_before_epoch_is_rejected():
+    codec = PayloadCodec(time_mode="epoch")
+    with pytest.raises(ValueError):
+        codec.encode([{"dt": codec.epoch - datetime.timedelta(seconds=1), "counts": {"person": 1}}])
+
+
+def test_unknown_time_mode_is_rejected():
+    with pytest.raises(ValueError):
+        PayloadCodec(time_mode="utc")
+
+
+def test_empty_records_are_rejected():
+    with pytest.raises(ValueError):
+        PayloadCodec().encode([])
+
+
+def test_window_stats_roundtrip():
+    aggregator = WindowAggregator(["person"], size=3)
+    for n in (1, 4, 2):
+        aggregator.add(NOW, {"person": n})
+    assert aggregator.full
+    record = aggregator.flush()
+    assert record["counts"] == {"person": 2}
+    assert record["stats"]["person"] == (1, 4, 7 / 3)
+    assert aggregator.samples == 0 and aggregator.flush() is None
+
+    codec = PayloadCodec(time_mode="epoch")
+    decoded, = codec.decode(codec.encode([record]))
+    # 平均は 0.1 単位に丸めて送る
+    assert decoded["stats"]["person"] == (1, 4, 2.3)
+
+
+def test_truncated_payload_is_rejected():
+    codec = PayloadCodec(classes=CLASSES, time_mode="epoch")
+    payload = codec.encode([{"dt": NOW, "counts": {"person": 300, "car": 2, "bicycle": 20000}}])
+    for end in range(1, len(payload)):
+        with pytest.raises(ValueError):
+            codec.decode(payload[:end])
+
+
+def test_empty_payload_is_rejected():
+    with pytest.raises(ValueError):
+        PayloadCodec().decode(b"")
+
+
+@pytest.mark.parametrize("version", [v for v in range(8) if v != PAYLOAD_VERSION])
+def test_unknown_version_is_rejected(version):
+    payload = PayloadCodec().encode([{"dt": NOW, "counts": {"person": 1}}])
+    with pytest.raises(ValueError, match="version"):
+        PayloadCodec().decode(bytes([(version << 5) | (payload[0] & 0x1F)]) + payload[1:])
+
+
+def test_unknown_time_mode_in_header_is_rejected():
+    payload = PayloadCodec().encode([{"dt": NOW, "counts": {"person": 1}}])
+    with pytest.raises(ValueError, match="time mode"):
+        PayloadCodec().decode(bytes([payload[0] | 0x18]) + payload[1:])
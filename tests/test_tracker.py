@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from app.tracker import MultiObjectTracker
+from benchmarks import tracker_bench
+
+IMAGE = np.zeros((360, 640, 3), dtype=np.uint8)
+
+
+def person(left, top=100):
+    return {"box": [left, top, 45, 110], "score": 0.9, "class_id": 0, "class_name": "person"}
+
+
+class _NoDetector:
+    """tracker_bench.run の推論の負荷を省く"""
+
+    def detect(self, image):
+        return []
+
+
+def test_reappearing_person_keeps_track_id():
+    tracker = MultiObjectTracker(detect_every=1, max_misses=1, min_hits=2, flow=False)
+    for index in range(5):
+        results = tracker.update(IMAGE, [person(100 + 5 * index)])
+    assert [r["track_id"] for r in results] == [1]
+
+    # 2フレーム隠れてトラックが消えた後、進んだ先に再び現れる
+    tracker.update(IMAGE, [])
+    tracker.update(IMAGE, [])
+    assert tracker.tracks == []
+    for index in range(7, 9):
+        results = tracker.update(IMAGE, [person(100 + 5 * index)])
+
+    assert [r["track_id"] for r in results] == [1]
+    assert tracker.visitors == {"person": 1}
+
+
+def test_distant_person_is_a_new_visitor():
+    tracker = MultiObjectTracker(detect_every=1, max_misses=1, min_hits=2, flow=False)
+    for index in range(5):
+        tracker.update(IMAGE, [person(100 + 5 * index)])
+    tracker.update(IMAGE, [])
+    tracker.update(IMAGE, [])
+    for _ in range(2):
+        results = tracker.update(IMAGE, [person(400, top=200)])
+
+    assert [r["track_id"] for r in results] != [1]
+    assert tracker.visitors == {"person": 2}
+
+
+@pytest.mark.parametrize("every", [1, 5, 10])
+def test_bench_scene_counts_each_person_once(every):
+    frames = 400
+    background, actors = tracker_bench.make_scene(6, frames)
+    _, tracker = tracker_bench.run(_NoDetector(), background, actors, frames, every, np.random.default_rng(1))
+
+    stats = tracker.stats()
+    assert stats["visitors"] == {"person": 6}
+    assert stats["crossings"]["center"] == tracker_bench.true_crossings(actors, frames)
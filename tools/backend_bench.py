@@ -0,0 +1,185 @@
+"""
+推論バックエンドの比較
+
+同じモデル・同じフレームを、バックエンド (app/backends.py) とスレッド数の組み合わせごとに推論し、
+1フレームあたりの処理時間 (p50/p95/p99)・invoke の平均・スループットと、
+基準 (最初の組み合わせ) の検出結果との一致度を表示する。
+一致度はクラスが同じで IoU が --iou 以上の検出を対応付けた F1 (2 × 一致数 / (基準の数 + 比較対象の数))。
+
+使い方:
+    python -m tools.backend_bench --model models/yolov8n_full_integer_quant.tflite --onnx models/yolov8n.onnx \\
+        --frames data/images --threads 1 2 4 --json data/logs/backend_bench.json
+    python -m tools.backend_bench --stub   # モデルなしの動作確認 (スタブはスレッド数を使わないので1行だけ)
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from app import YoloDetector
+from app.backends import BACKENDS, available_backends
+from app.tracker import greedy_match, iou_matrix
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_frames(source, count, size=(1280, 720)):
+    """
+    比較に使うフレームを読み込む (読み込み時間を計測に含めないよう先に全部メモリに置く)
+    :param source: 画像ディレクトリ・動画ファイル。None ならノイズ画像
+    """
+    if source is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8) for _ in range(count)]
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        frames = [cv2.imread(path) for path in paths[:count]]
+        return [frame for frame in frames if frame is not None]
+    video = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < count:
+        ok, frame = video.read()
+        if not ok:
+            break
+        frames.append(frame)
+    video.release()
+    return frames
+
+
+def agreement(reference, results, iou_threshold):
+    """
+    2つの検出結果の一致度
+    :return: (一致数, 基準の数, 比較対象の数, 一致した検出のスコア差の合計)
+    """
+    matched = 0
+    score_diff = 0.0
+    for class_id in {r["class_id"] for r in reference} | {r["class_id"] for r in results}:
+        a = [r for r in reference if r["class_id"] == class_id]
+        b = [r for r in results if r["class_id"] == class_id]
+        matches, _, _ = greedy_match(iou_matrix([r["box"] for r in a], [r["box"] for r in b]), iou_threshold)
+        matched += len(matches)
+        score_diff += sum(abs(a[i]["score"] - b[j]["score"]) for i, j in matches)
+    return matched, len(reference), len(results), score_diff
+
+
+def run(detector, frames, warmup):
+    """
+    全フレームを推論する
+    :return: (各フレームの結果, detect の時間 [秒] のリスト, invoke の時間の合計 [秒], invoke 回数)
+    """
+    interpreter = detector.interpreter
+    invoke = interpreter.invoke
+    invoke_time = [0.0, 0]
+
+    def _timed_invoke():
+        t0 = time.perf_counter()
+        invoke()
+        invoke_time[0] += time.perf_counter() - t0
+        invoke_time[1] += 1
+
+    for frame in frames[:warmup]:
+        detector.detect(frame)
+    interpreter.invoke = _timed_invoke
+    results, latencies = [], []
+    try:
+        for frame in frames:
+            t0 = time.perf_counter()
+            results.append(detector.detect(frame))
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        interpreter.invoke = invoke
+    return results, latencies, invoke_time[0], invoke_time[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference backend comparison")
+    parser.add_argument("--model", default="models/yolov8n_full_integer_quant.tflite",
+                        help="tflite / tflite-nodelegate で使うモデル")
+    parser.add_argument("--onnx", default=None,
+                        help="opencv / onnxruntime で使うモデル (.onnx)。省略時 opencv は --model を読む")
+    parser.add_argument("--backends", nargs="+", default=None, choices=BACKENDS,
+                        help="比較するバックエンド (省略時はこの環境で使えるもの全て)")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--input-size", type=int, nargs=2, default=None, metavar=("W", "H"),
+                        help="opencv で .onnx の入力サイズがグラフから読めない場合に指定する")
+    parser.add_argument("--frames", default=None, help="画像ディレクトリまたは動画 (省略時はノイズ画像)")
+    parser.add_argument("--count", type=int, default=50, help="使うフレーム数")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--iou", type=float, default=0.5, help="一致とみなすIoU")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存する")
+    parser.add_argument("--stub", action="store_true", help="モデルの代わりにスタブ推論を使う (動作確認用)")
+    args = parser.parse_args()
+
+    backends = args.backends or (["tflite"] if args.stub else available_backends())
+    if not args.onnx and not args.stub and "onnxruntime" in backends and not args.model.endswith(".onnx"):
+        print("Skipping onnxruntime: --onnx is not given")
+        backends = [b for b in backends if b != "onnxruntime"]
+    # スタブ推論はスレッド数に関係なく同じなので1回だけ測る
+    threads_list = args.threads[:1] if args.stub else args.threads
+    frames = load_frames(args.frames, args.count)
+    if not frames:
+        raise SystemExit(f"No frames loaded from {args.frames}")
+    print(f"{len(frames)} frames {frames[0].shape[1]}x{frames[0].shape[0]}, backends: {backends}, "
+          f"threads: {threads_list}")
+
+    print(f"{'backend':>18} {'threads':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'invoke ms':>9} "
+          f"{'fps':>7} {'detections':>10} {'agreement':>9} {'score diff':>10}")
+    reference = None
+    rows = []
+    for backend in backends:
+        model = args.onnx if backend in ("opencv", "onnxruntime") and args.onnx else args.model
+        for threads in threads_list:
+            try:
+                if args.stub:
+                    from benchmarks.stub_interpreter import StubInterpreter
+                    detector = YoloDetector(model_path=None, conf_threshold=args.conf,
+                                            interpreter=StubInterpreter(persons=(0, 3)))
+                else:
+                    detector = YoloDetector(model_path=model, num_threads=threads, conf_threshold=args.conf,
+                                            backend=backend, input_size=args.input_size)
+            except Exception as e:
+                print(f"{backend:>18} {threads:>7d} failed to load: {e}")
+                continue
+
+            results, latencies, invoke_total, invokes = run(detector, frames, args.warmup)
+            elapsed = sum(latencies)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+
+            if reference is None:
+                reference = results
+            matched = expected = found = 0
+            score_diff = 0.0
+            for ref, res in zip(reference, results):
+                m, e, f, d = agreement(ref, res, args.iou)
+                matched, expected, found, score_diff = matched + m, expected + e, found + f, score_diff + d
+            f1 = 2 * matched / (expected + found) if expected + found else 1.0
+            mean_diff = score_diff / matched if matched else 0.0
+
+            row = {
+                "backend": backend, "threads": threads, "model": os.path.basename(model) if model else "stub",
+                "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                "invoke_ms": invoke_total / invokes * 1000 if invokes else None,
+                "fps": len(frames) / elapsed, "detections": found, "agreement": f1, "score_diff": mean_diff,
+            }
+            rows.append(row)
+            print(f"{backend:>18} {threads:>7d} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} "
+                  f"{row['invoke_ms'] or 0:>9.1f} {row['fps']:>7.1f} {found:>10d} {f1:>9.3f} {mean_diff:>10.4f}")
+
+    if rows:
+        fastest = min(rows, key=lambda r: r["p50_ms"])
+        print(f"Fastest: {fastest['backend']} x{fastest['threads']} ({fastest['p50_ms']:.1f} ms p50, "
+              f"agreement {fastest['agreement']:.3f})")
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump({"frames": len(frames), "source": args.frames, "results": rows}, f, indent=2)
+        print(f"Saved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
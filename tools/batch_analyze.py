@@ -0,0 +1,235 @@
+"""
+録画・保存画像のオフライン一括再解析
+
+動画ファイルまたは画像ディレクトリを一定フレーム数のチャンクに分け、プロセスプールで並列に推論する。
+各ワーカーは自分の YoloDetector (TFLiteインタプリタ) を持ち、結果はメインプロセスで
+元のフレーム順に LoggerHandler へ書き込む (logAll.csv / logPerson.csv と同じ形式)。
+書き込み済みのチャンクは進捗ファイルに記録し、中断しても --resume で続きから再開できる。
+
+使い方:
+    python -m tools.batch_analyze data/record.mp4 --start 2025-01-01T09:00:00 --every 60 --out data/reanalysis
+    python -m tools.batch_analyze data/images --conf 0.3 --workers 4 --resume
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from app import LoggerHandler, YoloDetector
+
+MODEL_PATH = "models/yolov8n_full_integer_quant.tflite"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+_detector = None
+
+
+# ----------------------------------------------------------------------
+# ワーカー
+# ----------------------------------------------------------------------
+def _init_worker(detector_options, stub):
+    global _detector
+    # 並列化はプロセス単位で行うため、OpenCVのスレッドは使わない
+    cv2.setNumThreads(1)
+    if stub:
+        from benchmarks.stub_interpreter import StubInterpreter
+        _detector = YoloDetector(model_path=None, interpreter=StubInterpreter(persons=(0, 3)), **detector_options)
+    else:
+        _detector = YoloDetector(**detector_options)
+
+
+def _analyze_chunk(task):
+    """
+    1チャンク分のフレームを推論する
+    :param task: (source, chunk番号, [(フレーム番号 or ファイルパス, 日時), ...])
+    :return: (source, chunk番号, [(日時, 検出結果), ...], 推論にかかった時間)
+    """
+    source, chunk, frames = task
+    t0 = time.perf_counter()
+    results = []
+    if os.path.isdir(source):
+        for path, dt in frames:
+            image = cv2.imread(path)
+            results.append((dt, _detector.detect(image) if image is not None else []))
+    else:
+        video = cv2.VideoCapture(source)
+        position = frames[0][0]
+        video.set(cv2.CAP_PROP_POS_FRAMES, position)
+        for index, dt in frames:
+            # チャンク内は先頭から順に読み、間引いたフレームは grab だけで飛ばす
+            while position < index:
+                video.grab()
+                position += 1
+            ok, image = video.read()
+            position += 1
+            results.append((dt, _detector.detect(image) if ok else []))
+        video.release()
+    return source, chunk, results, time.perf_counter() - t0
+
+
+# ----------------------------------------------------------------------
+# タスク作成
+# ----------------------------------------------------------------------
+def list_frames(source, start=None, every=0.0):
+    """
+    解析するフレームと撮影日時の一覧
+    :param start: 動画の先頭フレームの日時 (省略時はファイルの更新時刻)
+    :param every: 間引き間隔 [秒] (動画のみ。0 なら全フレーム)
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        # 画像の撮影日時はファイルの更新時刻とする
+        return [(path, datetime.datetime.fromtimestamp(os.path.getmtime(path)).replace(microsecond=0))
+                for path in paths]
+
+    video = cv2.VideoCapture(source)
+    if not video.isOpened():
+        raise ValueError(f"Could not open video: {source}")
+    fps = video.get(cv2.CAP_PROP_FPS) or 30.0
+    total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    if start is None:
+        start = datetime.datetime.fromtimestamp(os.path.getmtime(source)) - datetime.timedelta(seconds=total / fps)
+    step = max(1, round(every * fps)) if every else 1
+    return [(index, (start + datetime.timedelta(seconds=index / fps)).replace(microsecond=0))
+            for index in range(0, total, step)]
+
+
+def make_tasks(source, frames, chunk_size, first_chunk=0):
+    for chunk, offset in enumerate(range(0, len(frames), chunk_size)):
+        if chunk >= first_chunk:
+            yield source, chunk, frames[offset:offset + chunk_size]
+
+
+# ----------------------------------------------------------------------
+# 進捗
+# ----------------------------------------------------------------------
+class Progress:
+    """ソースごとに書き込み済みのチャンク数を記録する"""
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("fingerprint") != fingerprint:
+                print(f"Warning: {path} was written with different settings: {data.get('fingerprint')}")
+            self.done = data.get("done", {})
+
+    def next_chunk(self, source):
+        return self.done.get(source, 0)
+
+    def mark(self, source, chunk):
+        self.done[source] = chunk + 1
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "done": self.done}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+# ----------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch re-analysis")
+    parser.add_argument("sources", nargs="+", help="動画ファイルまたは画像ディレクトリ")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--config", default=None, help="Detection セクションを読む設定ファイル (config.json)")
+    parser.add_argument("--conf", type=float, default=None, help="CONF_THRESHOLD (設定ファイルより優先)")
+    parser.add_argument("--classes", nargs="*", default=None)
+    parser.add_argument("--out", default="data/reanalysis", help="ログの出力先ディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=1, help="ワーカーごとのインタプリタのスレッド数")
+    parser.add_argument("--chunk", type=int, default=32, help="1タスクあたりのフレーム数")
+    parser.add_argument("--start", default=None, help="動画の先頭フレームの日時 (ISO形式)")
+    parser.add_argument("--every", type=float, default=0.0, help="動画を何秒ごとに解析するか (0 なら全フレーム)")
+    parser.add_argument("--resume", action="store_true", help="進捗ファイルから再開する")
+    parser.add_argument("--overwrite", action="store_true", help="出力先の既存ログを消してやり直す")
+    parser.add_argument("--stub", action="store_true", help="モデルの代わりにスタブ推論を使う (動作確認用)")
+    args = parser.parse_args()
+
+    detection = {}
+    if args.config:
+        with open(args.config) as f:
+            detection = json.load(f).get("Detection", {})
+    conf = args.conf if args.conf is not None else detection.get("CONF_THRESHOLD", 0.4)
+    classes = args.classes if args.classes is not None else detection.get("Classes", None)
+    tile_size = detection.get("TileSize", None)
+    detector_options = {
+        "conf_threshold": conf,
+        "classes": classes or None,
+        "rois": detection.get("ROIs", []),
+        "tiled": bool(detection.get("Tiled", 0)),
+        "tile_size": tuple(tile_size) if tile_size else None,
+        "tile_overlap": detection.get("TileOverlap", 0.2),
+    }
+    if not args.stub:
+        detector_options.update(model_path=args.model, num_threads=args.threads)
+    # 進捗ファイルと比較するため、JSONに保存したときと同じ形にしておく
+    fingerprint = json.loads(json.dumps({"model": "stub" if args.stub else os.path.abspath(args.model),
+                                         **detector_options}))
+
+    os.makedirs(args.out, exist_ok=True)
+    progress_path = os.path.join(args.out, "progress.json")
+    if not args.resume:
+        existing = [name for name in ("logAll.csv", "logPerson.csv", "progress.json")
+                    if os.path.exists(os.path.join(args.out, name))]
+        if existing and not args.overwrite:
+            raise SystemExit(f"{args.out} already contains {existing}. Use --resume or --overwrite.")
+        for name in existing:
+            os.remove(os.path.join(args.out, name))
+    progress = Progress(progress_path, fingerprint)
+    # 並び順どおりに書き込むので、時刻で退避はしない
+    logger = LoggerHandler(log_dir=args.out, flush_rows=256, fsync_interval=None, rotate="none", compress=False)
+
+    start = datetime.datetime.fromisoformat(args.start) if args.start else None
+    tasks = []
+    total_frames = 0
+    for source in args.sources:
+        source = os.path.abspath(source)
+        frames = list_frames(source, start, args.every)
+        first = progress.next_chunk(source)
+        pending = list(make_tasks(source, frames, args.chunk, first))
+        tasks.extend(pending)
+        total_frames += sum(len(t[2]) for t in pending)
+        print(f"{source}: {len(frames)} frames, resuming at chunk {first}" if first else f"{source}: {len(frames)} frames")
+
+    print(f"Analyzing {total_frames} frames with {args.workers} worker(s)...")
+    done_frames = 0
+    busy = 0.0
+    t0 = time.perf_counter()
+    last_report = t0
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.workers, initializer=_init_worker, initargs=(detector_options, args.stub)) as pool:
+        # imap は投入順に結果を返すので、ログは元のフレーム順になる
+        for source, chunk, results, elapsed in pool.imap(_analyze_chunk, tasks):
+            for dt, detections in results:
+                logger.save(dt, detections)
+            logger.flush()
+            progress.mark(source, chunk)
+
+            done_frames += len(results)
+            busy += elapsed
+            now = time.perf_counter()
+            if now - last_report >= 5.0:
+                last_report = now
+                fps = done_frames / (now - t0)
+                print(f"  {done_frames}/{total_frames} frames, {fps:.1f} fps ({fps / args.workers:.1f} fps/core)")
+
+    logger.close()
+    elapsed = time.perf_counter() - t0
+    fps = done_frames / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {done_frames} frames in {elapsed:.1f} s")
+    print(f"Throughput: {fps:.1f} fps total, {fps / args.workers:.1f} fps/core "
+          f"({done_frames / busy if busy else 0.0:.1f} fps per busy worker)")
+    print(f"Logs: {os.path.abspath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
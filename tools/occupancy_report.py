@@ -0,0 +1,376 @@
+"""
+CSVログ (Date,Time,Class,Count[,CarriedOver]) からの在室人数レポート
+
+logPerson.csv / logAll.csv とローテーションで退避したファイル (logPerson.2025-01-01.csv[.gz]) を
+一定バイト数ずつ読み、NumPy の配列演算で解析して
+  - hourly.csv:       1時間ごとの平均・最大人数
+  - daily.csv:        1日ごとの平均・最大人数と、平均が最も多かった時間帯
+  - weekday_hour.csv: 曜日 × 時間帯ごとの平均・最大人数
+  - totals.csv:       クラスごとの期間全体の集計 (count_sum は各周期の人数の合計 = 人 × 周期)
+を出力する (--json で同じ内容をJSONにも出力)。
+平均はログの行に対して取る。logPerson.csv は検出0人の周期も記録されるので在室人数の平均になるが、
+logAll.csv は検出された周期だけが記録されるため、平均は「いた周期の平均人数」になる。
+
+大きなファイルは改行位置で分割し、複数のファイル・端末 (ディレクトリ) とあわせてプロセスに振り分ける。
+各プロセスは (端末, クラス, 時刻[時]) ごとの合計・行数・最大だけを返し、メインプロセスで統合する。
+
+使い方:
+    python -m tools.occupancy_report data/logs --out data/reports
+    python -m tools.occupancy_report cam1=/mnt/cam1/logs cam2=/mnt/cam2/logs --log all \\
+        --start 2025-01-01 --end 2025-04-01 --workers 4 --json data/reports/summary.json
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+CHUNK_BYTES = 8 * 1024 * 1024
+SPLIT_BYTES = 64 * 1024 * 1024
+CLASS_WIDTH = 16  # COCOのクラス名は最長14文字
+COUNT_WIDTH = 7
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+# ----------------------------------------------------------------------
+# 解析
+# ----------------------------------------------------------------------
+def days_from_civil(year, month, day):
+    """グレゴリオ暦の日付 -> 1970-01-01 からの日数 (配列のまま計算する)"""
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _number(arr, positions, lengths, width):
+    """
+    各行の positions から lengths 桁の10進数を読む (列ごとにまとめて読むので行数ぶんのループはない)
+    :return: (値 int64, 全て数字だったか)
+    """
+    value = np.zeros(len(positions), dtype=np.int64)
+    ok = np.ones(len(positions), dtype=bool)
+    for k in range(width):
+        active = np.asarray(k < lengths)
+        digit = arr[positions + k].astype(np.int64) - 48
+        ok &= ~active | ((digit >= 0) & (digit <= 9))
+        value = np.where(active, value * 10 + digit, value)
+    return value, ok
+
+
+def _class_names(arr, positions, lengths):
+    """
+    各行のクラス名 -> (クラス番号, クラス名のリスト)
+    名前を 8 byte ずつ2つの整数にして比べる (文字列のソートより速い。クラスは数種類なので種類ごとに比較する)
+    """
+    words = np.zeros((2, len(positions)), dtype=np.uint64)
+    for k in range(CLASS_WIDTH):
+        byte = arr[positions + k].astype(np.uint64) * (k < lengths)
+        words[k // 8] |= byte << np.uint64(8 * (k % 8))
+    class_ids = np.full(len(positions), -1, dtype=np.int64)
+    names = []
+    remaining = np.arange(len(positions))
+    while len(remaining):
+        first = remaining[0]
+        same = (words[0, remaining] == words[0, first]) & (words[1, remaining] == words[1, first])
+        class_ids[remaining[same]] = len(names)
+        names.append(bytes(arr[positions[first]:positions[first] + lengths[first]]).decode(errors="replace"))
+        remaining = remaining[~same]
+    return class_ids, names
+
+
+def parse_chunk(buf):
+    """
+    改行で終わるバイト列を解析する
+    ヘッダ行・壊れた行は読み飛ばす
+    :return: (時刻 [1970-01-01 からの秒] int64, クラス番号, クラス名のリスト, 人数 int64)
+    """
+    # 行末を越えて読んでもよいように余白を付ける
+    arr = np.frombuffer(buf + bytes(CLASS_WIDTH + COUNT_WIDTH), dtype=np.uint8)
+    newlines = np.flatnonzero(arr[:len(buf)] == 10)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    ends = newlines - (arr[np.maximum(newlines - 1, 0)] == 13)  # CRLF
+
+    # "YYYY-MM-DD,HH:MM:SS,<class>,<count>[,<carried_over>]" の固定位置を確認する
+    ok = ends - starts >= 23
+    starts, ends = starts[ok], ends[ok]
+    ok = ((arr[starts + 4] == 45) & (arr[starts + 7] == 45) & (arr[starts + 10] == 44)
+          & (arr[starts + 13] == 58) & (arr[starts + 16] == 58) & (arr[starts + 19] == 44))
+    starts, ends = starts[ok], ends[ok]
+
+    # クラス名の終わり (クラス名の後のカンマ)
+    commas = np.flatnonzero(arr == 44)
+    index = np.searchsorted(commas, starts + 20)
+    ok = index < len(commas)
+    starts, ends, index = starts[ok], ends[ok], index[ok]
+    class_ends = commas[index]
+    class_lengths = class_ends - (starts + 20)
+    # 人数の終わり (次のカンマがその行にあればそこまで。CarriedOver 列のない以前の形式は行末まで)
+    following = commas[np.minimum(index + 1, len(commas) - 1)]
+    count_ends = np.where((index + 1 < len(commas)) & (following < ends), following, ends)
+    count_lengths = count_ends - class_ends - 1
+    ok = ((class_lengths > 0) & (class_lengths <= CLASS_WIDTH)
+          & (count_lengths > 0) & (count_lengths <= COUNT_WIDTH))
+    starts, class_ends, class_lengths, count_lengths = starts[ok], class_ends[ok], class_lengths[ok], count_lengths[ok]
+
+    # 人数・日時
+    counts, ok = _number(arr, class_ends + 1, count_lengths, COUNT_WIDTH)
+    fields = []
+    for offset, width in ((0, 4), (5, 2), (8, 2), (11, 2), (14, 2), (17, 2)):
+        value, valid = _number(arr, starts + offset, width, width)
+        fields.append(value)
+        ok &= valid
+    year, month, day, hour, minute, second = fields
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60) & (second < 61)
+    ts = days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+
+    class_ids, names = _class_names(arr, starts[ok] + 20, class_lengths[ok])
+    return ts[ok], class_ids, names, counts[ok]
+
+
+def reduce_groups(keys, sums, samples, maxima):
+    """同じキーの (合計, 行数, 最大) をまとめる -> キーの昇順"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    out_max = np.full(len(unique), -1, dtype=np.int64)
+    np.maximum.at(out_max, inverse, maxima)
+    return (unique,
+            np.bincount(inverse, weights=sums, minlength=len(unique)).astype(np.int64),
+            np.bincount(inverse, weights=samples, minlength=len(unique)).astype(np.int64),
+            out_max)
+
+
+def iter_chunks(path, start=0, end=None, chunk_bytes=CHUNK_BYTES):
+    """ファイルの [start, end) を改行で終わるバイト列に分けて返す (start, end は行の先頭であること)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start
+        rest = b""
+        while remaining is None or remaining > 0:
+            size = chunk_bytes if remaining is None else min(chunk_bytes, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                yield data[:cut]
+        if rest:
+            yield rest + b"\n"
+
+
+def analyze_task(task):
+    """
+    1タスク (ファイルの一部) を集計する
+    :param task: (端末名, パス, 開始位置, 終了位置, 期間の開始 [秒] or None, 期間の終了 [秒] or None, chunk_bytes)
+    :return: (端末名, クラス名のリスト, キー (クラス番号 << 32 | 時刻[時]), 合計, 行数, 最大, 行数)
+    """
+    device, path, start, end, since, until, chunk_bytes = task
+    class_index = {}
+    parts = []
+    rows = 0
+    for buf in iter_chunks(path, start, end, chunk_bytes):
+        ts, class_ids, names, counts = parse_chunk(buf)
+        rows += len(ts)
+        if since is not None or until is not None:
+            keep = np.ones(len(ts), dtype=bool)
+            if since is not None:
+                keep &= ts >= since
+            if until is not None:
+                keep &= ts < until
+            ts, class_ids, counts = ts[keep], class_ids[keep], counts[keep]
+        if not len(ts):
+            continue
+        # チャンクごとのクラス番号をタスク内の番号に揃える
+        mapping = np.array([class_index.setdefault(name, len(class_index)) for name in names], dtype=np.int64)
+        keys = (mapping[class_ids] << 32) | (ts // 3600)
+        parts.append(reduce_groups(keys, counts, np.ones(len(ts), dtype=np.int64), counts))
+        if len(parts) >= 16:
+            parts = [reduce_groups(*(np.concatenate(p) for p in zip(*parts)))]
+    if parts:
+        keys, sums, samples, maxima = reduce_groups(*(np.concatenate(p) for p in zip(*parts)))
+    else:
+        keys = sums = samples = maxima = np.empty(0, dtype=np.int64)
+    return device, list(class_index), keys, sums, samples, maxima, rows
+
+
+# ----------------------------------------------------------------------
+# タスク作成
+# ----------------------------------------------------------------------
+def find_logs(path, log="person"):
+    """ディレクトリ内の対象ログ (退避・圧縮したものを含む)。ファイルを指定したらそのまま"""
+    if os.path.isfile(path):
+        return [path]
+    prefix = "logPerson" if log == "person" else "logAll"
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.startswith(prefix) and (name.endswith(".csv") or name.endswith(".csv.gz")))
+
+
+def split_file(path, split_bytes=SPLIT_BYTES):
+    """大きな非圧縮ファイルを行の境目で [(開始, 終了), ...] に分ける"""
+    size = os.path.getsize(path)
+    if path.endswith(".gz") or size <= split_bytes:
+        return [(0, None)]
+    bounds = [0]
+    with open(path, "rb") as f:
+        for offset in range(split_bytes, size, split_bytes):
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def make_tasks(sources, log="person", since=None, until=None, split_bytes=SPLIT_BYTES, chunk_bytes=CHUNK_BYTES):
+    """
+    :param sources: ["ディレクトリ or ファイル", "端末名=ディレクトリ", ...]
+    """
+    tasks = []
+    for source in sources:
+        device, _, path = source.rpartition("=")
+        path = os.path.abspath(path)
+        device = device or os.path.basename(path.rstrip("/")) or path
+        for file_path in find_logs(path, log):
+            for start, end in split_file(file_path, split_bytes):
+                tasks.append((device, file_path, start, end, since, until, chunk_bytes))
+    # 大きいものから投入して、最後に1プロセスだけ残るのを避ける
+    tasks.sort(key=lambda t: -((t[3] or os.path.getsize(t[1])) - t[2]))
+    return tasks
+
+
+# ----------------------------------------------------------------------
+# 集計
+# ----------------------------------------------------------------------
+def run_report(tasks, workers=1):
+    """
+    全タスクを集計する
+    :return: ({(端末名, クラス名): (時刻[時], 合計, 行数, 最大)}, 読んだ行数)
+    """
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            results = list(pool.imap_unordered(analyze_task, tasks))
+    else:
+        results = [analyze_task(task) for task in tasks]
+
+    grouped = {}
+    total_rows = 0
+    for device, names, keys, sums, samples, maxima, rows in results:
+        total_rows += rows
+        class_ids = keys >> 32
+        hours = keys & 0xFFFFFFFF
+        for index, name in enumerate(names):
+            sel = class_ids == index
+            grouped.setdefault((device, name), []).append((hours[sel], sums[sel], samples[sel], maxima[sel]))
+    series = {key: reduce_groups(*(np.concatenate(p) for p in zip(*parts))) for key, parts in grouped.items()}
+    return series, total_rows
+
+
+def _hour_label(hour):
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(hours=int(hour))).strftime("%Y-%m-%d %H:00")
+
+
+def summarize(series):
+    """時間・日・曜日×時間帯・全体の表 (行の辞書のリスト) を作る"""
+    hourly, daily, weekday_hour, totals = [], [], [], []
+    for (device, name), (hours, sums, samples, maxima) in sorted(series.items()):
+        means = sums / samples
+        for h, n, mean, peak in zip(hours, samples, means, maxima):
+            hourly.append({"device": device, "class": name, "hour": _hour_label(h),
+                           "samples": int(n), "mean": round(float(mean), 3), "max": int(peak)})
+
+        days = hours // 24
+        day_keys, day_sums, day_samples, day_max = reduce_groups(days, sums, samples, maxima)
+        # 平均が最も多かった時間帯 (時刻順に並んでいるので、日ごとに最大の平均の最初の時間)
+        order = np.lexsort((-means, days))
+        first = np.concatenate(([True], days[order][1:] != days[order][:-1]))
+        peak_hours = hours[order][first] % 24
+        for d, s, n, peak, peak_hour in zip(day_keys, day_sums, day_samples, day_max, peak_hours):
+            date = datetime.date(1970, 1, 1) + datetime.timedelta(days=int(d))
+            daily.append({"device": device, "class": name, "date": date.isoformat(), "samples": int(n),
+                          "mean": round(s / n, 3), "max": int(peak), "peak_hour": int(peak_hour)})
+
+        weekday = (days + 3) % 7  # 1970-01-01 は木曜日
+        slot_keys, slot_sums, slot_samples, slot_max = reduce_groups(weekday * 24 + hours % 24, sums, samples, maxima)
+        for k, s, n, peak in zip(slot_keys, slot_sums, slot_samples, slot_max):
+            weekday_hour.append({"device": device, "class": name, "weekday": WEEKDAYS[k // 24], "hour": int(k % 24),
+                                 "samples": int(n), "mean": round(s / n, 3), "max": int(peak)})
+
+        total_samples = int(samples.sum())
+        totals.append({"device": device, "class": name, "first": _hour_label(hours[0]),
+                       "last": _hour_label(hours[-1]), "samples": total_samples, "count_sum": int(sums.sum()),
+                       "mean": round(float(sums.sum()) / total_samples, 3), "max": int(maxima.max()),
+                       "peak_hour": _hour_label(hours[np.argmax(means)])})
+    return {"hourly": hourly, "daily": daily, "weekday_hour": weekday_hour, "totals": totals}
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        if not rows:
+            return
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _to_seconds(text):
+    """ISO形式の日付・日時 -> 1970-01-01 からの秒 (ログと同じくローカル時刻のまま扱う)"""
+    if text is None:
+        return None
+    return int((datetime.datetime.fromisoformat(text) - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Occupancy report from CSV logs")
+    parser.add_argument("sources", nargs="+", help="ログのディレクトリ・ファイル (端末名=パス で名前を付けられる)")
+    parser.add_argument("--log", choices=["person", "all"], default="person", help="logPerson.csv / logAll.csv")
+    parser.add_argument("--start", default=None, help="集計期間の開始 (ISO形式。この日時を含む)")
+    parser.add_argument("--end", default=None, help="集計期間の終了 (ISO形式。この日時を含まない)")
+    parser.add_argument("--out", default="data/reports", help="CSVの出力先ディレクトリ")
+    parser.add_argument("--json", default=None, help="同じ内容をJSONで保存する")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--split-mb", type=int, default=SPLIT_BYTES // (1024 * 1024),
+                        help="これより大きいファイルは分割して並列に読む [MB]")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    tasks = make_tasks(args.sources, args.log, _to_seconds(args.start), _to_seconds(args.end),
+                       split_bytes=args.split_mb * 1024 * 1024)
+    if not tasks:
+        raise SystemExit(f"No log files found in {args.sources}")
+    series, rows = run_report(tasks, args.workers)
+    report = summarize(series)
+    elapsed = time.perf_counter() - t0
+
+    os.makedirs(args.out, exist_ok=True)
+    for name, table in report.items():
+        write_csv(os.path.join(args.out, f"{name}.csv"), table)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"Read {rows} rows from {len({t[1] for t in tasks})} file(s) in {len(tasks)} task(s) "
+          f"in {elapsed:.1f} sec ({rows / elapsed:,.0f} rows/sec)")
+    for row in report["totals"]:
+        print(f" - {row['device']} {row['class']}: {row['first']} - {row['last']}, mean {row['mean']}, "
+              f"max {row['max']} (peak hour {row['peak_hour']})")
+    print(f"Saved: {args.out}/{{hourly,daily,weekday_hour,totals}}.csv")
+
+
+if __name__ == "__main__":
+    main()